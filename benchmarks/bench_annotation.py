@@ -0,0 +1,84 @@
+"""
+Sanitizer and paginator throughput on large author bios, against the previous strip-tags + split_text pipeline.
+
+Run from the repository root: python benchmarks/bench_annotation.py [--output FILE] [--compare FILE]
+"""
+import re
+import sys
+
+from harness import SOURCE, measure, report
+
+sys.path.insert(0, SOURCE)
+
+from sanitizer import sanitize, split_pages  # noqa: E402
+
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+PARAGRAPH = (
+    "<p>Родился в семье <b>инженера</b> &amp; учительницы. В 1921 г. переехал в Москву, "
+    "где работал в редакции журнала &laquo;Красная новь&raquo;!<br/>"
+    "[b]Первая книга[/b] вышла в 1925 году &mdash; <i>сборник рассказов</i>, тираж 3 < 5 тыс.</p>\n\n\n"
+    "<p>Много путешествовал: Кавказ, Крым, Средняя Азия. Из поездок привозил записные книжки, которые потом "
+    "становились повестями и очерками. Современники вспоминали его как человека спокойного и внимательного, "
+    "который умел слушать и почти никогда не спорил. В годы войны был военным корреспондентом, дошёл до Берлина. "
+    "После войны преподавал в Литературном институте, переводил с украинского и белорусского.</p>\n"
+    "<div class=\"note\">Примечание: <a href=\"http://example.com\">источник</a>; <em>цитата</em>?</div>\n"
+)
+
+
+def make_bio(size: int) -> str:
+    return PARAGRAPH * (size // len(PARAGRAPH) + 1)
+
+
+def split_text(text: str):
+    # the pre-sanitizer paginator from utils.py
+    parts = []
+    i = 0
+    while True:
+        if i + 2048 > len(text):
+            parts.append(text[i:len(text) + 1])
+            break
+        new_i = max(text.rfind(".", i, i + 2048), text.rfind("!", i, i + 2048), text.rfind("?", i, i + 2048))
+        if new_i == -1:
+            new_i = text.rfind("\n", i, i + 2048)
+        if new_i == -1:
+            new_i = min(i + 2048, len(text))
+        if new_i == i or new_i == -1:
+            break
+        parts.append(text[i:new_i + 1])
+        i = new_i
+    return parts
+
+
+def old_pipeline(text: str):
+    body = TAG_RE.sub('', text).replace("[b]", "").replace("[/b]", "").replace("\n\n\n", "\n\n")
+    return split_text(body)
+
+
+def main():
+    results = {}
+    for size_kb in (10, 100, 500):
+        bio = make_bio(size_kb * 1024)
+        results[f"old_strip_split_{size_kb}kb"] = measure(lambda: old_pipeline(bio))
+        results[f"sanitize_{size_kb}kb"] = measure(lambda: sanitize(bio))
+        results[f"sanitize_paginate_{size_kb}kb"] = measure(lambda: split_pages(bio, 2048))
+        results[f"sanitize_paginate_{size_kb}kb"]["mb_per_s"] = round(
+            len(bio.encode()) / results[f"sanitize_paginate_{size_kb}kb"]["us_per_op"], 2
+        )
+    # one long text token: throughput must not drop as the input grows
+    sentence = "Много путешествовал по Кавказу и Крыму, писал очерки и повести & переводил. "
+    for size_kb in (256, 1024, 2048):
+        text = sentence * (size_kb * 1024 // len(sentence) + 1)
+        name = f"paginate_plain_{size_kb}kb"
+        results[name] = measure(lambda: split_pages(text, 2048))
+        results[name]["mb_per_s"] = round(len(text.encode()) / results[name]["us_per_op"], 2)
+    # text that more than doubles when escaped, used to fail with "Page limit is too small"
+    for name, text in (("ampersand_words", "A&B " * 1000), ("angle_brackets", "<<>> " * 1000),
+                       ("ampersands", "&" * 3000)):
+        results[f"paginate_escaped_{name}"] = measure(lambda: split_pages(text, 2048))
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Rendering and text utilities on the CPU hot path, on large synthetic payloads.
+
+Run from the repository root: python benchmarks/bench_render.py [--output FILE] [--compare FILE]
+"""
+import random
+
+from harness import setup_source, measure, report
+
+setup_source()
+
+from flibusta_server import BookWithAuthorsAndSequences, BookAnnotation, AuthorAnnotation  # noqa
+from send import build_keyboard, get_keyboard, normalize  # noqa
+
+
+FIRST_NAMES = ["Александр", "Фёдор", "Лев", "Анна", "Марина", "Сергей", "Иван", "Ольга"]
+LAST_NAMES = ["Пушкин", "Достоевский", "Толстой", "Ахматова", "Цветаева", "Есенин", "Бунин", "Берггольц"]
+MIDDLE_NAMES = ["Сергеевич", "Михайлович", "Николаевич", "Андреевна", "Ивановна", ""]
+WORDS = ["война", "мир", "преступление", "наказание", "братья", "идиот", "бесы", "повесть", "о", "времени"]
+
+
+def person(i: int) -> dict:
+    return {
+        "id": i,
+        "first_name": random.choice(FIRST_NAMES),
+        "last_name": random.choice(LAST_NAMES),
+        "middle_name": random.choice(MIDDLE_NAMES),
+        "annotation_exists": True,
+    }
+
+
+def book(authors: int, translators: int, sequences: int) -> dict:
+    return {
+        "id": 123456,
+        "title": " ".join(random.choice(WORDS) for _ in range(12)).capitalize() + " — «том 1»: №2",
+        "lang": "ru",
+        "file_type": "fb2",
+        "annotation_exists": True,
+        "authors": [person(i) for i in range(authors)],
+        "translators": [person(i) for i in range(translators)],
+        "sequences": [{"id": i, "name": "Серия " + random.choice(WORDS)} for i in range(sequences)],
+    }
+
+
+def annotation(size: int) -> dict:
+    sentences = []
+    length = 0
+    while length < size:
+        sentence = " ".join(random.choice(WORDS) for _ in range(random.randint(5, 25))).capitalize()
+        sentence = f"<p>{sentence}{random.choice('.!?')}</p>" if random.random() < 0.3 else \
+            f"[b]{sentence}[/b]{random.choice('.!?')}\n\n\n"
+        sentences.append(sentence)
+        length += len(sentence)
+    return {"book_id": 1, "author_id": 1, "title": "", "body": " ".join(sentences), "file": None}
+
+
+def main():
+    random.seed(0)
+    small = BookWithAuthorsAndSequences(book(authors=2, translators=1, sequences=1))
+    huge = BookWithAuthorsAndSequences(book(authors=150, translators=20, sequences=10))
+    book_annotation = BookAnnotation(annotation(20_000))
+    author_annotation = AuthorAnnotation(annotation(300_000))
+
+    results = {
+        "to_send_book_small": measure(lambda: small.to_send_book),
+        "to_send_book_huge": measure(lambda: huge.to_send_book),
+        "caption_small": measure(lambda: small.caption),
+        "caption_huge": measure(lambda: huge.caption),
+        "to_send_book_detail_huge": measure(lambda: huge.to_send_book_detail),
+        "get_keyboard": measure(lambda: get_keyboard(7, 30, "b")),
+        "get_keyboard_annotation": measure(lambda: get_keyboard(2, 40, "a_ann_12345", only_one=True)),
+        "build_keyboard_uncached": measure(lambda: build_keyboard(7, 30, "b").as_json()),
+        "normalize_small": measure(lambda: normalize(small, "epub")),
+        "normalize_huge": measure(lambda: normalize(huge, "epub")),
+        "author_annotation_pages_300kb": measure(lambda: author_annotation.pages(2048)),
+        "book_annotation_body_20kb": measure(lambda: book_annotation.body),
+        "author_annotation_body_300kb": measure(lambda: author_annotation.body),
+    }
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compares the compiled Router with the previous chain of per-handler regexp filters.
+
+Run from the repository root: python benchmarks/bench_router.py [--output FILE] [--compare FILE]
+"""
+import re
+import sys
+from datetime import date
+
+from harness import SOURCE, measure_async, report
+
+sys.path.insert(0, SOURCE)
+
+from router import Router  # noqa: E402
+
+
+COMMANDS = ["start", "help", "commands", "info", "settings", "beta_functions", "random_book",
+            "random_author", "random_series", "donate", "update_log"]
+
+MESSAGE_PATTERNS = [
+    (r"/a_([0-9]+)$", (int,)),
+    (r"/s_([0-9]+)$", (int,)),
+    (r"/(fb2|fb2\+zip|epub|mobi|djvu|pdf|doc)_([0-9]+)$", (str, int)),
+    (r"/b_info_([0-9]+)$", (int,)),
+    (r"/a_info_([0-9]+)$", (int,)),
+]
+
+CALLBACK_PATTERNS = [
+    (r"settings_main$", ()),
+    (r"langs_settings$", ()),
+    (r"(ru|uk|be)_(on|off)$", (str, str)),
+    (r"beta_testing$", ()),
+    (r"beta_test_(on|off)$", (str,)),
+    (r"download_c_([0-9]+)$", (int,)),
+    (r"download_c_(fb2|fb2\+zip|epub|mobi)_([0-9]+)$", (str, int)),
+    (r"b_([0-9]+)", (int,)),
+    (r"a_([0-9]+)", (int,)),
+    (r"s_([0-9]+)", (int,)),
+    (r"ba_([0-9]+)", (int,)),
+    (r"bs_([0-9]+)", (int,)),
+    (r"b_ann_([0-9]+)_([0-9]+)", (int, int)),
+    (r"a_ann_([0-9]+)_([0-9]+)", (int, int)),
+    (r"book_detail_([0-9]+)", (int,)),
+    (r"remove_cache$", ()),
+    (r"ul_([dtwm])_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9]+)$",
+     (str, date.fromisoformat, date.fromisoformat, int)),
+]
+
+MESSAGES = ["/help", "/fb2_123456", "/epub_42", "/a_1234", "/s_99", "/b_info_12345", "Война и мир", "/random_book"]
+CALLBACKS = ["b_2", "ba_3", "b_ann_123_2", "a_ann_5_1", "ul_m_2020-10-01_2020-10-30_4", "remove_cache", "ru_on",
+             "download_c_epub_55"]
+
+
+class RegExpFilter:
+    # what every aiogram handler used to do: one awaited filter check per registered handler
+    def __init__(self, pattern: str):
+        self.pattern = re.compile(pattern)
+
+    async def check(self, text: str) -> bool:
+        return self.pattern.match(text) is not None
+
+
+def build_chain(patterns):
+    return [RegExpFilter("^" + p) for p in patterns]
+
+
+def build_router(commands, patterns):
+    router = Router()
+    for command in commands:
+        router.command(command)(lambda *args: None)
+    for pattern, converters in patterns:
+        router.route(pattern, *converters)(lambda *args: None)
+    router.compile()
+    return router
+
+
+async def run_chain(chain, texts):
+    for text in texts:
+        for f in chain:
+            if await f.check(text):
+                break
+
+
+async def run_router(router, texts):
+    for text in texts:
+        router.match(text)
+
+
+def main():
+    command_patterns = [rf"/{c}(?:@\w+)?(?:\s|$)" for c in COMMANDS]
+    message_chain = build_chain(command_patterns + [p for p, _ in MESSAGE_PATTERNS])
+    callback_chain = build_chain([p for p, _ in CALLBACK_PATTERNS])
+    message_router = build_router(COMMANDS, MESSAGE_PATTERNS)
+    callback_router = build_router([], CALLBACK_PATTERNS)
+
+    # per batch of 8 texts
+    report({
+        "messages_filter_chain": measure_async(lambda: run_chain(message_chain, MESSAGES)),
+        "messages_router": measure_async(lambda: run_router(message_router, MESSAGES)),
+        "callbacks_filter_chain": measure_async(lambda: run_chain(callback_chain, CALLBACKS)),
+        "callbacks_router": measure_async(lambda: run_router(callback_router, CALLBACKS)),
+    })
+
+
+if __name__ == "__main__":
+    main()
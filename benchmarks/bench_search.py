@@ -0,0 +1,86 @@
+"""
+Local search index query latency on a synthetic catalog: common and rare words, word prefixes,
+deep pages and narrow language filters.
+
+Run from the repository root: python benchmarks/bench_search.py [--output FILE] [--compare FILE]
+"""
+import json
+import os
+import random
+import tempfile
+import time
+
+from harness import measure, report, setup_source
+
+setup_source()
+
+from langs import ALL_LANGS, LangSet  # noqa: E402
+from search_index import SearchIndexDB, match_query  # noqa: E402
+
+
+BOOKS = 200_000
+AUTHORS = 20_000
+SEQUENCES = 10_000
+PAGE_SIZE = 7
+
+WORDS = ("война мир тайна остров звезда капитан дорога море город ночь зима лето сердце время "
+         "дом сад река огонь тень ветер песня дело история путешествие код империя магия").split()
+FIRST_NAMES = "Александр Иван Мария Анна Сергей Ольга Дмитрий Елена Михаил Наталья".split()
+LAST_NAMES = "Иванов Петров Сидоров Смирнов Кузнецов Попов Васильев Соколов Михайлов Новиков".split()
+LANGS = ("ru", "ru", "ru", "uk", "be")
+
+
+def make_snapshot(path: str):
+    rnd = random.Random(1)
+    authors = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(1, AUTHORS + 1):
+            author = {"id": i, "first_name": rnd.choice(FIRST_NAMES), "last_name": rnd.choice(LAST_NAMES) + str(i),
+                      "middle_name": "", "annotation_exists": False}
+            authors.append(author)
+            f.write(json.dumps({"type": "author", "obj": author, "langs": [rnd.choice(LANGS)]},
+                               ensure_ascii=False) + "\n")
+        for i in range(1, SEQUENCES + 1):
+            sequence = {"id": i, "name": " ".join(rnd.sample(WORDS, 2)) + f" {i}", "authors": [rnd.choice(authors)]}
+            f.write(json.dumps({"type": "sequence", "obj": sequence, "langs": [rnd.choice(LANGS)]},
+                               ensure_ascii=False) + "\n")
+        for i in range(1, BOOKS + 1):
+            book = {"id": i, "title": " ".join(rnd.sample(WORDS, 3)) + f" {i}", "lang": rnd.choice(LANGS),
+                    "file_type": "fb2", "annotation_exists": False, "authors": [rnd.choice(authors)]}
+            f.write(json.dumps({"type": "book", "obj": book}, ensure_ascii=False) + "\n")
+
+
+def main():
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot = os.path.join(directory, "catalog.jsonl")
+        make_snapshot(snapshot)
+        db = SearchIndexDB(os.path.join(directory, "search.db"))
+
+        started_at = time.perf_counter()
+        count = db.load_snapshot(snapshot)
+        elapsed = time.perf_counter() - started_at
+        results["load_snapshot"] = {"us_per_op": round(elapsed * 1e6, 3), "ops": 1,
+                                    "items_per_s": round(count / elapsed)}
+
+        all_langs = ALL_LANGS
+        for name, table, query, langs, page in (
+            ("book_common_word", "book", "война", all_langs, 1),
+            ("book_common_word_page_50", "book", "война", all_langs, 50),
+            ("book_two_words", "book", "тайна остров", all_langs, 1),
+            ("book_prefix", "book", "путеш", all_langs, 1),
+            ("book_rare", "book", "война 12345", all_langs, 1),
+            ("book_only_be", "book", "война", LangSet.of(["be"]), 1),
+            ("book_no_results", "book", "абракадабра", all_langs, 1),
+            ("author_name", "author", "Иванов", all_langs, 1),
+            ("author_full_name", "author", "Иванов12 Мария", all_langs, 1),
+            ("sequence_name", "sequence", "империя", all_langs, 1),
+        ):
+            fts_query = match_query(query)
+            results[f"search_{name}"] = measure(lambda: db.search(table, fts_query, langs, PAGE_SIZE, page))
+        db.close()
+    report(results)
+
+
+if __name__ == "__main__":
+    main()
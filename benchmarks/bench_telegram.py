@@ -0,0 +1,58 @@
+"""
+Request building and response handling of the raw JSON fast path against the aiogram Bot path, without network.
+
+Run from the repository root: python benchmarks/bench_telegram.py [--output FILE] [--compare FILE]
+"""
+from harness import setup_source, measure, report
+
+setup_source()
+
+from aiogram import types  # noqa
+from aiogram.bot import api  # noqa
+from aiogram.utils.payload import generate_payload, prepare_arg  # noqa
+
+from send import get_keyboard  # noqa
+from telegram_api import FastBot  # noqa
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+TEXT = "\n\n\n".join(
+    f"📖 <b>Книга номер {i}</b> | ru\n<i>Автор Авторович</i>\nСкачать: /fb2_{i} /epub_{i} /mobi_{i}" for i in range(7)
+) + "\n\n<code>Страница 3/40</code>"
+
+RESPONSE = json.dumps({"ok": True, "result": {
+    "message_id": 1234, "date": 1600000000, "edit_date": 1600000001, "text": TEXT,
+    "chat": {"id": 123456789, "type": "private", "first_name": "Имя", "username": "user"},
+    "from": {"id": 987654321, "is_bot": True, "first_name": "Bot", "username": "bench_bot"},
+    "reply_markup": json.loads(get_keyboard(3, 40, "b")),
+}}, ensure_ascii=False)
+
+
+def aiogram_edit_message_text():
+    # what Bot.edit_message_text does before and after the HTTP call
+    reply_markup = prepare_arg(types.InlineKeyboardMarkup.to_object(json.loads(get_keyboard(3, 40, "b"))))
+    payload = generate_payload(text=TEXT, chat_id=123456789, message_id=1234, parse_mode="HTML",
+                               reply_markup=reply_markup)
+    api.compose_data(payload)()
+    result = api.check_result("editMessageText", "application/json", 200, RESPONSE)
+    return types.Message(**result)
+
+
+def fast_edit_message_text():
+    FastBot.make_body({"chat_id": 123456789, "message_id": 1234, "text": TEXT, "parse_mode": "HTML"},
+                      get_keyboard(3, 40, "b")).encode()
+
+
+def main():
+    report({
+        "aiogram_edit_message_text": measure(aiogram_edit_message_text),
+        "fast_edit_message_text": measure(fast_edit_message_text),
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Shared helpers for the benchmarks in this folder.
+
+Every benchmark prints a JSON object {name: {"us_per_op": ..., "ops": ...}}.
+Pass --output FILE to save it and --compare FILE to print the change against a saved run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "source")
+# setup_source changes into SOURCE, --output and --compare paths are relative to where the benchmark was started
+CALLER_DIR = os.getcwd()
+
+
+def setup_source():
+    # config.py reads these at import time, benchmarks never talk to the services
+    for name, value in (("BOT_TOKEN", "0:bench"), ("BOT_NAME", "bench_bot"), ("DB_PASSWORD", "bench"),
+                        ("FLIBUSTA_SERVER", "http://localhost"), ("FLIBUSTA_SERVER_PUBLIC", "http://localhost"),
+                        ("WEBHOOK_PORT", "8443"), ("WEBHOOK_HOST", "https://localhost"), ("SERVER_PORT", "8080")):
+        os.environ.setdefault(name, value)
+    if SOURCE not in sys.path:
+        sys.path.insert(0, SOURCE)
+    # db.py reads queries from ./sql
+    os.chdir(SOURCE)
+
+
+def measure(fn: Callable, min_time: float = 0.5) -> Dict[str, float]:
+    ops = 0
+    started_at = time.perf_counter()
+    while True:
+        fn()
+        ops += 1
+        elapsed = time.perf_counter() - started_at
+        if elapsed >= min_time and ops >= 5:
+            return {"us_per_op": round(elapsed / ops * 1e6, 3), "ops": ops}
+
+
+def measure_async(fn: Callable, min_time: float = 0.5) -> Dict[str, float]:
+    async def run():
+        ops = 0
+        started_at = time.perf_counter()
+        while True:
+            await fn()
+            ops += 1
+            elapsed = time.perf_counter() - started_at
+            if elapsed >= min_time and ops >= 5:
+                return {"us_per_op": round(elapsed / ops * 1e6, 3), "ops": ops}
+    return asyncio.run(run())
+
+
+def report(results: Dict[str, Dict[str, float]]):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    output = os.path.join(CALLER_DIR, args.output) if args.output else None
+    compare = os.path.join(CALLER_DIR, args.compare) if args.compare else None
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+        for name, result in results.items():
+            if name in baseline:
+                change = result["us_per_op"] / baseline[name]["us_per_op"] - 1
+                print(f"{name}: {baseline[name]['us_per_op']} -> {result['us_per_op']} us ({change:+.1%})",
+                      file=sys.stderr)
@@ -1,24 +1,165 @@
-from typing import Union
+import asyncio
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Union
 
-from chatbase import Message
+import aiohttp
 from aiogram import types
-from aioify import aioify
+
+try:
+    import ujson as json
+except ImportError:
+    import json
 
 from config import Config
+from metrics import UPDATES, HANDLER_LATENCY, ANALYTICS_EVENTS
+from stats import Stats
+
+
+class AnalyticsBackend(ABC):
+    @abstractmethod
+    async def send(self, events: List[dict]):
+        pass
+
+    async def close(self):
+        pass
+
+
+class NullBackend(AnalyticsBackend):
+    async def send(self, events: List[dict]):
+        pass
+
+
+class FileBackend(AnalyticsBackend):
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, events: List[dict]):
+        with open(self.path, "a") as f:
+            f.write(''.join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+
+    async def send(self, events: List[dict]):
+        await asyncio.get_running_loop().run_in_executor(None, self._write, events)
 
 
-def _analyze(message: str, intent: str, user_id: Union[int, str]):
-    return Message(
-        api_key=Config.CHATBASE_API_KEY,
-        platform="telegram",
-        message=message,
-        intent=intent,
-        user_id=user_id if isinstance(user_id, str) else str(user_id),
-        version="3"
-    ).send()
+class ChatbaseBackend(AnalyticsBackend):
+    URL = "https://chatbase.com/api/messages"
 
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.session: Optional[aiohttp.ClientSession] = None
 
-_async_analyze = aioify(_analyze)
+    async def send(self, events: List[dict]):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        messages = [{
+            "api_key": self.api_key,
+            "type": "user",
+            "platform": "telegram",
+            "version": "3",
+            **event
+        } for event in events]
+        async with self.session.post(self.URL, data=json.dumps({"messages": messages}),
+                                     headers={"Content-Type": "application/json"}) as response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+def make_backend() -> AnalyticsBackend:
+    if Config.ANALYTICS_BACKEND == "chatbase" and Config.CHATBASE_API_KEY:
+        return ChatbaseBackend(Config.CHATBASE_API_KEY)
+    if Config.ANALYTICS_BACKEND == "file":
+        return FileBackend(Config.ANALYTICS_FILE)
+    return NullBackend()
+
+
+class Analytics:
+    QUEUE_SIZE = 10_000
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 5
+
+    backend: AnalyticsBackend = NullBackend()
+    sample_rate: float = 1.0
+    enabled = False
+
+    queue: Optional[asyncio.Queue] = None
+    task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls, backend: AnalyticsBackend, sample_rate: float = 1.0):
+        cls.backend = backend
+        cls.sample_rate = sample_rate
+        cls.enabled = not isinstance(backend, NullBackend) and sample_rate > 0
+        if not cls.enabled:
+            return
+        cls.queue = asyncio.Queue(maxsize=cls.QUEUE_SIZE)
+        cls.task = asyncio.create_task(cls._worker())
+
+    @classmethod
+    async def stop(cls):
+        if not cls.enabled:
+            return
+        cls.enabled = False
+        # the worker sends everything queued before the sentinel, including the batch it is collecting
+        await cls.queue.put(None)
+        await cls.task
+        cls.task = None
+        await cls.backend.close()
+
+    @classmethod
+    def push(cls, message: Optional[str], intent: str, user_id: Union[int, str]):
+        if not cls.enabled:
+            return
+        if cls.sample_rate < 1 and random.random() >= cls.sample_rate:
+            return
+        try:
+            cls.queue.put_nowait({
+                "message": message or "",
+                "intent": intent,
+                "user_id": str(user_id),
+                "time_stamp": int(time.time() * 1000)
+            })
+        except asyncio.QueueFull:
+            ANALYTICS_EVENTS.inc(result="dropped")
+
+    @classmethod
+    async def _flush(cls, events: List[dict]):
+        try:
+            await cls.backend.send(events)
+            ANALYTICS_EVENTS.inc(len(events), result="sent")
+        except Exception as e:
+            ANALYTICS_EVENTS.inc(len(events), result="failed")
+            logging.warning(f"Analytics: failed to send {len(events)} events: {e!r}")
+
+    @classmethod
+    async def _worker(cls):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            event = await cls.queue.get()
+            if event is None:
+                return
+            events = [event]
+            deadline = loop.time() + cls.FLUSH_INTERVAL
+            while len(events) < cls.BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(cls.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                events.append(event)
+            await cls._flush(events)
 
 
 class Analyze:
@@ -26,22 +167,29 @@ class Analyze:
         self.intent = intent
         self.obj = obj
         self.reply_msg = reply_msg
+        self.started_at = 0.0
 
     async def __aenter__(self):
-        pass
+        self.started_at = time.monotonic()
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if Config.CHATBASE_API_KEY:
-            await analyze(self.intent, self.obj, self.reply_msg)
+        latency = time.monotonic() - self.started_at
+        Stats.record(self.intent, latency * 1000, exc_type is not None)
+        UPDATES.inc(handler=self.intent)
+        HANDLER_LATENCY.observe(latency, handler=self.intent)
+        if Analytics.enabled:
+            analyze(self.intent, self.obj, self.reply_msg)
 
 
-async def analyze(intent, obj, reply_msg=None):
+def analyze(intent, obj, reply_msg=None):
+    if not Analytics.enabled:
+        return
     if isinstance(obj, types.Message):
         if reply_msg:
-            await _async_analyze(obj.reply_to_message.text, intent, obj.from_user.id)
+            Analytics.push(obj.reply_to_message.text, intent, obj.from_user.id)
         else:
-            await _async_analyze(obj.text, intent, obj.from_user.id)
+            Analytics.push(obj.text, intent, obj.from_user.id)
     elif isinstance(obj, types.CallbackQuery):
-        await _async_analyze(obj.message.text, intent, obj.from_user.id)
+        Analytics.push(obj.message.text, intent, obj.from_user.id)
     elif isinstance(obj, types.InlineQuery):
-        await _async_analyze(obj.query, intent, obj.from_user.id)
+        Analytics.push(obj.query, intent, obj.from_user.id)
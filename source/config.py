@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 import os
 
 
@@ -24,11 +24,43 @@ class Config:
     SERVER_HOST: str
     SERVER_PORT: int
 
+    WORKERS: int
+    WORKER_ID: Optional[int]
+    PRIMARY_WORKER: bool
+    WORKER_BASE_PORT: int
+
+    FAST_ACK: bool
+    WEBHOOK_REPLIES: bool
+    UPDATE_QUEUE_SIZE: int
+    UPDATE_WORKERS: int
+
+    DRAIN_TIMEOUT: float
+
+    TRACE_FILE: Optional[str]
+    TRACE_SLOW_THRESHOLD: float
+    TRACE_SAMPLE_RATE: float
+
+    PROFILE_ON_START: float
+
+    DIGEST_HOUR: int
+    DIGEST_RATE: float
+
+    SEARCH_INDEX_FILE: Optional[str]
+    SEARCH_INDEX_SNAPSHOT: Optional[str]
+
+    OFFLINE_STORE_FILE: Optional[str]
+
     REDIS_HOST: str
     REDIS_PASSWORD: str
 
+    ADMINS: List[int]
+
     CHATBASE_API_KEY: Optional[str]
 
+    ANALYTICS_BACKEND: str
+    ANALYTICS_FILE: str
+    ANALYTICS_SAMPLE_RATE: float
+
     DSN: str
 
     @classmethod
@@ -55,7 +87,40 @@ class Config:
         cls.SERVER_HOST = os.environ.get('SERVER_HOST', 'localhost')
         cls.SERVER_PORT = os.environ['SERVER_PORT']
 
+        cls.WORKERS = int(os.environ.get('WORKERS', 1))
+        cls.WORKER_ID = int(os.environ['WORKER_ID']) if 'WORKER_ID' in os.environ else None
+        # the single process or the first worker, runs the background jobs shared by all workers
+        cls.PRIMARY_WORKER = cls.WORKER_ID in (None, 0)
+        cls.WORKER_BASE_PORT = int(os.environ.get('WORKER_BASE_PORT', int(cls.SERVER_PORT) + 1))
+
+        cls.FAST_ACK = os.environ.get('FAST_ACK', '0') == '1'
+        cls.WEBHOOK_REPLIES = os.environ.get('WEBHOOK_REPLIES', '1') == '1'
+        cls.UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', 1000))
+        cls.UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', 32))
+
+        cls.DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 25))
+
+        cls.TRACE_FILE = os.environ.get('TRACE_FILE', None)
+        cls.TRACE_SLOW_THRESHOLD = float(os.environ.get('TRACE_SLOW_THRESHOLD', 2.0))
+        cls.TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+
+        cls.PROFILE_ON_START = float(os.environ.get('PROFILE_ON_START', 0))
+
+        cls.DIGEST_HOUR = int(os.environ.get('DIGEST_HOUR', 10))
+        cls.DIGEST_RATE = float(os.environ.get('DIGEST_RATE', 20))
+
+        cls.SEARCH_INDEX_FILE = os.environ.get('SEARCH_INDEX_FILE', None)
+        cls.SEARCH_INDEX_SNAPSHOT = os.environ.get('SEARCH_INDEX_SNAPSHOT', None)
+
+        cls.OFFLINE_STORE_FILE = os.environ.get('OFFLINE_STORE_FILE', None)
+
+        cls.ADMINS = [int(x) for x in os.environ.get('ADMINS', '').split(',') if x.strip()]
+
         cls.CHATBASE_API_KEY = os.environ.get('CHATBASE_API_KEY', None)
 
+        cls.ANALYTICS_BACKEND = os.environ.get('ANALYTICS_BACKEND', 'chatbase' if cls.CHATBASE_API_KEY else 'null')
+        cls.ANALYTICS_FILE = os.environ.get('ANALYTICS_FILE', 'analytics.jsonl')
+        cls.ANALYTICS_SAMPLE_RATE = float(os.environ.get('ANALYTICS_SAMPLE_RATE', 1.0))
+
 
 Config.configurate()
@@ -1,48 +1,136 @@
 import pathlib
+import time
 from abc import ABC
-from typing import Type, Union, List
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Type, Union, List, Tuple, Dict, Optional, AsyncIterator
 
 import asyncpg
 from aiogram.types import User, CallbackQuery
 
 from config import Config
+from langs import DEFAULT_LANGS, LangSet
+from metrics import DB_LATENCY
+from tracing import span
 
 
-async def prepare_db():
-    pool = await asyncpg.create_pool(user=Config.DB_USER, password=Config.DB_PASSWORD,
-                                     database=Config.DB_NAME, host=Config.DB_HOST,
-                                     port=Config.DB_PORT)
+async def prepare_db() -> int:
+    pool = TimedPool(await asyncpg.create_pool(user=Config.DB_USER, password=Config.DB_PASSWORD,
+                                               database=Config.DB_NAME, host=Config.DB_HOST,
+                                               port=Config.DB_PORT))
 
-    for _class in [TablesCreator, TelegramUserDB, SettingsDB, PostedBookDB]:  # type: Type[ConfigurableDB]
+    for _class in [Migrator, TelegramUserDB, SettingsDB, PostedBookDB, IntentStatsDB,
+                   SeriesJobDB, DigestSubscriptionDB]:  # type: Type[ConfigurableDB]
         _class.configurate(pool)
 
-    await TablesCreator.create_tables()
+    return await Migrator.migrate()
+
+
+async def close_db():
+    await Migrator.pool.close()
 
 SQL_FOLDER = pathlib.Path("./sql")
 
+QUERY_NAMES: Dict[str, str] = {}
+
+
+def read_sql(name: str) -> str:
+    query = open(SQL_FOLDER / f"{name}.sql").read()
+    QUERY_NAMES[query] = name
+    return query
+
+
+class TimedPool:
+    def __init__(self, pool: asyncpg.pool.Pool):
+        self.pool = pool
+
+    def acquire(self):
+        return self.pool.acquire()
+
+    async def close(self):
+        await self.pool.close()
+
+    async def _timed(self, method, query: str, *args):
+        started_at = time.monotonic()
+        name = QUERY_NAMES.get(query, "other")
+        try:
+            with span("db", name):
+                return await method(query, *args)
+        finally:
+            DB_LATENCY.observe(time.monotonic() - started_at, query=name)
+
+    async def execute(self, query: str, *args):
+        return await self._timed(self.pool.execute, query, *args)
+
+    async def fetch(self, query: str, *args):
+        return await self._timed(self.pool.fetch, query, *args)
+
+    async def fetchval(self, query: str, *args):
+        return await self._timed(self.pool.fetchval, query, *args)
+
 
 class ConfigurableDB(ABC):
-    pool: asyncpg.pool.Pool
+    pool: TimedPool
 
     @classmethod
-    def configurate(cls, pool: asyncpg.pool.Pool):
+    def configurate(cls, pool: TimedPool):
         cls.pool = pool
 
 
-class TablesCreator(ConfigurableDB):
-    CREATE_TELEGRAM_USER_TABLE = open(SQL_FOLDER / "create_telegram_user_table.sql").read().format(Config.DB_USER)
-    CREATE_SETTINGS_TABLE = open(SQL_FOLDER / "create_settings_table.sql").read().format(Config.DB_USER)
-    CREATE_POSTED_BOOK_TABLE = open(SQL_FOLDER / "create_posted_book_table.sql").read().format(Config.DB_USER)
+class Migrator(ConfigurableDB):
+    MIGRATIONS_FOLDER = SQL_FOLDER / "migrations"
+
+    # any constant shared by all replicas, used to serialize migrations between them
+    LOCK_ID = 0x666c6962
+
+    CREATE_VERSION_TABLE = read_sql("schema_version_create").format(owner=Config.DB_USER)
+    GET_VERSION = read_sql("schema_version_get")
+    INSERT_VERSION = read_sql("schema_version_insert")
 
     @classmethod
-    async def create_tables(cls):
-        await cls.pool.execute(cls.CREATE_TELEGRAM_USER_TABLE)
-        await cls.pool.execute(cls.CREATE_SETTINGS_TABLE)
-        await cls.pool.execute(cls.CREATE_POSTED_BOOK_TABLE)
+    def migrations(cls) -> List[Tuple[int, pathlib.Path]]:
+        result = []
+        for path in cls.MIGRATIONS_FOLDER.glob("*.sql"):
+            version, _ = path.stem.split("_", 1)
+            result.append((int(version), path))
+        return sorted(result)
+
+    @classmethod
+    async def get_version(cls, conn: asyncpg.Connection) -> int:
+        if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+            return 0
+        return await conn.fetchval(cls.GET_VERSION)
+
+    @classmethod
+    async def migrate(cls) -> int:
+        migrations = cls.migrations()
+        latest = migrations[-1][0] if migrations else 0
+
+        async with cls.pool.acquire() as conn:
+            # fast path: nothing to do, no DDL and no catalog locks
+            if await cls.get_version(conn) >= latest:
+                return 0
+
+            await conn.execute("SELECT pg_advisory_lock($1)", cls.LOCK_ID)
+            try:
+                await conn.execute(cls.CREATE_VERSION_TABLE)
+                current = await cls.get_version(conn)
+
+                applied = 0
+                for version, path in migrations:
+                    if version <= current:
+                        continue
+                    async with conn.transaction():
+                        await conn.execute(path.read_text().format(owner=Config.DB_USER))
+                        await conn.execute(cls.INSERT_VERSION, version)
+                    applied += 1
+                return applied
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", cls.LOCK_ID)
 
 
 class TelegramUserDB(ConfigurableDB):
-    CREATE_OR_UPDATE = open(SQL_FOLDER / "telegram_user_create_or_update.sql").read()
+    CREATE_OR_UPDATE = read_sql("telegram_user_create_or_update")
 
     @classmethod
     async def create_or_update(cls, obj: Union[User, CallbackQuery]):
@@ -55,40 +143,29 @@ class TelegramUserDB(ConfigurableDB):
 
 
 class Settings:
-    def __init__(self, user_id: int, allow_ru: bool, allow_be: bool, allow_uk: bool, beta_testing: bool):
+    def __init__(self, user_id: int, langs: LangSet, beta_testing: bool):
         self.user_id: int = user_id
-        self.allow_ru: bool = allow_ru
-        self.allow_be: bool = allow_be
-        self.allow_uk: bool = allow_uk
+        self.langs: LangSet = langs
         self.beta_testing: bool = beta_testing
 
-    def get(self) -> List[str]:
-        result: List[str] = []
-        if self.allow_ru:
-            result.append("ru")
-        if self.allow_be:
-            result.append("be")
-        if self.allow_uk:
-            result.append("uk")
-        return result
+    def get(self) -> LangSet:
+        return self.langs
 
 
 class SettingsDB(ConfigurableDB):
-    GET = open(SQL_FOLDER / "settings_get.sql").read()
-    UPDATE = open(SQL_FOLDER / "settings_update.sql").read()
+    GET = read_sql("settings_get")
+    UPDATE = read_sql("settings_update")
 
     @classmethod
     async def get(cls, user_id: int) -> Settings:
         result = await cls.pool.fetch(cls.GET, user_id)
         if not result:
-            return Settings(user_id, True, False, False, False)
-        return Settings(user_id, result[0]["allow_ru"], result[0]["allow_be"], 
-                        result[0]["allow_uk"], result[0]["beta_testing"])
+            return Settings(user_id, DEFAULT_LANGS, False)
+        return Settings(user_id, LangSet(result[0]["langs"]), result[0]["beta_testing"])
 
     @classmethod
     async def update(cls, settings: Settings):
-        await cls.pool.execute(cls.UPDATE, settings.user_id, settings.allow_ru,
-                               settings.allow_be, settings.allow_uk, settings.beta_testing)
+        await cls.pool.execute(cls.UPDATE, settings.user_id, settings.langs.mask, settings.beta_testing)
 
 
 class PostedBook:
@@ -99,9 +176,10 @@ class PostedBook:
 
 
 class PostedBookDB(ConfigurableDB):
-    GET = open(SQL_FOLDER / "posted_book_get.sql").read()
-    CREATE_OR_UPDATE = open(SQL_FOLDER / "posted_book_create_or_update.sql").read()
-    DELETE = open(SQL_FOLDER / "posted_book_delete.sql").read()
+    GET = read_sql("posted_book_get")
+    CREATE_OR_UPDATE = read_sql("posted_book_create_or_update")
+    DELETE = read_sql("posted_book_delete")
+    GET_BOOK_IDS = read_sql("posted_book_get_book_ids")
 
     @classmethod
     async def get(cls, book_id: int, file_type: str):
@@ -117,3 +195,124 @@ class PostedBookDB(ConfigurableDB):
     @classmethod
     async def delete(cls, book_id: int, file_type: str):
         await cls.pool.execute(cls.DELETE, book_id, file_type)
+
+    @classmethod
+    async def get_book_ids(cls, after_id: int, limit: int) -> List[int]:
+        """Ids of books with cached files, `limit` of them after `after_id` in ascending order."""
+        return [row["book_id"] for row in await cls.pool.fetch(cls.GET_BOOK_IDS, after_id, limit)]
+
+
+class IntentStatsDB(ConfigurableDB):
+    ADD = read_sql("intent_stats_add")
+    GET_SINCE = read_sql("intent_stats_get_since")
+
+    @classmethod
+    async def add(cls, period_start: datetime, intent: str, count: int, errors: int, buckets: List[int]):
+        await cls.pool.execute(cls.ADD, period_start, intent, count, errors, buckets)
+
+    @classmethod
+    async def get_since(cls, since: datetime) -> List[asyncpg.Record]:
+        return await cls.pool.fetch(cls.GET_SINCE, since)
+
+
+class SeriesJob:
+    def __init__(self, chat_id: int, message_id: int, books: List[Tuple[int, str]]):
+        self.chat_id: int = chat_id
+        self.message_id: int = message_id
+        self.books: List[Tuple[int, str]] = books
+
+
+class SeriesJobDB(ConfigurableDB):
+    CREATE = read_sql("series_job_create")
+    POP = read_sql("series_job_pop")
+
+    @classmethod
+    async def create(cls, job: SeriesJob):
+        await cls.pool.execute(cls.CREATE, job.chat_id, job.message_id,
+                               [book_id for book_id, _ in job.books], [file_type for _, file_type in job.books])
+
+    @classmethod
+    async def pop(cls, workers: int, worker_id: int) -> List[SeriesJob]:
+        """Jobs of the chats that the supervisor routes to `worker_id` (chat_id % workers, as in Python)."""
+        return [SeriesJob(row["chat_id"], row["message_id"], list(zip(row["book_ids"], row["file_types"])))
+                for row in await cls.pool.fetch(cls.POP, workers, worker_id)]
+
+
+class DigestSubscription:
+    def __init__(self, user_id: int, period: Optional[str], author_ids: List[int], sequence_ids: List[int],
+                 langs: LangSet = LangSet(0)):
+        self.user_id: int = user_id
+        self.period: Optional[str] = period  # "d", "w" or None when digests are off
+        self.author_ids: List[int] = author_ids
+        self.sequence_ids: List[int] = sequence_ids
+        self.langs: LangSet = langs
+
+
+class DigestSubscriptionDB(ConfigurableDB):
+    GET = read_sql("digest_subscription_get")
+    SET_PERIOD = read_sql("digest_subscription_set_period")
+    TOGGLE_AUTHOR = read_sql("digest_subscription_toggle_author")
+    TOGGLE_SEQUENCE = read_sql("digest_subscription_toggle_sequence")
+    STREAM = read_sql("digest_subscription_stream")
+    MARK_SENT = read_sql("digest_subscription_mark_sent")
+
+    # any constant shared by all replicas, only one of them sends digests
+    LOCK_ID = 0x64696765
+
+    # users per keyset query, each window is fetched with one query and no connection is held between them
+    STREAM_WINDOW = 5_000
+
+    @classmethod
+    async def get(cls, user_id: int) -> DigestSubscription:
+        result = await cls.pool.fetch(cls.GET, user_id)
+        if not result:
+            return DigestSubscription(user_id, None, [], [])
+        return DigestSubscription(user_id, result[0]["period"], result[0]["author_ids"], result[0]["sequence_ids"])
+
+    @classmethod
+    async def set_period(cls, user_id: int, period: Optional[str]):
+        await cls.pool.execute(cls.SET_PERIOD, user_id, period)
+
+    @classmethod
+    async def toggle_author(cls, user_id: int, author_id: int) -> bool:
+        """Follows or unfollows the author, returns whether the author is followed now."""
+        return (await cls.pool.fetch(cls.TOGGLE_AUTHOR, user_id, author_id))[0]["following"]
+
+    @classmethod
+    async def toggle_sequence(cls, user_id: int, sequence_id: int) -> bool:
+        return (await cls.pool.fetch(cls.TOGGLE_SEQUENCE, user_id, sequence_id))[0]["following"]
+
+    @classmethod
+    async def mark_sent(cls, user_ids: List[int], digest_date: date):
+        await cls.pool.execute(cls.MARK_SENT, user_ids, digest_date)
+
+    @classmethod
+    async def stream(cls, period: str, digest_date: date) -> AsyncIterator[DigestSubscription]:
+        """
+        Subscribers that have not got the digest of `digest_date` yet, ordered by user id.
+
+        Rows are fetched in keyset windows of STREAM_WINDOW users, so the memory does not grow with the table,
+        and no connection is held while the caller sends the window.
+        """
+        last_user_id = 0
+        while True:
+            rows = await cls.pool.fetch(cls.STREAM, period, digest_date, last_user_id, cls.STREAM_WINDOW)
+            for row in rows:
+                yield DigestSubscription(
+                    row["user_id"], period, row["author_ids"], row["sequence_ids"], LangSet(row["langs"])
+                )
+            if len(rows) < cls.STREAM_WINDOW:
+                return
+            last_user_id = rows[-1]["user_id"]
+
+    @classmethod
+    @asynccontextmanager
+    async def exclusive(cls) -> AsyncIterator[bool]:
+        """Holds an advisory lock while digests are sent, yields False if another replica holds it."""
+        async with cls.pool.acquire() as conn:
+            locked = await conn.fetchval("SELECT pg_try_advisory_lock($1)", cls.LOCK_ID)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    await conn.execute("SELECT pg_advisory_unlock($1)", cls.LOCK_ID)
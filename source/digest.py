@@ -0,0 +1,194 @@
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+from aiogram import exceptions
+
+from cache import TTLCache
+from config import Config
+from db import DigestSubscription, DigestSubscriptionDB
+from flibusta_server import BookWithAuthor, SequenceAPI, UpdateLogAPI
+from langs import LangSet
+from metrics import DIGESTS_SENT
+from telegram_api import FastBot
+from throttling import RateLimiter
+
+
+PERIODS = ("d", "w")
+
+
+def digest_date(period: str, today: date) -> date:
+    """Date a digest is sent on: every day for daily ones, on Monday for weekly ones."""
+    if period == "w":
+        return today - timedelta(days=today.weekday())
+    return today
+
+
+def digest_range(period: str, sent_on: date) -> Tuple[date, date]:
+    end_date = sent_on - timedelta(days=1)
+    if period == "w":
+        return end_date - timedelta(days=6), end_date
+    return end_date, end_date
+
+
+class DigestSender:
+    """
+    Sends new-book digests to subscribers once a day at DIGEST_HOUR (weekly ones on Monday).
+
+    Books are fetched once per language set and every distinct digest is rendered once,
+    subscribers are streamed from the database and sent at most DIGEST_RATE messages per second.
+    Progress is saved every CHECKPOINT_EVERY messages, a restarted bot continues from there.
+    """
+    CHECK_INTERVAL = 10 * 60
+    CHECKPOINT_EVERY = 50
+
+    MAX_BOOKS = 2_000
+    FETCH_LIMIT = 100
+    SERIES_BOOKS_LIMIT = 1_000
+    SHOWN_BOOKS = 10
+    MESSAGE_LIMIT = 3_500
+
+    task: Optional[asyncio.Task] = None
+    limiter: RateLimiter
+
+    @classmethod
+    def start(cls):
+        cls.limiter = RateLimiter("digest", capacity=Config.DIGEST_RATE, rate=Config.DIGEST_RATE)
+        cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            now = datetime.now()
+            for period in PERIODS:
+                sent_on = digest_date(period, now.date())
+                if datetime.combine(sent_on, time(Config.DIGEST_HOUR)) > now:
+                    continue
+                try:
+                    await cls.run(period, sent_on)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"Digest {period} {sent_on} interrupted: {e!r}")
+                except Exception:
+                    logging.exception(f"Digest {period} {sent_on} failed")
+            await asyncio.sleep(cls.CHECK_INTERVAL)
+
+    @classmethod
+    async def run(cls, period: str, sent_on: date):
+        async with DigestSubscriptionDB.exclusive() as locked:
+            if not locked:
+                return
+
+            start_date, end_date = digest_range(period, sent_on)
+            books: Dict[LangSet, List[BookWithAuthor]] = {}
+            series_books: Dict[Tuple[int, LangSet], Set[int]] = {}
+            # rendered digest by language set and followed authors and series, "" when there is nothing to send
+            digests = TTLCache("digest", max_size=10_000, ttl=24 * 60 * 60)
+            sent: List[int] = []
+
+            try:
+                async for subscription in DigestSubscriptionDB.stream(period, sent_on):
+                    key = (subscription.langs, tuple(sorted(subscription.author_ids)),
+                           tuple(sorted(subscription.sequence_ids)))
+                    text = digests.get(key)
+                    if text is None:
+                        if subscription.langs and subscription.langs not in books:
+                            books[subscription.langs] = await cls.fetch_books(start_date, end_date,
+                                                                              subscription.langs)
+                        text = await cls.render(subscription, start_date, end_date,
+                                                books.get(subscription.langs, []), series_books)
+                        digests.set(key, text)
+
+                    if text:
+                        await cls.send(period, subscription.user_id, text)
+                    else:
+                        DIGESTS_SENT.inc(period=period, result="empty")
+                    sent.append(subscription.user_id)
+                    if len(sent) >= cls.CHECKPOINT_EVERY:
+                        await DigestSubscriptionDB.mark_sent(sent, sent_on)
+                        sent = []
+            finally:
+                if sent:
+                    await DigestSubscriptionDB.mark_sent(sent, sent_on)
+
+    @classmethod
+    async def fetch_books(cls, start_date: date, end_date: date, langs: LangSet) -> List[BookWithAuthor]:
+        result: List[BookWithAuthor] = []
+        page = 1
+        while len(result) < cls.MAX_BOOKS:
+            update_log = await UpdateLogAPI.get_by_day(start_date, end_date, langs, cls.FETCH_LIMIT, page)
+            if update_log is None:
+                # nobody is marked as sent, the next check starts over
+                raise aiohttp.ClientError(f"update log {start_date} - {end_date} {langs} is not available")
+            result.extend(update_log.books)
+            if len(update_log.books) < cls.FETCH_LIMIT or page * cls.FETCH_LIMIT >= update_log.count:
+                break
+            page += 1
+        return result
+
+    @classmethod
+    async def render(cls, subscription: DigestSubscription, start_date: date, end_date: date,
+                     books: List[BookWithAuthor], series_books: Dict[Tuple[int, LangSet], Set[int]]) -> str:
+        if subscription.author_ids or subscription.sequence_ids:
+            author_ids = set(subscription.author_ids)
+            book_ids: Set[int] = set()
+            for sequence_id in subscription.sequence_ids:
+                book_ids |= await cls.get_series_books(sequence_id, subscription.langs, series_books)
+            books = [
+                book for book in books
+                if book.id in book_ids or any(author.id in author_ids for author in book.authors)
+            ]
+        if not books:
+            return ""
+
+        if start_date == end_date:
+            text = f"🔔 <b>Новые книги за {start_date.isoformat()}</b>\n\n"
+        else:
+            text = f"🔔 <b>Новые книги за {start_date.isoformat()} - {end_date.isoformat()}</b>\n\n"
+        shown = 0
+        for book in books[:cls.SHOWN_BOOKS]:
+            book_text = book.to_send_book
+            if shown and len(text) + len(book_text) > cls.MESSAGE_LIMIT:
+                break
+            text += book_text + "\n\n\n"
+            shown += 1
+        if len(books) > shown:
+            text += f"И ещё {len(books) - shown}: /update_log\n"
+        return text + "Настроить рассылку: /digest"
+
+    @classmethod
+    async def get_series_books(cls, sequence_id: int, langs: LangSet,
+                               series_books: Dict[Tuple[int, LangSet], Set[int]]) -> Set[int]:
+        key = (sequence_id, langs)
+        if key not in series_books:
+            sequence = await SequenceAPI.get_by_id(sequence_id, langs, cls.SERIES_BOOKS_LIMIT, 1)
+            series_books[key] = {book.id for book in sequence.books} if sequence else set()
+        return series_books[key]
+
+    @classmethod
+    async def send(cls, period: str, user_id: int, text: str):
+        while not cls.limiter.allow(0):
+            await asyncio.sleep(cls.limiter.retry_after(0))
+        for _ in range(2):
+            try:
+                await FastBot.send_message(user_id, text, parse_mode="HTML")
+                DIGESTS_SENT.inc(period=period, result="sent")
+                return
+            except exceptions.RetryAfter as e:
+                await asyncio.sleep(e.timeout)
+            except (exceptions.BotBlocked, exceptions.ChatNotFound, exceptions.UserDeactivated):
+                await DigestSubscriptionDB.set_period(user_id, None)
+                DIGESTS_SENT.inc(period=period, result="unsubscribed")
+                return
+            except exceptions.TelegramAPIError as e:
+                logging.warning(f"Digest for {user_id} not sent: {e!r}")
+                break
+        DIGESTS_SENT.inc(period=period, result="failed")
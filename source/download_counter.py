@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import aiohttp
+
+from flibusta_server import DownloadAPI
+from metrics import DOWNLOAD_COUNTER_EVENTS
+
+
+class DownloadCounter:
+    QUEUE_SIZE = 10_000
+    CONCURRENCY = 4
+    RETRIES = 3
+    RETRY_DELAY = 1
+
+    queue: Optional["asyncio.Queue[Tuple[int, int]]"] = None
+    workers: List[asyncio.Task] = []
+
+    @classmethod
+    def start(cls):
+        cls.queue = asyncio.Queue(maxsize=cls.QUEUE_SIZE)
+        cls.workers = [asyncio.create_task(cls._worker()) for _ in range(cls.CONCURRENCY)]
+
+    @classmethod
+    async def stop(cls, timeout: float = 5):
+        if cls.queue is not None:
+            try:
+                await asyncio.wait_for(cls.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Download counter: {cls.queue.qsize()} events left unsent")
+        for worker in cls.workers:
+            worker.cancel()
+        cls.workers = []
+
+    @classmethod
+    def push(cls, book_id: int, user_id: int):
+        if cls.queue is None:
+            DOWNLOAD_COUNTER_EVENTS.inc(result="dropped")
+            return
+        try:
+            cls.queue.put_nowait((book_id, user_id))
+        except asyncio.QueueFull:
+            DOWNLOAD_COUNTER_EVENTS.inc(result="dropped")
+
+    @classmethod
+    async def _send(cls, book_id: int, user_id: int) -> bool:
+        for attempt in range(cls.RETRIES):
+            try:
+                if await DownloadAPI.update(book_id, user_id):
+                    return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            if attempt + 1 < cls.RETRIES:
+                await asyncio.sleep(cls.RETRY_DELAY * 2 ** attempt)
+        return False
+
+    @classmethod
+    async def _worker(cls):
+        while True:
+            book_id, user_id = await cls.queue.get()
+            try:
+                if await cls._send(book_id, user_id):
+                    DOWNLOAD_COUNTER_EVENTS.inc(result="sent")
+                else:
+                    DOWNLOAD_COUNTER_EVENTS.inc(result="failed")
+            except Exception:
+                # a worker must outlive any event, otherwise the queue is never drained
+                logging.exception(f"Download counter: event for book {book_id} failed")
+                DOWNLOAD_COUNTER_EVENTS.inc(result="failed")
+            finally:
+                cls.queue.task_done()
@@ -1,15 +1,11 @@
 import re
+from typing import Callable, Optional
 
 from aiogram import filters
 from aiogram.types import Message, CallbackQuery
 
-
-class CallbackDataRegExFilter(filters.Filter):
-    def __init__(self, reg_exp_query: str):
-        self.pattern = re.compile(reg_exp_query)
-
-    async def check(self, callback) -> bool:
-        return self.pattern.match(callback.data) is not None
+from config import Config
+from router import Router
 
 
 class InlineQueryRegExFilter(filters.Filter):
@@ -23,3 +19,23 @@ class InlineQueryRegExFilter(filters.Filter):
 class IsTextMessageFilter(filters.Filter):
     async def check(self, message: Message) -> bool:
         return message.text is not None
+
+
+class IsAdminFilter(filters.Filter):
+    async def check(self, obj) -> bool:
+        return obj.from_user is not None and obj.from_user.id in Config.ADMINS
+
+
+class RouterFilter(filters.Filter):
+    def __init__(self, router: Router, get_text: Callable[[object], Optional[str]]):
+        self.router = router
+        self.get_text = get_text
+
+    async def check(self, obj):
+        text = self.get_text(obj)
+        if text is None:
+            return False
+        route = self.router.match(text)
+        if route is None:
+            return False
+        return {"route": route}
@@ -1,24 +1,55 @@
+import asyncio
 import io
+import time
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from datetime import date
-import re
 
 import aiohttp
 from aiohttp import ClientTimeout, ServerDisconnectedError
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from utils import BytesResult
-
-try:
-    import ujson as json
-except ImportError:
-    import json
-
+from sanitizer import sanitize, split_pages
+from metrics import BACKEND_LATENCY
+from tracing import span
 
 from config import Config
-
-
-TAG_RE = re.compile(r'<[^>]+>')
+from langs import LangSet
+
+
+class BackendStatus:
+    """Outcome of the latest backend request, the offline store answers while the backend is down."""
+    down_since: Optional[float] = None
+
+    @classmethod
+    def report(cls, available: bool):
+        if available:
+            cls.down_since = None
+        elif cls.down_since is None:
+            cls.down_since = time.time()
+
+    @classmethod
+    def is_down(cls) -> bool:
+        return cls.down_since is not None
+
+
+@asynccontextmanager
+async def backend_request(endpoint: str, url: str, **kwargs):
+    started_at = time.monotonic()
+    status = "error"
+    try:
+        with span("backend", endpoint):
+            async with aiohttp.request("GET", url, **kwargs) as response:
+                status = str(response.status)
+                BackendStatus.report(response.status < 500)
+                yield response
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        if status == "error":
+            BackendStatus.report(False)
+        raise
+    finally:
+        BACKEND_LATENCY.observe(time.monotonic() - started_at, endpoint=endpoint, status=status)
 
 
 class Book:
@@ -235,36 +266,35 @@ class BookAPI:
     @staticmethod
     async def download(book_id: int, file_type: str) -> Optional[BytesResult]:
         try:
-            async with aiohttp.ClientSession(timeout=ClientTimeout(total=600)) as session:
-                async with session.get(f"{Config.FLIBUSTA_SERVER}/book/download/{book_id}/{file_type}",
-                                       timeout=None) as response:
-                    if response.status != 200:
-                        return None
-                    return BytesResult(await response.content.read())
+            async with backend_request("book_download", f"{Config.FLIBUSTA_SERVER}/book/download/{book_id}/{file_type}",
+                                       timeout=ClientTimeout(total=600)) as response:
+                if response.status != 200:
+                    return None
+                return BytesResult(await response.content.read())
         except ServerDisconnectedError:
             return None
     
     @staticmethod
     async def get_by_id(book_id: int) -> Optional[BookWithAuthorsAndSequences]:
-        async with aiohttp.request("GET", f"{Config.FLIBUSTA_SERVER}/book/{book_id}") as response:
+        async with backend_request("book_get", f"{Config.FLIBUSTA_SERVER}/book/{book_id}") as response:
             if response.status != 200:
                 return None
             return BookWithAuthorsAndSequences(await response.json())
 
     @staticmethod
-    async def search(query: str, allowed_langs: List[str], limit: int, page: int) -> Optional[BookSearchResult]:
-        async with aiohttp.request(
-            "GET",
-                f"{Config.FLIBUSTA_SERVER}/book/search/{json.dumps(allowed_langs)}/{limit}/{page}/{query}"
+    async def search(query: str, allowed_langs: LangSet, limit: int, page: int) -> Optional[BookSearchResult]:
+        async with backend_request(
+            "book_search",
+                f"{Config.FLIBUSTA_SERVER}/book/search/{allowed_langs.segment}/{limit}/{page}/{query}"
         ) as response:
             if response.status != 200:
                 return None
             return BookSearchResult(await response.json())
 
     @staticmethod
-    async def get_random(allowed_langs: List[str]) -> Optional[BookWithAuthor]:
-        async with aiohttp.request("GET", 
-                                   f"{Config.FLIBUSTA_SERVER}/book/random/{json.dumps(allowed_langs)}") as response:
+    async def get_random(allowed_langs: LangSet) -> Optional[BookWithAuthor]:
+        async with backend_request("book_random", 
+                                   f"{Config.FLIBUSTA_SERVER}/book/random/{allowed_langs.segment}") as response:
             if response.status != 200:
                 return None
             return BookWithAuthor(await response.json())
@@ -421,10 +451,10 @@ class AuthorSearchResult:
 
 class AuthorAPI:
     @staticmethod
-    async def by_id(author_id: int, allowed_langs, limit: int, page: int) -> Optional[AuthorWithBooks]:
-        async with aiohttp.request(
-                "GET",
-                f"{Config.FLIBUSTA_SERVER}/author/{author_id}/{json.dumps(allowed_langs)}/{limit}/{page}") as response:
+    async def by_id(author_id: int, allowed_langs: LangSet, limit: int, page: int) -> Optional[AuthorWithBooks]:
+        async with backend_request(
+                "author_get",
+                f"{Config.FLIBUSTA_SERVER}/author/{author_id}/{allowed_langs.segment}/{limit}/{page}") as response:
             if response.status != 200:
                 return None
             response_json = await response.json()
@@ -433,20 +463,20 @@ class AuthorAPI:
             return AuthorWithBooks(response_json)
 
     @staticmethod
-    async def search(query: str, allowed_langs: List[str], limit: int, page: int) -> Optional[AuthorSearchResult]:
-        async with aiohttp.request(
-                "GET",
-                f"{Config.FLIBUSTA_SERVER}/author/search/{json.dumps(allowed_langs)}/{limit}/{page}/{query}") \
+    async def search(query: str, allowed_langs: LangSet, limit: int, page: int) -> Optional[AuthorSearchResult]:
+        async with backend_request(
+                "author_search",
+                f"{Config.FLIBUSTA_SERVER}/author/search/{allowed_langs.segment}/{limit}/{page}/{query}") \
                     as response:
             if response.status != 200:
                 return None
             return AuthorSearchResult(await response.json())
 
     @staticmethod
-    async def get_random(allowed_langs: List[str]) -> Optional[Author]:
-        async with aiohttp.request(
-                "GET",
-                f"{Config.FLIBUSTA_SERVER}/author/random/{json.dumps(allowed_langs)}") as response:
+    async def get_random(allowed_langs: LangSet) -> Optional[Author]:
+        async with backend_request(
+                "author_random",
+                f"{Config.FLIBUSTA_SERVER}/author/random/{allowed_langs.segment}") as response:
             if response.status != 200:
                 return None
             return Author(await response.json())
@@ -520,28 +550,28 @@ class SequenceSearchResult:
 
 class SequenceAPI:
     @staticmethod
-    async def get_by_id(seq_id: int, allowed_langs: List[str], limit: int, page: int) -> Optional[SequenceWithBooks]:
-        async with aiohttp.request(
-                "GET",
-                f"{Config.FLIBUSTA_SERVER}/sequence/{seq_id}/{json.dumps(allowed_langs)}/{limit}/{page}") as response:
+    async def get_by_id(seq_id: int, allowed_langs: LangSet, limit: int, page: int) -> Optional[SequenceWithBooks]:
+        async with backend_request(
+                "sequence_get",
+                f"{Config.FLIBUSTA_SERVER}/sequence/{seq_id}/{allowed_langs.segment}/{limit}/{page}") as response:
             if response.status != 200:
                 return None
             response_json = await response.json()
             return SequenceWithBooks(response_json)
 
     @staticmethod
-    async def search(query: str, allowed_langs: List[str], limit: int, page: int) -> Optional[SequenceSearchResult]:
-        async with aiohttp.request(
-                "GET",
-                f"{Config.FLIBUSTA_SERVER}/sequence/search/{json.dumps(allowed_langs)}/{limit}/{page}/{query}"
+    async def search(query: str, allowed_langs: LangSet, limit: int, page: int) -> Optional[SequenceSearchResult]:
+        async with backend_request(
+                "sequence_search",
+                f"{Config.FLIBUSTA_SERVER}/sequence/search/{allowed_langs.segment}/{limit}/{page}/{query}"
         ) as response:
             if response.status != 200:
                 return None
             return SequenceSearchResult(await response.json())
 
     @staticmethod
-    async def get_random(allowed_langs: List[str]) -> Optional[SequenceWithAuthors]:
-        async with aiohttp.request("GET", f"{Config.FLIBUSTA_SERVER}/sequence/random/{json.dumps(allowed_langs)}"
+    async def get_random(allowed_langs: LangSet) -> Optional[SequenceWithAuthors]:
+        async with backend_request("sequence_random", f"{Config.FLIBUSTA_SERVER}/sequence/random/{allowed_langs.segment}"
                                    ) as response:
             if response.status != 200:
                 return None
@@ -562,7 +592,10 @@ class BookAnnotation:
 
     @property
     def body(self):
-        return TAG_RE.sub('', self.obj.get("body", ""))
+        return sanitize(self.obj.get("body", ""))
+
+    def pages(self, limit: int) -> List[str]:
+        return split_pages(self.obj.get("body", ""), limit)
 
     @property
     def photo_link(self):
@@ -574,7 +607,7 @@ class BookAnnotation:
 class BookAnnotationAPI:
     @staticmethod
     async def get_by_book_id(book_id: int) -> Optional[BookAnnotation]:
-        async with aiohttp.request("GET", f"{Config.FLIBUSTA_SERVER}/annotation/book/{book_id}") as response:
+        async with backend_request("book_annotation", f"{Config.FLIBUSTA_SERVER}/annotation/book/{book_id}") as response:
             if response.status != 200:
                 return None
             return BookAnnotation(await response.json())
@@ -594,7 +627,10 @@ class AuthorAnnotation:
 
     @property
     def body(self):
-        return TAG_RE.sub('', self.obj.get("body", "")).replace("[b]", "").replace("[/b]", "").replace("\n\n\n", "\n\n")
+        return sanitize(self.obj.get("body", ""))
+
+    def pages(self, limit: int) -> List[str]:
+        return split_pages(self.obj.get("body", ""), limit)
 
     @property
     def photo_link(self):
@@ -606,7 +642,7 @@ class AuthorAnnotation:
 class AuthorAnnotationAPI:
     @staticmethod
     async def get_by_author_id(book_id: int) -> Optional[AuthorAnnotation]:
-        async with aiohttp.request("GET", f"{Config.FLIBUSTA_SERVER}/annotation/author/{book_id}") as response:
+        async with backend_request("author_annotation", f"{Config.FLIBUSTA_SERVER}/annotation/author/{book_id}") as response:
             if response.status != 200:
                 return None
             return AuthorAnnotation(await response.json())
@@ -630,12 +666,12 @@ class UpdateLog:
 class UpdateLogAPI:
     @staticmethod
     async def get_by_day(start_date: date, end_date: date, 
-                         allowed_langs: List[str], limit: int, page: int) -> Optional[UpdateLog]:
+                         allowed_langs: LangSet, limit: int, page: int) -> Optional[UpdateLog]:
         start_date_d = start_date.isoformat()
         end_date_d = end_date.isoformat()
-        async with aiohttp.request(
-            "GET", 
-            f"{Config.FLIBUSTA_SERVER}/book/update_log_range/{start_date_d}/{end_date_d}/{json.dumps(allowed_langs)}/{limit}/{page}"
+        async with backend_request(
+            "update_log", 
+            f"{Config.FLIBUSTA_SERVER}/book/update_log_range/{start_date_d}/{end_date_d}/{allowed_langs.segment}/{limit}/{page}"
                 ) as response:
             if response.status != 200:
                 return None
@@ -644,6 +680,6 @@ class UpdateLogAPI:
 
 class DownloadAPI:
     @staticmethod
-    async def update(book_id: int, user_id: int):
-        async with aiohttp.request("GET", f"{Config.FLIBUSTA_SERVER}/download_counter/update/{book_id}/{user_id}") as resp:
-            pass
+    async def update(book_id: int, user_id: int) -> bool:
+        async with backend_request("download_counter", f"{Config.FLIBUSTA_SERVER}/download_counter/update/{book_id}/{user_id}") as resp:
+            return resp.status == 200
@@ -0,0 +1,74 @@
+from typing import Dict, Iterable, Iterator, Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+# bit of every language in the settings.langs mask, append only: the masks are stored in the database
+LANG_BITS: Tuple[str, ...] = ("ru", "be", "uk")
+
+
+class LangSet:
+    """
+    Set of languages stored as a bitmask over LANG_BITS.
+
+    Instances are interned, one per mask, so equal sets are the same object: they are cheap cache keys,
+    and the canonical (sorted) language tuple and the backend URL segment are built once per set.
+    """
+    __slots__ = ("mask", "langs", "segment")
+
+    _interned: Dict[int, "LangSet"] = {}
+
+    mask: int
+    langs: Tuple[str, ...]
+    segment: str
+
+    def __new__(cls, mask: int) -> "LangSet":
+        lang_set = cls._interned.get(mask)
+        if lang_set is None:
+            if mask < 0 or mask >> len(LANG_BITS):
+                raise ValueError(f"Unknown languages in mask {mask:#x}")
+            lang_set = object.__new__(cls)
+            lang_set.mask = mask
+            lang_set.langs = tuple(sorted(lang for i, lang in enumerate(LANG_BITS) if mask & (1 << i)))
+            lang_set.segment = json.dumps(list(lang_set.langs))
+            cls._interned[mask] = lang_set
+        return lang_set
+
+    @classmethod
+    def of(cls, langs: Iterable[str]) -> "LangSet":
+        mask = 0
+        for lang in langs:
+            try:
+                mask |= 1 << LANG_BITS.index(lang)
+            except ValueError:
+                raise ValueError(f"Unknown language {lang!r}") from None
+        return cls(mask)
+
+    def with_lang(self, lang: str, enabled: bool) -> "LangSet":
+        bit = LangSet.of((lang,)).mask
+        return LangSet(self.mask | bit if enabled else self.mask & ~bit)
+
+    def __reduce__(self):
+        return LangSet, (self.mask,)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.langs)
+
+    def __len__(self) -> int:
+        return len(self.langs)
+
+    def __contains__(self, lang: object) -> bool:
+        return lang in self.langs
+
+    def __bool__(self) -> bool:
+        return self.mask != 0
+
+    def __repr__(self) -> str:
+        return f"LangSet({','.join(self.langs)})"
+
+
+ALL_LANGS = LangSet((1 << len(LANG_BITS)) - 1)
+DEFAULT_LANGS = LangSet.of(("ru",))
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from functools import wraps
+from typing import Set
+
+from aiohttp import web
+
+from tracing import Tracer
+
+
+class Lifecycle:
+    """Tracks background tasks so that shutdown can wait for them instead of killing them."""
+
+    accepting = True
+    tasks: Set[asyncio.Task] = set()
+
+    @classmethod
+    def spawn(cls, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        cls.tasks.add(task)
+        task.add_done_callback(cls._on_done)
+        return task
+
+    @classmethod
+    def _on_done(cls, task: asyncio.Task):
+        cls.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error("Background task failed", exc_info=task.exception())
+
+    @classmethod
+    def background(cls, fn):
+        # like Dispatcher.async_task, but the task is tracked
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            cls.spawn(Tracer.run(fn(*args, **kwargs), fn.__name__))
+        return wrapper
+
+    @classmethod
+    async def drain(cls, timeout: float):
+        cls.accepting = False
+        if not cls.tasks:
+            return
+        logging.info(f"Waiting for {len(cls.tasks)} background tasks")
+        _, pending = await asyncio.wait(set(cls.tasks), timeout=timeout)
+        if pending:
+            logging.warning(f"Cancelling {len(pending)} background tasks")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+@web.middleware
+async def reject_when_stopping(request: web.Request, handler):
+    if not Lifecycle.accepting:
+        raise web.HTTPServiceUnavailable()
+    return await handler(request)
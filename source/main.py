@@ -1,76 +1,123 @@
-import re
-from datetime import date, timedelta, datetime
+import logging
+import time
+from datetime import date
+from typing import Optional
 
 from aiogram import Bot, Dispatcher, types, filters, exceptions
-from aiogram.utils.executor import start_webhook
+from aiogram.dispatcher.webhook import BaseResponse, WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
 
 import analytics
 import strings
-from filters import CallbackDataRegExFilter, InlineQueryRegExFilter, IsTextMessageFilter
+import stats
+from filters import InlineQueryRegExFilter, IsTextMessageFilter, IsAdminFilter, RouterFilter
 from config import Config
-from flibusta_server import BookAPI
-from send import Sender
-from db import TelegramUserDB, SettingsDB, prepare_db
-from utils import ignore, make_settings_keyboard, make_settings_lang_keyboard, download_by_series_keyboard, beta_testing_keyboard
+from send import Sender, ELEMENTS_ON_PAGE
+from supervisor import Supervisor
+from db import TelegramUserDB, SettingsDB, DigestSubscription, DigestSubscriptionDB, prepare_db, close_db
+from digest import DigestSender
+from download_counter import DownloadCounter
+from lifecycle import Lifecycle, reject_when_stopping
+from metrics import metrics_handler
+from router import Router, RouteMatch
+from profiler import Profiler
+from random_pool import start_random_pools, stop_random_pools
+from search_index import SearchIndex
+from offline import OfflineStore
+from telegram_api import InstrumentedBot, FastBot, webhook_reply
+from tracing import Tracer, TracingMiddleware
+from update_log import UpdateLogCache, update_log_ranges
+from update_queue import UpdateQueue, FastAckRequestHandler
+from utils import ignore, make_settings_keyboard, make_settings_lang_keyboard, download_by_series_keyboard, beta_testing_keyboard, \
+    SEARCH_KEYBOARD, DIGEST_KEYBOARDS, LANGS
+
+
+STARTED_AT = time.monotonic()
+
+bot = InstrumentedBot(token=Config.BOT_TOKEN)
+dp = Dispatcher(bot)
 
+dp.middleware.setup(TracingMiddleware())
 
-bot = Bot(token=Config.BOT_TOKEN)
-dp = Dispatcher(bot)
+messages = Router()
+callbacks = Router()
 
 Sender.configure(bot)
+FastBot.configure(bot, Config.BOT_TOKEN)
 
 
-@dp.message_handler(commands=["start"])
+@messages.route(r"/start(?:@\w+)?(?:\s+([^_\s]+)_([0-9]+))?(?:\s|$)", str, int)
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
-async def start_handler(msg: types.Message):
+async def start_handler(msg: types.Message, file_type: Optional[str], book_id: Optional[int]):
     await TelegramUserDB.create_or_update(msg)
-    try:
-        await analytics.analyze(msg.text, "get_shared_book", msg.from_user.id)
-        file_type, book_id = (msg["text"].split(' ')[1].split("_"))
-        await Sender.send_book(msg, int(book_id), file_type)
-    except (ValueError, IndexError):
-        await analytics.analyze(msg.text, "start", msg.from_user.id)
-        await msg.reply(strings.start_message.format(name=msg.from_user.first_name))
+    if book_id is not None:
+        analytics.analyze("get_shared_book", msg)
+        await Sender.download_book(msg, book_id, file_type)
+    else:
+        analytics.analyze("start", msg)
+        return await webhook_reply(msg, strings.start_message.format(name=msg.from_user.first_name))
 
 
-@dp.message_handler(commands=["help"])
+@messages.command("help")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def help_handler(msg: types.Message):
     async with analytics.Analyze("help", msg):
-        await msg.reply(strings.help_msg)
+        return await webhook_reply(msg, strings.help_msg)
 
 
-@dp.message_handler(commands=["commands"])
+@messages.command("commands")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def help_commands_handler(msg: types.Message):
     async with analytics.Analyze("commands", msg):
-        await msg.reply(strings.commands_msg)
+        return await webhook_reply(msg, strings.commands_msg)
 
 
-@dp.message_handler(commands=["info"])
+@messages.command("info")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def info_handler(msg: types.Message):
     async with analytics.Analyze("info", msg):
-        await msg.reply(strings.info_msg, disable_web_page_preview=True)
+        return await webhook_reply(msg, strings.info_msg, disable_web_page_preview=True)
 
 
-@dp.message_handler(commands=["settings"])
+@messages.command("settings")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def settings(msg: types.Message):
     async with analytics.Analyze("settings", msg):
         await TelegramUserDB.create_or_update(msg)
-        await msg.reply("Настройки: ", reply_markup=await make_settings_keyboard())
+        return await webhook_reply(msg, "Настройки: ", reply_markup=await make_settings_keyboard())
 
 
-@dp.message_handler(commands=["beta_functions"])
+@messages.command("beta_functions")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def beta_test_functions(msg: types.Message):
     async with analytics.Analyze("beta_test_functions", msg):
         await TelegramUserDB.create_or_update(msg)
-        await msg.reply("Нет")
+        return await webhook_reply(msg, "Нет")
+
+
+@dp.message_handler(IsAdminFilter(), commands=["stats"])
+@ignore((exceptions.BotBlocked, exceptions.BadRequest))
+async def stats_handler(msg: types.Message):
+    await msg.reply(await stats.render_summary(), parse_mode="HTML")
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^settings_main$"))
+@dp.message_handler(IsAdminFilter(), commands=["profile"])
+@Lifecycle.background
+@ignore((exceptions.BotBlocked, exceptions.BadRequest))
+async def profile_handler(msg: types.Message):
+    args = msg.get_args()
+    duration = float(args) if args and args.isdigit() else 30
+    await msg.reply(f"Профилирование {min(duration, Profiler.MAX_DURATION):.0f} сек...")
+    path = await Profiler.run(duration)
+    if path is None:
+        await msg.reply("Профилирование уже запущено!")
+        return
+    for suffix in (".collapsed", ".coroutines.json"):
+        await bot.send_document(msg.chat.id, types.InputFile(path + suffix), reply_to_message_id=msg.message_id)
+
+
+@callbacks.route(r"settings_main$")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def settings_main(query: types.CallbackQuery):
     async with analytics.Analyze("settings_main", query):
@@ -78,7 +125,7 @@ async def settings_main(query: types.CallbackQuery):
         await query.message.edit_text("Настройки:", reply_markup=await make_settings_keyboard())
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^langs_settings$"))
+@callbacks.route(r"langs_settings$")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def lang_setup(query: types.CallbackQuery):
     async with analytics.Analyze("lang_settings", query):
@@ -86,24 +133,18 @@ async def lang_setup(query: types.CallbackQuery):
         await query.message.edit_text("Языки:", reply_markup=await make_settings_lang_keyboard(query.from_user.id))
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^(ru|uk|be)_(on|off)$"))
+@callbacks.route(rf"({'|'.join(lang for lang, _ in LANGS)})_(on|off)$")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
-async def lang_setup_changer(query: types.CallbackQuery):
+async def lang_setup_changer(query: types.CallbackQuery, lang: str, set_: str):
     async with analytics.Analyze("lang_settings_change", query):
         await TelegramUserDB.create_or_update(query)
         settings = await SettingsDB.get(query.from_user.id)
-        lang, set_ = query.data.split('_')
-        if lang == "uk":
-            settings.allow_uk = (set_ == "on")
-        if lang == "be":
-            settings.allow_be = (set_ == "on")
-        if lang == "ru":
-            settings.allow_ru = (set_ == "on")
+        settings.langs = settings.langs.with_lang(lang, set_ == "on")
         await SettingsDB.update(settings)
         await query.message.edit_reply_markup(await make_settings_lang_keyboard(query.from_user.id))
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^beta_testing$"))
+@callbacks.route(r"beta_testing$")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def beta_testing_menu(query: types.CallbackQuery):
     async with analytics.Analyze("beta_testing_menu", query):
@@ -114,13 +155,12 @@ async def beta_testing_menu(query: types.CallbackQuery):
         )
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^beta_test_(on|off)$"))
+@callbacks.route(r"beta_test_(on|off)$")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
-async def beta_testing_choose(query: types.CallbackQuery):
+async def beta_testing_choose(query: types.CallbackQuery, new_status: str):
     async with analytics.Analyze("beta_testing_choose", query):
         await TelegramUserDB.create_or_update(query)
         settings = await SettingsDB.get(query.from_user.id)
-        new_status = query.data.replace("beta_test_", "")
         if new_status == "on":
             settings.beta_testing = True
         else:
@@ -129,24 +169,63 @@ async def beta_testing_choose(query: types.CallbackQuery):
         await query.message.edit_reply_markup(await beta_testing_keyboard(query.from_user.id))
 
 
+def digest_text(subscription: DigestSubscription) -> str:
+    return strings.digest_msg.format(period=strings.digest_periods[subscription.period],
+                                     authors=len(subscription.author_ids), series=len(subscription.sequence_ids))
+
+
+@messages.command("digest")
+@ignore((exceptions.BotBlocked, exceptions.BadRequest))
+async def digest_settings(msg: types.Message):
+    async with analytics.Analyze("digest", msg):
+        await TelegramUserDB.create_or_update(msg)
+        subscription = await DigestSubscriptionDB.get(msg.from_user.id)
+        return await webhook_reply(msg, digest_text(subscription),
+                                   reply_markup=DIGEST_KEYBOARDS[subscription.period])
+
+
+@callbacks.route(r"digest_(d|w|off)$", str)
+@ignore((exceptions.BotBlocked, exceptions.BadRequest))
+async def digest_period_changer(query: types.CallbackQuery, period: str):
+    async with analytics.Analyze("digest_change", query):
+        await TelegramUserDB.create_or_update(query)
+        await DigestSubscriptionDB.set_period(query.from_user.id, None if period == "off" else period)
+        subscription = await DigestSubscriptionDB.get(query.from_user.id)
+        await query.message.edit_text(digest_text(subscription), reply_markup=DIGEST_KEYBOARDS[subscription.period])
+
+
+@callbacks.route(r"follow_(a|s)_([0-9]+)$", str, int)
+@ignore((exceptions.BotBlocked, exceptions.BadRequest))
+async def follow_changer(query: types.CallbackQuery, type_: str, id_: int):
+    async with analytics.Analyze("digest_follow", query):
+        await TelegramUserDB.create_or_update(query)
+        if type_ == "a":
+            following = await DigestSubscriptionDB.toggle_author(query.from_user.id, id_)
+        else:
+            following = await DigestSubscriptionDB.toggle_sequence(query.from_user.id, id_)
+        if following:
+            await query.answer("Новинки будут в рассылке, настроить: /digest", show_alert=True)
+        else:
+            await query.answer("Подписка отменена")
+
 
-@dp.message_handler(regexp=re.compile(r'^/a_([0-9]+)$'))
+@messages.route(r"/a_([0-9]+)$", int)
 @ignore((exceptions.BotBlocked, exceptions.MessageCantBeEdited, exceptions.BadRequest))
-async def search_books_by_author(msg: types.Message):
+async def search_books_by_author(msg: types.Message, author_id: int):
     async with analytics.Analyze("get_books_by_author", msg):
         await TelegramUserDB.create_or_update(msg)
-        await Sender.search_books_by_author(msg, int(msg.text.split('_')[1]), 1)
+        await Sender.search_books_by_author(msg, author_id, 1)
 
 
-@dp.message_handler(regexp=re.compile(r'^/s_([0-9]+)$'))
+@messages.route(r"/s_([0-9]+)$", int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked))
-async def search_book_by_series(msg: types.Message):
+async def search_book_by_series(msg: types.Message, series_id: int):
     async with analytics.Analyze("get_book_by_series", msg):
         await TelegramUserDB.create_or_update(msg)
-        await Sender.search_books_by_series(msg, int(msg.text.split("_")[1]), 1)
+        await Sender.search_books_by_series(msg, series_id, 1)
 
 
-@dp.message_handler(commands=['random_book'])
+@messages.command("random_book")
 @ignore((exceptions.BadRequest, exceptions.BotBlocked))
 async def get_random_book(msg: types.Message):
     async with analytics.Analyze("get_random_book", msg):
@@ -154,7 +233,7 @@ async def get_random_book(msg: types.Message):
         await Sender.get_random_book(msg)
 
 
-@dp.message_handler(commands=['random_author'])
+@messages.command("random_author")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def get_random_author(msg: types.Message):
     async with analytics.Analyze("get_random_author", msg):
@@ -162,7 +241,7 @@ async def get_random_author(msg: types.Message):
         await Sender.get_random_author(msg)
 
 
-@dp.message_handler(commands=["random_series"])
+@messages.command("random_series")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def get_random_series(msg: types.Message):
     async with analytics.Analyze("get_random_series", msg):
@@ -170,143 +249,133 @@ async def get_random_series(msg: types.Message):
         await Sender.get_random_sequence(msg)
 
 
-@dp.message_handler(commands=['donate'])
+@messages.command("donate")
 @ignore((exceptions.BotBlocked, exceptions.BadRequest))
 async def donation(msg: types.Message):
     async with analytics.Analyze("donation", msg):
-        await msg.reply(strings.donate_msg, parse_mode='HTML')
+        return await webhook_reply(msg, strings.donate_msg, parse_mode='HTML')
 
 
-@dp.message_handler(regexp=re.compile(r'^/(fb2|fb2\+zip|epub|mobi|djvu|pdf|doc)_[0-9]+$'))
-@dp.async_task
+@messages.route(r"/(fb2|fb2\+zip|epub|mobi|djvu|pdf|doc)_([0-9]+)$", str, int)
+@Lifecycle.background
 @ignore(exceptions.BotBlocked)
-async def download_book(msg: types.Message):
+async def download_book(msg: types.Message, file_type: str, book_id: int):
     async with analytics.Analyze("download", msg):
-        file_type, book_id = msg.text.replace('/', '').split('_')
-        await Sender.send_book(msg, int(book_id), file_type)
+        await Sender.download_book(msg, book_id, file_type)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^download_c_([0-9]+)$"))
-async def send_download_by_serial_keyboard(query: types.CallbackQuery):
+@callbacks.route(r"download_c_([0-9]+)$", int)
+async def send_download_by_serial_keyboard(query: types.CallbackQuery, series_id: int):
     async with analytics.Analyze("download_by_serial_keyboard", query):
-        series_id = int(query.data.replace("download_c_", ""))
         await query.message.edit_text(
             strings.choose_priority_format,
             reply_markup=await download_by_series_keyboard(series_id)
         )
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r"^download_c_(fb2|fb2\+zip|epub|mobi)_([0-9]+)$"))
-@dp.async_task
-async def download_books_by_series(query: types.CallbackQuery):
+@callbacks.route(r"download_c_(fb2|fb2\+zip|epub|mobi)_([0-9]+)$", str, int)
+@Lifecycle.background
+async def download_books_by_series(query: types.CallbackQuery, file_type: str, series_id: int):
     async with analytics.Analyze("download_series", query):
-        file_type, series_id = query.data.replace("download_c_", "").split("_")
-        await Sender.send_books_by_series(query, int(series_id), file_type)
+        await Sender.send_books_by_series(query, series_id, file_type)
 
 
-@dp.message_handler(regexp=re.compile(r"^/b_info_[0-9]+$"))
+@messages.route(r"/b_info_([0-9]+)$", int)
 @ignore((exceptions.BadRequest, exceptions.BotBlocked))
-async def get_book_detail(msg: types.Message):
+async def get_book_detail(msg: types.Message, book_id: int):
     async with analytics.Analyze("book_detail", msg):
-        book_id = int(msg.text.split("/b_info_")[1])
         await Sender.send_book_detail(msg, book_id)
 
 
-@dp.message_handler(regexp=re.compile(r"^/a_info_[0-9]+$"))
+@messages.route(r"/a_info_([0-9]+)$", int)
 @ignore((exceptions.BadRequest, exceptions.BotBlocked))
-async def get_author_annotation(msg: types.Message):
+async def get_author_annotation(msg: types.Message, author_id: int):
     async with analytics.Analyze("author_annotation", msg):
-        author_id = int(msg.text.split("/a_info_")[1])
         await Sender.send_author_annotation(msg, author_id)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^b_([0-9]+)'))
+@callbacks.route(r"b_([0-9]+)", int)
 @ignore((exceptions.BotBlocked, exceptions.MessageCantBeEdited, exceptions.BadRequest))
-async def search_books_by_title(callback: types.CallbackQuery):
+async def search_books_by_title(callback: types.CallbackQuery, page: int):
     async with analytics.Analyze("search_book_by_title", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
-        await Sender.search_books(msg, int(callback.data.split('_')[1]))
+        await Sender.search_books(msg, page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^a_([0-9]+)'))
+@callbacks.route(r"a_([0-9]+)", int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def search_authors(callback: types.CallbackQuery):
+async def search_authors(callback: types.CallbackQuery, page: int):
     async with analytics.Analyze("search_authors", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
-        await Sender.search_authors(msg, int(callback.data.split('_')[1]))
+        await Sender.search_authors(msg, page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^s_([0-9]+)'))
+@callbacks.route(r"s_([0-9]+)", int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def search_series(callback: types.CallbackQuery):
+async def search_series(callback: types.CallbackQuery, page: int):
     async with analytics.Analyze("search_series", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
-        await Sender.search_series(msg, int(callback.data.split('_')[1]))
+        await Sender.search_series(msg, page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^ba_([0-9]+)'))
+@callbacks.route(r"ba_([0-9]+)", int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def get_books_by_author(callback: types.CallbackQuery):
+async def get_books_by_author(callback: types.CallbackQuery, page: int):
     async with analytics.Analyze("get_books_by_author", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
         await TelegramUserDB.create_or_update(msg.reply_to_message)
-        await Sender.search_books_by_author(msg, int(msg.reply_to_message.text.split('_')[1]),
-                                            int(callback.data.split('_')[1]))
+        await Sender.search_books_by_author(msg, int(msg.reply_to_message.text.split('_')[1]), page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^bs_([0-9]+)'))
+@callbacks.route(r"bs_([0-9]+)", int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def get_books_by_series(callback: types.CallbackQuery):
+async def get_books_by_series(callback: types.CallbackQuery, page: int):
     async with analytics.Analyze("get_books_by_series", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
         await TelegramUserDB.create_or_update(msg.reply_to_message)
-        await Sender.search_books_by_series(msg, int(msg.reply_to_message.text.split("_")[1]),
-                                            int(callback.data.split('_')[1]))
+        await Sender.search_books_by_series(msg, int(msg.reply_to_message.text.split("_")[1]), page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^b_ann_([0-9]+)_([0-9]+)'))
+@callbacks.route(r"b_ann_([0-9]+)_([0-9]+)", int, int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def get_book_annotation(callback: types.CallbackQuery):
+async def get_book_annotation(callback: types.CallbackQuery, book_id: int, page: int):
     async with analytics.Analyze("get_book_annotation", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
-        book_id, page = callback.data.replace("b_ann_", "").split("_")
         await TelegramUserDB.create_or_update(msg.reply_to_message)
-        await Sender.send_book_annotation(msg, int(book_id), int(page))
+        await Sender.send_book_annotation(msg, book_id, page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^a_ann_([0-9]+)_([0-9]+)'))
+@callbacks.route(r"a_ann_([0-9]+)_([0-9]+)", int, int)
 @ignore((exceptions.MessageCantBeEdited, exceptions.BotBlocked, exceptions.BadRequest))
-async def get_author_annotation_update(callback: types.CallbackQuery):
+async def get_author_annotation_update(callback: types.CallbackQuery, author: int, page: int):
     async with analytics.Analyze("get_author_annotation", callback):
         msg: types.Message = callback.message
         if not msg.reply_to_message or not msg.reply_to_message.text:
             return await msg.reply("Ошибка :( Попробуйте еще раз!")
-        author, page = callback.data.replace("a_ann_", "").split("_")
         await TelegramUserDB.create_or_update(msg.reply_to_message)
-        await Sender.send_author_annotation_edit(msg, int(author), int(page))
+        await Sender.send_author_annotation_edit(msg, author, page)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^book_detail_([0-9]+)'))
+@callbacks.route(r"book_detail_([0-9]+)", int)
 @ignore((exceptions.BadRequest, exceptions.BotBlocked))
-async def get_book_detail_callback(callback: types.CallbackQuery):
+async def get_book_detail_callback(callback: types.CallbackQuery, book_id: int):
     async with analytics.Analyze("book_detail", callback):
-        book_id = int(callback.data.replace("book_detail_", ""))
         await Sender.send_book_detail_edit(callback.message, book_id)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(r'^remove_cache$'))
+@callbacks.route(r"remove_cache$")
 @ignore((exceptions.BadRequest, exceptions.BotBlocked))
 async def remove_cache(callback: types.CallbackQuery):
     async with analytics.Analyze("remove_cache", callback):
@@ -319,36 +388,43 @@ async def remove_cache(callback: types.CallbackQuery):
         await Sender.send_book(reply_to, int(book_id), file_type)
 
 
-@dp.message_handler(commands=['update_log'])
+@messages.command("update_log")
 @ignore(exceptions.BotBlocked)
 @ignore(exceptions.BadRequest)
 async def get_update_log_message(msg: types.Message):
     async with analytics.Analyze("get_update_log_message", msg):
         await TelegramUserDB.create_or_update(msg)
-        end_date_t = date.today() - timedelta(days=1)
-        end_date = end_date_t.isoformat()
-        start_date_3 = (end_date_t - timedelta(days=2)).isoformat()
-        start_date_7 = (end_date_t - timedelta(days=6)).isoformat()
-        start_date_30 = (end_date_t - timedelta(days=30)).isoformat()
+        ranges = update_log_ranges(date.today())
         keyboard = types.InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            types.InlineKeyboardButton("За 1 день", callback_data=f"ul_d_{end_date}_{end_date}_1"),
-            types.InlineKeyboardButton("За 3 дня", callback_data=f"ul_t_{start_date_3}_{end_date}_1"),
-            types.InlineKeyboardButton("За 7 дней", callback_data=f"ul_w_{start_date_7}_{end_date}_1"),
-            types.InlineKeyboardButton("За 30 дней", callback_data=f"ul_m_{start_date_30}_{end_date}_1")
-        )
+        keyboard.add(*(
+            types.InlineKeyboardButton(
+                title, callback_data=f"ul_{type_}_{ranges[type_][0].isoformat()}_{ranges[type_][1].isoformat()}_1"
+            )
+            for type_, title in (("d", "За 1 день"), ("t", "За 3 дня"), ("w", "За 7 дней"), ("m", "За 30 дней"))
+        ))
         await msg.reply("Обновления за: ", reply_markup=keyboard)
 
 
-@dp.callback_query_handler(CallbackDataRegExFilter(
-    r'^ul_[dtwm]_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9])+$')
-)
-async def get_day_update_log_range(callback: types.CallbackQuery):
+@callbacks.route(r"ul_([dtwm])_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9]{4}-[0-9]{2}-[0-9]{2})_([0-9]+)$",
+                 str, date.fromisoformat, date.fromisoformat, int)
+async def get_day_update_log_range(callback: types.CallbackQuery, type_: str, start_date: date, end_date: date,
+                                   page: int):
     async with analytics.Analyze("get_update_log", callback):
         msg: types.Message = callback.message
-        type_, raw_start_date, raw_end_date, page = callback.data[3:].split("_")
         await TelegramUserDB.create_or_update(callback)
-        await Sender.send_update_log(msg, date.fromisoformat(raw_start_date), date.fromisoformat(raw_end_date), int(page), type_)
+        await Sender.send_update_log(msg, start_date, end_date, page, type_)
+
+
+@dp.message_handler(RouterFilter(messages, lambda msg: msg.text))
+async def route_message(msg: types.Message, route: RouteMatch):
+    handler, args = route
+    return await handler(msg, *args)
+
+
+@dp.callback_query_handler(RouterFilter(callbacks, lambda query: query.data))
+async def route_callback(query: types.CallbackQuery, route: RouteMatch):
+    handler, args = route
+    return await handler(query, *args)
 
 
 @dp.message_handler(IsTextMessageFilter())
@@ -356,15 +432,7 @@ async def get_day_update_log_range(callback: types.CallbackQuery):
 async def search(msg: types.Message):
     async with analytics.Analyze("new_search_query", msg):
         await TelegramUserDB.create_or_update(msg)
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.row(
-            types.InlineKeyboardButton("По названию", callback_data="b_1")
-        )
-        keyboard.row(
-            types.InlineKeyboardButton("По авторам", callback_data="a_1"),
-            types.InlineKeyboardButton("По сериям", callback_data="s_1")
-        )
-        await msg.reply("Поиск: ", reply_markup=keyboard)
+        return await webhook_reply(msg, "Поиск: ", reply_markup=SEARCH_KEYBOARD)
 
 
 @dp.inline_handler(InlineQueryRegExFilter(r'^share_([\d]+)$'))
@@ -372,7 +440,7 @@ async def search(msg: types.Message):
 async def share_book(query: types.InlineQuery):
     async with analytics.Analyze("share_book", query):
         book_id = int(query.query.split("_")[1])
-        book = await BookAPI.get_by_id(book_id)
+        book, _ = await OfflineStore.get_book(book_id)
 
         if book is None:
             return
@@ -386,25 +454,91 @@ async def share_book(query: types.InlineQuery):
                 parse_mode="markdown",
                 disable_web_page_preview=True
             )
-        )])
+        )], cache_time=3600)
+
+
+@dp.inline_handler()
+@ignore((exceptions.InvalidQueryID, exceptions.BotBlocked))
+async def search_books_inline(query: types.InlineQuery):
+    async with analytics.Analyze("inline_search", query):
+        await Sender.search_books_inline(query)
+
+
+async def process_update(update: types.Update):
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    results = await dp.process_update(update)
+    # the webhook is already answered in fast ack mode, send replies meant for it separately
+    for result in results or ():
+        if isinstance(result, BaseResponse):
+            # ignored like in the handlers, which no longer see the errors of their webhook replies
+            try:
+                await result.execute_response(bot)
+            except (exceptions.BotBlocked, exceptions.BadRequest):
+                pass
 
 
 async def on_startup(dp):
-    await prepare_db()
-    await bot.set_webhook(Config.WEBHOOK_HOST + "/")
+    Bot.set_current(bot)
+    Tracer.configure(Config.TRACE_FILE, Config.TRACE_SLOW_THRESHOLD, Config.TRACE_SAMPLE_RATE)
+    applied_migrations = await prepare_db()
+    DownloadCounter.start()
+    analytics.Analytics.start(analytics.make_backend(), Config.ANALYTICS_SAMPLE_RATE)
+    stats.Stats.start()
+    UpdateLogCache.start(ELEMENTS_ON_PAGE)
+    DigestSender.start()
+    start_random_pools()
+    SearchIndex.start()
+    OfflineStore.start()
+    if Config.FAST_ACK:
+        UpdateQueue.start(process_update, Config.UPDATE_WORKERS, Config.UPDATE_QUEUE_SIZE)
+    # with several workers the webhook belongs to the supervisor
+    if Config.WORKER_ID is None:
+        await bot.set_webhook(Config.WEBHOOK_HOST + "/")
+    await Sender.resume_series_jobs()
+    if Config.PROFILE_ON_START:
+        Lifecycle.spawn(Profiler.run(Config.PROFILE_ON_START))
+    logging.info(f"Ready for webhooks in {time.monotonic() - STARTED_AT:.2f}s "
+                 f"(migrations applied: {applied_migrations})")
 
 
 async def on_shutdown(dp):
-    await bot.delete_webhook()
+    Lifecycle.accepting = False
+    if Config.WORKER_ID is None:
+        await bot.delete_webhook()
+    if Config.FAST_ACK:
+        await UpdateQueue.stop(timeout=Config.DRAIN_TIMEOUT)
+    await Lifecycle.drain(timeout=Config.DRAIN_TIMEOUT)
+    await DownloadCounter.stop()
+    await analytics.Analytics.stop()
+    await stats.Stats.stop()
+    await UpdateLogCache.stop()
+    await DigestSender.stop()
+    await stop_random_pools()
+    await SearchIndex.stop()
+    await OfflineStore.stop()
+    await close_db()
+    await (await bot.get_session()).close()
 
 
 if __name__ == "__main__":
-    start_webhook(
-        dispatcher=dp,
-        webhook_path="/",
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=False,
-        host=Config.SERVER_HOST,
-        port=Config.SERVER_PORT
-    )
+    logging.basicConfig(level=logging.INFO)
+
+    if Config.WORKERS > 1 and Config.WORKER_ID is None:
+        Supervisor(Config.WORKERS).run()
+    else:
+        app = web.Application(middlewares=[reject_when_stopping])
+        app.router.add_get("/metrics", metrics_handler)
+
+        executor = Executor(dp, skip_updates=False)
+        executor.on_startup(on_startup)
+        executor.on_shutdown(on_shutdown)
+        executor.set_webhook(
+            webhook_path="/",
+            request_handler=FastAckRequestHandler if Config.FAST_ACK else WebhookRequestHandler,
+            web_app=app
+        )
+        executor.run_app(
+            host=Config.SERVER_HOST if Config.WORKER_ID is None else "127.0.0.1",
+            port=Config.SERVER_PORT if Config.WORKER_ID is None else Config.WORKER_BASE_PORT + Config.WORKER_ID
+        )
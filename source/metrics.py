@@ -0,0 +1,154 @@
+import bisect
+from abc import ABC, abstractmethod
+from typing import Dict, List, Tuple
+
+from aiohttp import web
+
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[n]) for n in self.labels)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def expose(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.TYPE}",
+            *self.samples()
+        ])
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self.values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.values.get(key)
+        if counts is None:
+            # per bucket counts, then +Inf count and sum
+            counts = self.values[key] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> List[str]:
+        result = []
+        for key, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                le = f'le="{bound}"'
+                result.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {total}")
+            result.append(f"{self.name}_count{_format_labels(self.labels, key)} {total}")
+            result.append(f"{self.name}_sum{_format_labels(self.labels, key)} {counts[-1]}")
+        return result
+
+
+REGISTRY: List[Metric] = []
+
+
+UPDATES = Counter("bot_updates_total", "Handled updates by handler", ("handler",))
+HANDLER_LATENCY = Histogram("bot_handler_latency_seconds", "Handler latency", ("handler",))
+BACKEND_LATENCY = Histogram("bot_backend_latency_seconds", "Flibusta server call latency", ("endpoint", "status"))
+DB_LATENCY = Histogram("bot_db_query_latency_seconds", "Database query latency", ("query",))
+TELEGRAM_LATENCY = Histogram("bot_telegram_latency_seconds", "Telegram Bot API call latency", ("method",))
+TELEGRAM_RETRY_AFTER = Counter("bot_telegram_retry_after_total", "Telegram RetryAfter errors", ("method",))
+CACHE_REQUESTS = Counter("bot_cache_requests_total", "Cache lookups by result", ("cache", "result"))
+DOWNLOADS_IN_FLIGHT = Gauge("bot_downloads_in_flight", "Book downloads in progress")
+DOWNLOAD_COUNTER_EVENTS = Counter("bot_download_counter_events_total", "Download counter reports by result", ("result",))
+UPDATE_QUEUE_DEPTH = Gauge("bot_update_queue_depth", "Updates waiting or in progress in the fast-ack queue")
+UPDATE_QUEUE_WAIT = Histogram("bot_update_queue_wait_seconds", "Time updates spend in the fast-ack queue")
+UPDATE_QUEUE_REJECTED = Counter("bot_update_queue_rejected_total", "Updates rejected because the queue is full")
+THROTTLED = Counter("bot_throttled_total", "Requests rejected by the per-user rate limit", ("kind",))
+ANALYTICS_EVENTS = Counter("bot_analytics_events_total", "Analytics events by result", ("result",))
+DIGESTS_SENT = Counter("bot_digests_sent_total", "New-book digests by result", ("period", "result"))
+WEBHOOK_REPLIES = Counter("bot_webhook_replies_total", "Replies returned in the webhook response", ("method",))
+OFFLINE_RESPONSES = Counter("bot_offline_responses_total", "Lookups in the offline store while the backend is down",
+                            ("kind", "result"))
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def merge_expositions(expositions: Dict[str, str], label: str) -> str:
+    """Merges text expositions of several processes, marking every sample with `label`."""
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for value, text in expositions.items():
+        family = ""
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("# "):
+                family = line.split(" ", 3)[2]
+                family_headers = headers.setdefault(family, [])
+                if line not in family_headers:
+                    family_headers.append(line)
+                continue
+            if "{" in line:
+                name, rest = line.split("{", 1)
+                sample = f'{name}{{{label}="{value}",{rest}'
+            else:
+                name, rest = line.split(" ", 1)
+                sample = f'{name}{{{label}="{value}"}} {rest}'
+            samples.setdefault(family, []).append(sample)
+    return "\n\n".join("\n".join(headers[f] + samples.get(f, [])) for f in headers) + "\n"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text="\n\n".join(m.expose() for m in REGISTRY) + "\n",
+                        content_type="text/plain", charset="utf-8")
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Set, Tuple
+
+import aiohttp
+
+import strings
+from cache import TTLCache
+from config import Config
+from db import PostedBookDB
+from flibusta_server import BackendStatus, BookAPI, BookWithAuthorsAndSequences, SequenceAPI, SequenceWithBooks
+from langs import LangSet
+from metrics import OFFLINE_RESPONSES
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS book (id INTEGER PRIMARY KEY, obj TEXT NOT NULL, saved_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS sequence_page (
+    id INTEGER NOT NULL, langs TEXT NOT NULL, page_size INTEGER NOT NULL, page INTEGER NOT NULL,
+    obj TEXT NOT NULL, saved_at REAL NOT NULL,
+    PRIMARY KEY (id, langs, page_size, page)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sequence_page_saved_at ON sequence_page (saved_at);
+"""
+
+
+def offline_note(saved_at: Optional[float]) -> str:
+    """Staleness mark for data served from the offline store, empty for fresh data."""
+    if saved_at is None:
+        return ""
+    return strings.offline_note.format(date=datetime.fromtimestamp(saved_at).strftime("%d.%m.%Y %H:%M"))
+
+
+class OfflineStoreDB:
+    """Backend responses by request, kept on disk. All calls block and are made from OfflineStore's thread."""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def save_book(self, book_id: int, obj: dict):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO book (id, obj, saved_at) VALUES (?, ?, ?)",
+                              (book_id, json.dumps(obj, ensure_ascii=False), time.time()))
+
+    def get_book(self, book_id: int) -> Optional[Tuple[dict, float]]:
+        row = self.conn.execute("SELECT obj, saved_at FROM book WHERE id = ?", (book_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def fresh_book_ids(self, book_ids: List[int], saved_after: float) -> Set[int]:
+        rows = self.conn.execute(
+            f"SELECT id FROM book WHERE id IN ({','.join('?' * len(book_ids))}) AND saved_at > ?",
+            (*book_ids, saved_after)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def save_sequence_page(self, key: Tuple[int, str, int, int], obj: dict):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sequence_page (id, langs, page_size, page, obj, saved_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, json.dumps(obj, ensure_ascii=False), time.time())
+            )
+
+    def get_sequence_page(self, key: Tuple[int, str, int, int]) -> Optional[Tuple[dict, float]]:
+        row = self.conn.execute(
+            "SELECT obj, saved_at FROM sequence_page WHERE id = ? AND langs = ? AND page_size = ? AND page = ?", key
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def prune_sequence_pages(self, saved_before: float):
+        with self.conn:
+            self.conn.execute("DELETE FROM sequence_page WHERE saved_at < ?", (saved_before,))
+
+
+class OfflineStore:
+    """
+    Book details and series pages as the backend last returned them, enabled by OFFLINE_STORE_FILE.
+
+    Every successful response is saved by every worker, books with cached files are also synced
+    in the background by the primary worker. While the backend is down lookups are answered from here,
+    together with the time the data was saved, so that replies can be marked with `offline_note`.
+    """
+    SYNC_INTERVAL = 60 * 60
+    SYNC_WINDOW = 500  # ids per query, below the oldest sqlite limit of host parameters
+    SYNC_PAUSE = 0.2
+    REFRESH_AFTER = 7 * 24 * 60 * 60
+    SEQUENCE_PAGES_TTL = 90 * 24 * 60 * 60
+
+    db: Optional[OfflineStoreDB] = None
+    executor: Optional[ThreadPoolExecutor] = None
+    task: Optional[asyncio.Task] = None
+    # keys saved recently, popular books are not written on every request
+    saved = TTLCache("offline_saved", max_size=50_000, ttl=60 * 60)
+
+    @classmethod
+    def start(cls):
+        if not Config.OFFLINE_STORE_FILE:
+            return
+        cls.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offline_store")
+        cls.db = OfflineStoreDB(Config.OFFLINE_STORE_FILE)
+        if Config.PRIMARY_WORKER:
+            cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
+        if cls.db is not None:
+            await cls._call(cls.db.close)
+            cls.db = None
+        if cls.executor is not None:
+            # waits for pending writes
+            cls.executor.shutdown()
+            cls.executor = None
+
+    @classmethod
+    async def _call(cls, fn: Callable, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(cls.executor, fn, *args)
+
+    @classmethod
+    def _save(cls, key: tuple, fn: Callable, *args):
+        if cls.saved.get(key) is None:
+            cls.saved.set(key, True)
+            cls.executor.submit(fn, *args).add_done_callback(cls._log_error)
+
+    @staticmethod
+    def _log_error(future: Future):
+        if future.exception() is not None:
+            logging.warning(f"Offline store write failed: {future.exception()!r}")
+
+    @classmethod
+    async def get_book(cls, book_id: int) -> Tuple[Optional[BookWithAuthorsAndSequences], Optional[float]]:
+        """The book and, when it comes from the store, the time it was saved."""
+        try:
+            book = await BookAPI.get_by_id(book_id)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if cls.db is None:
+                raise
+            book = None
+        if cls.db is None:
+            return book, None
+        if book is not None:
+            cls._save(("book", book_id), cls.db.save_book, book_id, book.obj)
+            return book, None
+        if not BackendStatus.is_down():
+            return None, None
+
+        item = await cls._call(cls.db.get_book, book_id)
+        OFFLINE_RESPONSES.inc(kind="book", result="hit" if item else "miss")
+        if item is None:
+            return None, None
+        return BookWithAuthorsAndSequences(item[0]), item[1]
+
+    @classmethod
+    async def get_sequence(cls, sequence_id: int, allowed_langs: LangSet, limit: int,
+                           page: int) -> Tuple[Optional[SequenceWithBooks], Optional[float]]:
+        try:
+            sequence = await SequenceAPI.get_by_id(sequence_id, allowed_langs, limit, page)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if cls.db is None:
+                raise
+            sequence = None
+        if cls.db is None:
+            return sequence, None
+        key = (sequence_id, ",".join(allowed_langs.langs), limit, page)
+        if sequence is not None:
+            cls._save(("sequence",) + key, cls.db.save_sequence_page, key,
+                      {"count": sequence.count, "result": sequence.obj})
+            return sequence, None
+        if not BackendStatus.is_down():
+            return None, None
+
+        item = await cls._call(cls.db.get_sequence_page, key)
+        OFFLINE_RESPONSES.inc(kind="sequence", result="hit" if item else "miss")
+        if item is None:
+            return None, None
+        return SequenceWithBooks(item[0]), item[1]
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            try:
+                await cls.sync()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Offline store sync interrupted: {e!r}")
+            await asyncio.sleep(cls.SYNC_INTERVAL)
+
+    @classmethod
+    async def sync(cls):
+        """Saves books with cached files that are missing or older than REFRESH_AFTER, so they can be sent offline."""
+        await cls._call(cls.db.prune_sequence_pages, time.time() - cls.SEQUENCE_PAGES_TTL)
+        after_id = 0
+        while not BackendStatus.is_down():
+            book_ids = await PostedBookDB.get_book_ids(after_id, cls.SYNC_WINDOW)
+            if not book_ids:
+                return
+            after_id = book_ids[-1]
+            fresh = await cls._call(cls.db.fresh_book_ids, book_ids, time.time() - cls.REFRESH_AFTER)
+            for book_id in book_ids:
+                if book_id in fresh:
+                    continue
+                if BackendStatus.is_down():
+                    return
+                book = await BookAPI.get_by_id(book_id)
+                if book is not None:
+                    await cls._call(cls.db.save_book, book_id, book.obj)
+                await asyncio.sleep(cls.SYNC_PAUSE)
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from typing import Dict, List, Optional
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+class Profiler:
+    """
+    Sampling profiler for the event loop thread.
+
+    A helper thread takes the loop thread's stack every INTERVAL seconds; stacks are written
+    in the collapsed format (flamegraph.pl, speedscope). While it runs, wall time of the
+    coroutine methods registered with `instrument` is collected as well.
+    """
+
+    INTERVAL = 0.005
+    MAX_DURATION = 300
+    FOLDER = "profiles"
+
+    active = False
+    stacks: Counter = Counter()
+    coroutine_times: Dict[str, List[float]] = {}
+
+    @classmethod
+    def _sample(cls, thread_id: int, stop: threading.Event):
+        while not stop.wait(cls.INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            cls.stacks[";".join(reversed(stack))] += 1
+
+    @classmethod
+    async def run(cls, duration: float) -> Optional[str]:
+        if cls.active:
+            return None
+        cls.active = True
+        cls.stacks = Counter()
+        cls.coroutine_times = {}
+
+        stop = threading.Event()
+        thread = threading.Thread(target=cls._sample, args=(threading.get_ident(), stop), daemon=True)
+        thread.start()
+        try:
+            await asyncio.sleep(min(duration, cls.MAX_DURATION))
+        finally:
+            stop.set()
+            cls.active = False
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+
+        os.makedirs(cls.FOLDER, exist_ok=True)
+        path = os.path.join(cls.FOLDER, time.strftime("profile-%Y%m%d-%H%M%S"))
+        with open(path + ".collapsed", "w") as f:
+            f.write("".join(f"{stack} {count}\n" for stack, count in cls.stacks.most_common()))
+        with open(path + ".coroutines.json", "w") as f:
+            f.write(json.dumps(cls.coroutine_summary(), indent=2))
+        return path
+
+    @classmethod
+    def coroutine_summary(cls) -> Dict[str, dict]:
+        result = {}
+        for name, times in sorted(cls.coroutine_times.items(), key=lambda x: -sum(x[1])):
+            times = sorted(times)
+            result[name] = {
+                "calls": len(times),
+                "total_ms": round(sum(times) * 1000, 2),
+                "p50_ms": round(times[len(times) // 2] * 1000, 2),
+                "max_ms": round(times[-1] * 1000, 2),
+            }
+        return result
+
+    @classmethod
+    def _timed(cls, name: str, fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            if not cls.active:
+                return await fn(*args, **kwargs)
+            started_at = time.monotonic()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                cls.coroutine_times.setdefault(name, []).append(time.monotonic() - started_at)
+        return wrapper
+
+    @classmethod
+    def instrument(cls, target: type):
+        for name, value in list(vars(target).items()):
+            if isinstance(value, (classmethod, staticmethod)):
+                fn = value.__func__
+                if asyncio.iscoroutinefunction(fn):
+                    setattr(target, name, type(value)(cls._timed(f"{target.__name__}.{name}", fn)))
+            elif asyncio.iscoroutinefunction(value):
+                setattr(target, name, cls._timed(f"{target.__name__}.{name}", value))
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+import aiohttp
+
+from flibusta_server import AuthorAPI, BookAPI, SequenceAPI
+from langs import ALL_LANGS, DEFAULT_LANGS, LangSet
+from metrics import cache_lookup
+
+
+class RandomPool:
+    """
+    Rendered random items per language set, so that /random_* commands do not wait for the backend.
+
+    When a pool drops below `low` it is refilled in the background up to `high`,
+    `concurrency` backend requests at a time with a pause between batches to leave the backend
+    to user requests. An empty pool falls back to a direct request.
+    """
+
+    MAX_LANG_SETS = 32
+    BATCH_PAUSE = 0.5
+
+    def __init__(self, name: str, fetch: Callable[[LangSet], Awaitable[Optional[Any]]],
+                 render: Callable[[Any], str], low: int = 5, high: int = 30, concurrency: int = 3):
+        self.name = name
+        self.fetch = fetch
+        self.render = render
+        self.low = low
+        self.high = high
+        self.concurrency = concurrency
+        self.pools: Dict[LangSet, Deque[str]] = {}
+        self.refills: Dict[LangSet, asyncio.Task] = {}
+
+    async def pop(self, lang_set: LangSet) -> Optional[str]:
+        pool = self.pools.get(lang_set)
+        if pool is None and len(self.pools) < self.MAX_LANG_SETS:
+            pool = self.pools[lang_set] = deque()
+
+        item = pool.popleft() if pool else None
+        cache_lookup(self.name, item is not None)
+        if pool is not None and len(pool) < self.low:
+            self.refill(lang_set)
+        if item is not None:
+            return item
+
+        result = await self.fetch(lang_set)
+        return self.render(result) if result is not None else None
+
+    def refill(self, lang_set: LangSet):
+        if lang_set not in self.refills:
+            self.pools.setdefault(lang_set, deque())
+            task = self.refills[lang_set] = asyncio.create_task(self._refill(lang_set))
+            task.add_done_callback(lambda _: self.refills.pop(lang_set, None))
+
+    async def _refill(self, lang_set: LangSet):
+        pool = self.pools[lang_set]
+        try:
+            while len(pool) < self.high:
+                batch = min(self.concurrency, self.high - len(pool))
+                results = await asyncio.gather(*(self.fetch(lang_set) for _ in range(batch)))
+                items = [self.render(result) for result in results if result is not None]
+                if not items:
+                    return
+                pool.extend(items)
+                await asyncio.sleep(self.BATCH_PAUSE)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"{self.name} pool {lang_set} refill failed: {e!r}")
+
+    async def stop(self):
+        tasks = list(self.refills.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+RANDOM_POOLS: Dict[str, RandomPool] = {
+    "book": RandomPool("random_book", BookAPI.get_random, lambda book: book.to_send_book),
+    "author": RandomPool("random_author", AuthorAPI.get_random, lambda author: author.to_send),
+    "sequence": RandomPool("random_sequence", SequenceAPI.get_random, lambda sequence: sequence.to_send),
+}
+
+# warmed up on start, other language sets are added on their first request
+DEFAULT_LANG_SETS: Set[LangSet] = {DEFAULT_LANGS, ALL_LANGS}
+
+
+def start_random_pools():
+    for pool in RANDOM_POOLS.values():
+        for lang_set in DEFAULT_LANG_SETS:
+            pool.refill(lang_set)
+
+
+async def stop_random_pools():
+    for pool in RANDOM_POOLS.values():
+        await pool.stop()
@@ -0,0 +1,73 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+RouteMatch = Tuple[Callable, Tuple[Any, ...]]
+
+
+class Route:
+    __slots__ = ("pattern", "handler", "converters", "group", "groups_count")
+
+    def __init__(self, pattern: str, handler: Callable, converters: Tuple[Callable, ...]):
+        self.pattern = pattern
+        self.handler = handler
+        self.groups_count = re.compile(pattern).groups
+        if converters and len(converters) != self.groups_count:
+            raise ValueError(f"{pattern}: {self.groups_count} groups, {len(converters)} converters")
+        self.converters = converters or (str,) * self.groups_count
+        self.group = 0
+
+
+class Router:
+    """
+    Matches text against all registered patterns with one compiled regexp.
+
+    Every pattern becomes a named alternative, the first registered pattern that matches wins
+    (the same order aiogram checks handlers in). Groups of the matched pattern are converted
+    once and passed to the handler as positional arguments (None stays None).
+    """
+
+    def __init__(self):
+        self.routes: List[Route] = []
+        self.by_name: Dict[str, Route] = {}
+        self.compiled: Optional[re.Pattern] = None
+
+    def add(self, pattern: str, handler: Callable, *converters: Callable):
+        self.routes.append(Route(pattern, handler, converters))
+        self.compiled = None
+
+    def route(self, pattern: str, *converters: Callable):
+        def decorator(fn):
+            self.add(pattern, fn, *converters)
+            return fn
+        return decorator
+
+    def command(self, *names: str):
+        return self.route(rf"/(?:{'|'.join(re.escape(n) for n in names)})(?:@\w+)?(?:\s|$)")
+
+    def compile(self):
+        parts = []
+        group = 1
+        self.by_name = {}
+        for i, route in enumerate(self.routes):
+            name = f"r{i}"
+            parts.append(f"(?P<{name}>{route.pattern})")
+            route.group = group
+            group += 1 + route.groups_count
+            self.by_name[name] = route
+        self.compiled = re.compile("|".join(parts))
+
+    def match(self, text: str) -> Optional[RouteMatch]:
+        if self.compiled is None:
+            self.compile()
+        m = self.compiled.match(text)
+        if m is None:
+            return None
+        route = self.by_name[m.lastgroup]
+        if not route.groups_count:
+            return route.handler, ()
+        values = m.groups()[route.group:route.group + route.groups_count]
+        return route.handler, tuple(
+            value if value is None else converter(value)
+            for value, converter in zip(values, route.converters)
+        )
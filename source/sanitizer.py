@@ -0,0 +1,219 @@
+import html
+from html.entities import html5
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+
+TEXT, OPEN, CLOSE = 0, 1, 2
+
+Token = Tuple[int, str]
+
+TOKEN_RE = re.compile(
+    r"<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*>"
+    r"|<!--.*?-->"
+    r"|\[(/?)(b|i|u|s|url|quote|img|color|size|center)(?:=[^\]]*)?\]"
+    r"|&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);",
+    re.S | re.I
+)
+MANY_NEWLINES_RE = re.compile(r"\n{3,}")
+
+# source tag -> Telegram tag
+FORMAT_TAGS = {
+    "b": "b", "strong": "b",
+    "i": "i", "em": "i",
+    "u": "u", "ins": "u",
+    "s": "s", "strike": "s", "del": "s",
+}
+BREAK_TAGS = {"br", "p", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "quote", "center"}
+
+SENTENCE_ENDS = (". ", "! ", "? ", "… ", ".\n", "!\n", "?\n", "\n")
+
+
+def escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def tokenize(source: str) -> Iterator[Token]:
+    """
+    Converts annotation HTML/BBCode into a stream of plain text and Telegram formatting tags.
+
+    Unsupported tags are dropped (block tags become line breaks), entities are decoded,
+    runs of blank lines are collapsed and tags are always balanced.
+    """
+    open_tags: List[str] = []
+    trailing_newlines = 2  # no leading blank lines
+
+    def text(value: str) -> Iterator[Token]:
+        nonlocal trailing_newlines
+        value = value.replace("\r", "")
+        if not value:
+            return
+        stripped = value.lstrip("\n")
+        leading = len(value) - len(stripped)
+        if leading:
+            value = "\n" * min(leading, max(0, 2 - trailing_newlines)) + stripped
+        value = MANY_NEWLINES_RE.sub("\n\n", value)
+        if not value:
+            return
+        if value.strip("\n"):
+            trailing_newlines = len(value) - len(value.rstrip("\n"))
+        else:
+            trailing_newlines += len(value)
+        yield TEXT, value
+
+    # text between formatting tags is collected and emitted as one token
+    buffer: List[str] = []
+    position = 0
+    for match in TOKEN_RE.finditer(source):
+        if match.start() > position:
+            buffer.append(source[position:match.start()])
+        position = match.end()
+
+        entity = match.group(5)
+        if entity is not None:
+            if entity[0] == "#":
+                buffer.append(html.unescape(f"&{entity};"))
+            else:
+                buffer.append(html5.get(entity + ";", f"&{entity};"))
+            continue
+
+        if match.group(2) is not None:
+            closing, name = match.group(1), match.group(2).lower()
+        elif match.group(4) is not None:
+            closing, name = match.group(3), match.group(4).lower()
+        else:
+            continue  # comment
+
+        tag = FORMAT_TAGS.get(name)
+        if tag is None:
+            if name in BREAK_TAGS and (closing or name == "br"):
+                buffer.append("\n")
+            continue
+        # nested duplicates and stray closing tags are dropped
+        if (tag in open_tags) != bool(closing):
+            continue
+        if buffer:
+            yield from text("".join(buffer))
+            buffer.clear()
+        if not closing:
+            open_tags.append(tag)
+            yield OPEN, tag
+        else:
+            while open_tags:
+                last = open_tags.pop()
+                yield CLOSE, last
+                if last == tag:
+                    break
+
+    if position < len(source):
+        buffer.append(source[position:])
+    if buffer:
+        yield from text("".join(buffer))
+    while open_tags:
+        yield CLOSE, open_tags.pop()
+
+
+def render(tokens: Iterable[Token]) -> str:
+    return "".join(escape(value) if kind == TEXT else f"<{value}>" if kind == OPEN else f"</{value}>"
+                   for kind, value in tokens)
+
+
+def _cut(text: str, position: int, room: int) -> int:
+    """Returns how many chars of `text` from `position` fit into `room` escaped chars, preferring sentence ends."""
+    window = text[position:position + room]
+    excess = len(escape(window)) - room
+    if excess > 0:
+        # an escaped char takes 1 to 5 chars: dropping `excess` chars always fits, dropping fewer
+        # than excess / 5 never does, the longest prefix that fits is between the two
+        low, high = max(0, len(window) - excess), len(window) - (excess + 4) // 5
+        while low < high:
+            middle = (low + high + 1) // 2
+            if len(escape(window[:middle])) <= room:
+                low = middle
+            else:
+                high = middle - 1
+        window = window[:low]
+    cut = 0
+    for end in SENTENCE_ENDS:
+        found = window.rfind(end)
+        if found != -1:
+            cut = max(cut, found + len(end))
+    if cut < len(window) // 3:
+        cut = window.rfind(" ") + 1
+        if cut < len(window) // 3:
+            cut = len(window)
+    return cut
+
+
+def paginate(tokens: Iterable[Token], limit: int) -> List[str]:
+    """
+    Splits the token stream into HTML pages of at most `limit` chars.
+
+    Pages end at sentence breaks where possible, never inside an entity or a tag,
+    and tags open at a page break are closed and reopened on the next page.
+    """
+    pages: List[str] = []
+    page: List[str] = []
+    length = 0
+    open_tags: List[str] = []
+    closing_length = 0
+    has_text = False
+
+    def flush():
+        nonlocal page, length, has_text
+        if has_text:
+            pages.append(("".join(page) + "".join(f"</{t}>" for t in reversed(open_tags))).strip())
+        page = [f"<{t}>" for t in open_tags]
+        length = sum(len(p) for p in page)
+        has_text = False
+
+    for kind, value in tokens:
+        if kind == OPEN:
+            tag = f"<{value}>"
+            if length + len(tag) + closing_length + len(value) + 3 > limit:
+                flush()
+            page.append(tag)
+            length += len(tag)
+            open_tags.append(value)
+            closing_length += len(value) + 3
+        elif kind == CLOSE:
+            page.append(f"</{value}>")
+            length += len(value) + 3
+            open_tags.remove(value)
+            closing_length -= len(value) + 3
+        else:
+            # only the emitted window is escaped or copied, so long texts stay linear
+            position = 0
+            while position < len(value):
+                room = limit - length - closing_length
+                # escaping never shortens text, a longer rest cannot fit
+                if len(value) - position <= room:
+                    rest = value[position:]
+                    escaped = escape(rest)
+                    if len(escaped) <= room:
+                        page.append(escaped)
+                        length += len(escaped)
+                        has_text = has_text or not rest.isspace()
+                        break
+                cut = _cut(value, position, room) if room > 0 else 0
+                if cut:
+                    chunk = value[position:position + cut]
+                    escaped = escape(chunk)
+                    page.append(escaped)
+                    length += len(escaped)
+                    has_text = has_text or not chunk.isspace()
+                    position += cut
+                elif not has_text:
+                    raise ValueError(f"Page limit {limit} is too small")
+                flush()
+
+    flush()
+    return pages or [""]
+
+
+def sanitize(source: str) -> str:
+    return render(tokenize(source))
+
+
+def split_pages(source: str, limit: int) -> List[str]:
+    return paginate(tokenize(source), limit)
@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import aiohttp
+
+from config import Config
+from flibusta_server import AuthorSearchResult, BookSearchResult, BookWithAuthor, SequenceSearchResult, UpdateLogAPI
+from langs import ALL_LANGS, LangSet
+from metrics import cache_lookup
+from update_log import seconds_until_tomorrow
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS book (id INTEGER PRIMARY KEY, obj TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS author (id INTEGER PRIMARY KEY, obj TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS sequence (id INTEGER PRIMARY KEY, obj TEXT NOT NULL);
+CREATE VIRTUAL TABLE IF NOT EXISTS book_fts USING fts5(name, langs, tokenize='unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE IF NOT EXISTS author_fts USING fts5(name, langs, tokenize='unicode61 remove_diacritics 2');
+CREATE VIRTUAL TABLE IF NOT EXISTS sequence_fts USING fts5(name, langs, tokenize='unicode61 remove_diacritics 2');
+"""
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text: str) -> str:
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def quote(token: str) -> str:
+    return '"' + token.replace('"', '""') + '"'
+
+
+def match_query(query: str) -> Optional[str]:
+    """FTS5 query matching every word of `query` as a prefix, None when there are no words."""
+    words = WORD_RE.findall(normalize(query))
+    if not words:
+        return None
+    return ' '.join(quote(word) + '*' for word in words)
+
+
+def author_name(obj: dict) -> str:
+    return ' '.join(obj[key] for key in ("last_name", "first_name", "middle_name") if obj.get(key))
+
+
+class SearchIndexDB:
+    """
+    Title, author and series search over a local SQLite FTS5 catalog.
+
+    Objects are stored the way the backend returns them in search results, so search answers are built
+    with the same classes. All calls block and are made from SearchIndex's single thread.
+
+    Only the writer creates the schema; readers open the file of another process read-only
+    and call `load_langs` once it has been built.
+    """
+    RANKED_MATCHES = 2_000
+
+    def __init__(self, path: str, writer: bool = True):
+        if writer:
+            self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        else:
+            self.conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True,
+                                        check_same_thread=False, timeout=30)
+        # languages present in each table, a search in all of them needs no language filter
+        self.langs: Dict[str, Set[str]] = {table: set() for table in ("book", "author", "sequence")}
+        if writer:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.load_langs()
+
+    def close(self):
+        self.conn.close()
+
+    def load_langs(self):
+        for table in self.langs:
+            self.langs[table] = set(json.loads(self.get_meta(f"{table}_langs") or "[]"))
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.conn:
+            self._set_meta(key, value)
+
+    def _set_meta(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _add_langs(self, table: str, langs: Iterable[str]):
+        if not self.langs[table].issuperset(langs):
+            self.langs[table].update(langs)
+            self._set_meta(f"{table}_langs", json.dumps(sorted(self.langs[table])))
+
+    def _upsert(self, table: str, obj: dict, name: str, langs: Iterable[str]):
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} (id, obj) VALUES (?, ?)",
+                          (obj["id"], json.dumps(obj, ensure_ascii=False)))
+        self.conn.execute(f"DELETE FROM {table}_fts WHERE rowid = ?", (obj["id"],))
+        self.conn.execute(f"INSERT INTO {table}_fts (rowid, name, langs) VALUES (?, ?, ?)",
+                          (obj["id"], normalize(name), ' '.join(sorted(set(langs)))))
+        self._add_langs(table, langs)
+
+    def _add_author_lang(self, obj: dict, lang: str):
+        row = self.conn.execute("SELECT langs FROM author_fts WHERE rowid = ?", (obj["id"],)).fetchone()
+        if row is None:
+            self._upsert("author", obj, author_name(obj), (lang,))
+        elif lang not in row[0].split():
+            # known from the snapshot, whose object has the annotation flag
+            self.conn.execute("UPDATE author_fts SET langs = ? WHERE rowid = ?",
+                              (' '.join(sorted(row[0].split() + [lang])), obj["id"]))
+            self._add_langs("author", (lang,))
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Loads a JSON lines catalog snapshot, one {"type": "book" | "author" | "sequence", "obj": {...}}
+        per line, authors and series with the "langs" of their books. Returns the number of loaded items.
+        """
+        count = 0
+        with open(path, encoding="utf-8") as f, self.conn:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                obj = item["obj"]
+                if item["type"] == "book":
+                    self._upsert("book", obj, obj["title"], (obj["lang"],))
+                elif item["type"] == "author":
+                    self._upsert("author", obj, author_name(obj), item.get("langs", ()))
+                elif item["type"] == "sequence":
+                    self._upsert("sequence", obj, obj["name"], item.get("langs", ()))
+                else:
+                    continue
+                count += 1
+        return count
+
+    def add_books(self, books: List[BookWithAuthor]):
+        """Adds books from the update log together with their authors."""
+        with self.conn:
+            for book in books:
+                self._upsert("book", book.obj, book.title, (book.lang,))
+                for author in book.obj.get("authors") or ():
+                    obj = dict(author)
+                    obj.setdefault("annotation_exists", False)
+                    self._add_author_lang(obj, book.lang)
+
+    def search(self, table: str, query: str, langs: LangSet, limit: int, page: int) -> dict:
+        match = f"name : ({query})"
+        if not self.langs[table].issubset(langs):
+            # languages are tokens of the same index, no join is needed to filter by them
+            match += f" AND langs : ({' OR '.join(quote(lang) for lang in langs)})"
+        count = self.conn.execute(f"SELECT count(*) FROM {table}_fts WHERE {table}_fts MATCH ?",
+                                  (match,)).fetchone()[0]
+        if count == 0:
+            return {"count": 0, "result": []}
+        # scoring every match of a broad query costs more than the rest of the request,
+        # and a word present in thousands of titles says little about relevance anyway
+        score = f"bm25({table}_fts, 1.0, 0.0)" if count <= self.RANKED_MATCHES else "0"
+        rows = self.conn.execute(
+            f"SELECT {table}.obj FROM ("
+            f"SELECT rowid, {score} AS score FROM {table}_fts WHERE {table}_fts MATCH ? "
+            f"ORDER BY score, rowid DESC LIMIT ? OFFSET ?"
+            f") AS found JOIN {table} ON {table}.id = found.rowid ORDER BY found.score, found.rowid DESC",
+            (match, limit, (page - 1) * limit)
+        ).fetchall()
+        return {"count": count, "result": [json.loads(row[0]) for row in rows]}
+
+
+class SearchIndex:
+    """
+    Optional local search, enabled by SEARCH_INDEX_FILE and built from the SEARCH_INDEX_SNAPSHOT catalog.
+
+    New books and their authors are added daily from the update log. Queries with no local results
+    return None and are sent to the backend, as are all queries until a snapshot is loaded.
+
+    The index is loaded and updated by the primary worker only, the other workers read the same file
+    and follow its progress every POLL_INTERVAL.
+    """
+    MAX_CATCH_UP_DAYS = 30
+    FETCH_LIMIT = 500
+    ROLLOVER_DELAY = 5 * 60
+    POLL_INTERVAL = 60
+
+    db: Optional[SearchIndexDB] = None
+    ready: bool = False
+    executor: Optional[ThreadPoolExecutor] = None
+    task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls):
+        if not Config.SEARCH_INDEX_FILE:
+            return
+        # sqlite connections are used from one thread, the event loop only waits for it
+        cls.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search_index")
+        cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
+        cls.ready = False
+        if cls.db is not None:
+            await cls._call(cls.db.close)
+            cls.db = None
+        if cls.executor is not None:
+            cls.executor.shutdown()
+            cls.executor = None
+
+    @classmethod
+    async def _call(cls, fn: Callable, *args) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(cls.executor, fn, *args)
+
+    @classmethod
+    async def _run(cls):
+        try:
+            if Config.PRIMARY_WORKER:
+                await cls._maintain()
+            else:
+                await cls._follow()
+        except sqlite3.Error:
+            cls.ready = False
+            logging.exception("Search index failed, searching on the backend")
+
+    @classmethod
+    async def _maintain(cls):
+        cls.db = await cls._call(SearchIndexDB, Config.SEARCH_INDEX_FILE)
+        await cls._load_snapshot()
+        cls.ready = await cls._call(cls.db.get_meta, "synced_until") is not None
+        if not cls.ready:
+            logging.warning("Search index has no catalog snapshot, searching on the backend")
+            return
+        while True:
+            try:
+                await cls._catch_up()
+            except (aiohttp.ClientError, asyncio.TimeoutError, sqlite3.OperationalError) as e:
+                logging.warning(f"Search index update failed: {e!r}")
+            await asyncio.sleep(seconds_until_tomorrow() + cls.ROLLOVER_DELAY)
+
+    @classmethod
+    async def _follow(cls):
+        while True:
+            try:
+                if cls.db is None:
+                    cls.db = await cls._call(SearchIndexDB, Config.SEARCH_INDEX_FILE, False)
+                # languages of new books are added by the primary worker as well
+                if await cls._call(cls.db.get_meta, "synced_until") is not None:
+                    await cls._call(cls.db.load_langs)
+                    cls.ready = True
+            except sqlite3.OperationalError as e:
+                # the file is not created or built yet
+                logging.debug(f"Search index is not available yet: {e!r}")
+            await asyncio.sleep(cls.POLL_INTERVAL)
+
+    @classmethod
+    async def _load_snapshot(cls):
+        path = Config.SEARCH_INDEX_SNAPSHOT
+        if not path or not os.path.exists(path):
+            return
+        mtime = str(os.path.getmtime(path))
+        if await cls._call(cls.db.get_meta, "snapshot_mtime") == mtime:
+            return
+        started_at = datetime.now()
+        count = await cls._call(cls.db.load_snapshot, path)
+        # the snapshot may miss books added on its last day, they are added again from the update log
+        snapshot_date = datetime.fromtimestamp(float(mtime)).date() - timedelta(days=1)
+        await cls._call(cls.db.set_meta, "snapshot_mtime", mtime)
+        await cls._call(cls.db.set_meta, "synced_until", snapshot_date.isoformat())
+        logging.info(f"Search index: {count} items loaded from {path} in {datetime.now() - started_at}")
+
+    @classmethod
+    async def _catch_up(cls):
+        synced_until = date.fromisoformat(await cls._call(cls.db.get_meta, "synced_until"))
+        yesterday = date.today() - timedelta(days=1)
+        day = max(synced_until + timedelta(days=1), yesterday - timedelta(days=cls.MAX_CATCH_UP_DAYS))
+        while day <= yesterday:
+            page = 1
+            while True:
+                update_log = await UpdateLogAPI.get_by_day(day, day, ALL_LANGS, cls.FETCH_LIMIT, page)
+                if update_log is None:
+                    raise aiohttp.ClientError(f"update log {day} is not available")
+                await cls._call(cls.db.add_books, update_log.books)
+                if len(update_log.books) < cls.FETCH_LIMIT or page * cls.FETCH_LIMIT >= update_log.count:
+                    break
+                page += 1
+            await cls._call(cls.db.set_meta, "synced_until", day.isoformat())
+            day += timedelta(days=1)
+
+    @classmethod
+    async def _search(cls, kind: str, result_type: type, query: str, langs: LangSet,
+                      limit: int, page: int) -> Optional[Any]:
+        if not cls.ready:
+            return None
+        fts_query = match_query(query)
+        if fts_query is None or not langs:
+            return None
+        try:
+            result = await cls._call(cls.db.search, kind, fts_query, langs, limit, page)
+        except sqlite3.Error as e:
+            logging.warning(f"Search index {kind} query {query!r} failed: {e!r}")
+            return None
+        cache_lookup(f"search_index_{kind}", result["count"] != 0)
+        return result_type(result) if result["count"] != 0 else None
+
+    @classmethod
+    async def search_books(cls, query: str, langs: LangSet, limit: int, page: int) -> Optional[BookSearchResult]:
+        return await cls._search("book", BookSearchResult, query, langs, limit, page)
+
+    @classmethod
+    async def search_authors(cls, query: str, langs: LangSet, limit: int,
+                             page: int) -> Optional[AuthorSearchResult]:
+        return await cls._search("author", AuthorSearchResult, query, langs, limit, page)
+
+    @classmethod
+    async def search_sequences(cls, query: str, langs: LangSet, limit: int,
+                               page: int) -> Optional[SequenceSearchResult]:
+        return await cls._search("sequence", SequenceSearchResult, query, langs, limit, page)
@@ -1,4 +1,5 @@
-from typing import Optional
+import asyncio
+from typing import Dict, Optional, Tuple
 from functools import wraps
 from datetime import date
 
@@ -10,23 +11,45 @@ import aiohttp
 from config import Config
 
 from notifier import Notifier
-from flibusta_server import BookAPI, DownloadAPI, AuthorAPI, SequenceAPI, \
+from flibusta_server import BookAPI, AuthorAPI, SequenceAPI, \
     BookAnnotationAPI, AuthorAnnotationAPI, UpdateLogAPI
 from flibusta_server import BookWithAuthor
-from db import PostedBookDB, SettingsDB
-from utils import split_text
+from db import PostedBookDB, SettingsDB, SeriesJob, SeriesJobDB
+from download_counter import DownloadCounter
+from lifecycle import Lifecycle
+from cache import TTLCache
+from metrics import DOWNLOADS_IN_FLIGHT, THROTTLED, cache_lookup
+from throttling import LIMITERS
+from tracing import span
+from profiler import Profiler
+from telegram_api import FastBot
+from update_log import UpdateLogCache
+from random_pool import RANDOM_POOLS
+from search_index import SearchIndex
+from offline import OfflineStore, offline_note
 
 
 ELEMENTS_ON_PAGE = 7
 BOOKS_CHANGER = 5
 
+INLINE_RESULTS_ON_PAGE = 20
+INLINE_MIN_QUERY_LENGTH = 3
+INLINE_DEBOUNCE = 0.4
+INLINE_CACHE_TIME = 300
 
-async def get_keyboard(
+# sanitized HTML per annotation page, leaves room for the page footer
+ANNOTATION_PAGE_SIZE = 2048
+
+inline_search_cache = TTLCache("inline_search", max_size=5_000, ttl=INLINE_CACHE_TIME)
+annotation_pages_cache = TTLCache("annotation_pages", max_size=2_000, ttl=6 * 60 * 60)
+# keys include ids from callback data, so the size bounds the memory
+keyboards_cache = TTLCache("keyboards", max_size=20_000, ttl=24 * 60 * 60)
+
+
+def build_keyboard(
     page: int, pages_count: int,
     keyboard_type: str, only_one: bool = False
-) -> Optional[InlineKeyboardMarkup]:
-    if pages_count == 1:
-        return None
+) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardMarkup()
 
     first_row = []
@@ -64,6 +87,31 @@ async def get_keyboard(
     return keyboard
 
 
+def get_keyboard(
+    page: int, pages_count: int,
+    keyboard_type: str, only_one: bool = False,
+    footer: Tuple[Tuple[str, str], ...] = ()
+) -> Optional[str]:
+    """
+    Pagination keyboard already serialized to JSON, aiogram sends strings as is.
+    `footer` is a tuple of (text, callback_data) buttons added one per row below the pages.
+    """
+    if pages_count == 1 and not footer:
+        return None
+    key = (page, pages_count, keyboard_type, only_one, footer)
+    markup = keyboards_cache.get(key)
+    if markup is None:
+        if pages_count == 1:
+            keyboard = InlineKeyboardMarkup()
+        else:
+            keyboard = build_keyboard(page, pages_count, keyboard_type, only_one)
+        for text, callback_data in footer:
+            keyboard.row(InlineKeyboardButton(text, callback_data=callback_data))
+        markup = keyboard.as_json()
+        keyboards_cache.set(key, markup)
+    return markup
+
+
 # remove chars that don't accept in Telegram Bot API
 def normalize(book: BookWithAuthor, file_type: str) -> str:
     filename = '_'.join([a.short for a in book.authors]) + \
@@ -113,31 +161,90 @@ def need_one_or_more_langs(fn):
     return wrapper
 
 
+def is_throttled(kind: str, user_id: int) -> bool:
+    if user_id in Config.ADMINS or LIMITERS[kind].allow(user_id):
+        return False
+    THROTTLED.inc(kind=kind)
+    return True
+
+
+def rate_limited(kind: str):
+    def decorator(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            for a in args:
+                if isinstance(a, Message):
+                    user_id, reply_to = a.chat.id, a.message_id
+                elif isinstance(a, types.CallbackQuery):
+                    user_id, reply_to = a.from_user.id, None
+                else:
+                    continue
+                if is_throttled(kind, user_id):
+                    wait = int(LIMITERS[kind].retry_after(user_id)) + 1
+                    return await Sender.bot.send_message(
+                        user_id,
+                        f"Слишком много запросов, попробуйте через {wait} сек.",
+                        reply_to_message_id=reply_to,
+                        allow_sending_without_reply=True
+                    )
+                break
+            return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
 async def get_book_from_channel(book_id: int, file_type: str):
     if not Config.FLIBUSTA_CHANNEL_SERVER:
         return None
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"{Config.FLIBUSTA_CHANNEL_SERVER}/"
-            f"get_message_id/{book_id}/{file_type}"
-        ) as response:
-            return await response.json()
+    with span("channel", "get_message_id"):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{Config.FLIBUSTA_CHANNEL_SERVER}/"
+                f"get_message_id/{book_id}/{file_type}"
+            ) as response:
+                return await response.json()
 
 
 async def delete_book_from_channel(message_id: int):
     if not Config.FLIBUSTA_CHANNEL_SERVER:
         return None
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            f"{Config.FLIBUSTA_CHANNEL_SERVER}/"
-            f"delete_message_id/{message_id}"
-        ) as response:
-            return await response.json()
+    with span("channel", "delete_message_id"):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{Config.FLIBUSTA_CHANNEL_SERVER}/"
+                f"delete_message_id/{message_id}"
+            ) as response:
+                return await response.json()
+
+
+async def get_book_annotation_pages(book_id: int) -> Optional[Tuple[str, ...]]:
+    pages = annotation_pages_cache.get(("book", book_id))
+    if pages is None:
+        annotation = await BookAnnotationAPI.get_by_book_id(book_id)
+        if annotation is None:
+            return None
+        pages = tuple(annotation.pages(ANNOTATION_PAGE_SIZE))
+        annotation_pages_cache.set(("book", book_id), pages)
+    return pages
+
+
+async def get_author_annotation_pages(author_id: int) -> Optional[Tuple[str, ...]]:
+    pages = annotation_pages_cache.get(("author", author_id))
+    if pages is None:
+        annotation = await AuthorAnnotationAPI.get_by_author_id(author_id)
+        if annotation is None:
+            return None
+        pages = tuple(annotation.pages(ANNOTATION_PAGE_SIZE))
+        annotation_pages_cache.set(("author", author_id), pages)
+    return pages
 
 
 class Sender:
     bot: Bot
 
+    # latest inline query id of every user, older ones are not answered
+    inline_queries: Dict[int, str] = {}
+
     @classmethod
     def configure(cls, bot: Bot):
         cls.bot = bot
@@ -146,26 +253,47 @@ class Sender:
     async def remove_cache(type_: str, id_: int):
         await PostedBookDB.delete(id_, type_)
 
+    @classmethod
+    @rate_limited("download")
+    async def download_book(cls, msg: Message, book_id: int, file_type: str):
+        await cls.send_book(msg, book_id, file_type)
+
     @classmethod
     async def send_book(cls, msg: Message, book_id: int, file_type: str):
+        DOWNLOADS_IN_FLIGHT.inc()
+        try:
+            await cls._send_book(msg, book_id, file_type)
+        finally:
+            DOWNLOADS_IN_FLIGHT.dec()
+
+    @classmethod
+    async def _send_book(cls, msg: Message, book_id: int, file_type: str):
         async with Notifier(cls.bot, msg.chat.id, "upload_document"):
-            book = await BookAPI.get_by_id(book_id)
+            book, saved_at = await OfflineStore.get_book(book_id)
             if book is None:
                 await msg.reply("Книга не найдена!")
                 return
-
-            book_on_channel = await get_book_from_channel(
-                book_id, file_type
-            )
+            caption = book.caption
+            note = offline_note(saved_at)
+            if note and len(caption) + len(note) + 2 <= 1024:
+                caption += "\n\n" + note
+
+            try:
+                book_on_channel = await get_book_from_channel(
+                    book_id, file_type
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                book_on_channel = None
+            cache_lookup("channel", book_on_channel is not None)
             if book_on_channel is not None:
                 try:
-                    await cls.bot.copy_message(
+                    await FastBot.copy_message(
                         msg.chat.id,
                         book_on_channel["channel_id"],
                         book_on_channel["message_id"],
                         reply_markup=book.share_markup
                     )
-                    await DownloadAPI.update(book_id, msg.chat.id)
+                    DownloadCounter.push(book_id, msg.chat.id)
                     return
                 except exceptions.BadRequest:
                     await delete_book_from_channel(
@@ -173,37 +301,42 @@ class Sender:
                     )
 
             pb = await PostedBookDB.get(book_id, file_type)
+            cache_lookup("posted_book", pb is not None)
             if pb:
-                await cls.bot.send_document(
+                await FastBot.send_document(
                     msg.chat.id, pb.file_id,
                     reply_to_message_id=msg.message_id,
                     allow_sending_without_reply=True,
-                    caption=book.caption,
+                    caption=caption,
                     reply_markup=book.share_markup
                 )
-                await DownloadAPI.update(book_id, msg.chat.id)
+                DownloadCounter.push(book_id, msg.chat.id)
                 return
 
-            book_bytes = await BookAPI.download(book_id, file_type)
+            try:
+                book_bytes = await BookAPI.download(book_id, file_type)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                book_bytes = None
             if not book_bytes:
-                await cls.bot.send_message(
+                await FastBot.send_message(
                     msg.chat.id,
                     "Ошибка! Попробуйте позже :(",
                     reply_to_message_id=msg.message_id,
                     allow_sending_without_reply=True
                 )
-                await DownloadAPI.update(book_id, msg.chat.id)
+                DownloadCounter.push(book_id, msg.chat.id)
                 return
             if book_bytes.size > 50_000_000:
-                await cls.bot.send_message(
+                await FastBot.send_message(
                     msg.chat.id,
                     book.download_caption(file_type), parse_mode="HTML",
                     reply_to_message_id=msg.message_id,
                     allow_sending_without_reply=True
                 )
-                await DownloadAPI.update(book_id, msg.chat.id)
+                DownloadCounter.push(book_id, msg.chat.id)
                 return
-            book_bytes.name = normalize(book, file_type)
+            with span("render", "normalize"):
+                book_bytes.name = normalize(book, file_type)
 
             send_response = await cls.bot.send_document(
                 msg.chat.id, book_bytes,
@@ -216,28 +349,27 @@ class Sender:
                 book_id, file_type,
                 send_response.document.file_id
             )
-            await DownloadAPI.update(book_id, msg.chat.id)
+            DownloadCounter.push(book_id, msg.chat.id)
 
     @classmethod
+    @rate_limited("search")
     @need_one_or_more_langs
     async def search_books(cls, msg: Message, page: int):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        search_result = await BookAPI.search(
-            normalize_input(msg.reply_to_message.text),
-            (await SettingsDB.get(msg.chat.id)).get(),
-            ELEMENTS_ON_PAGE,
-            page
-        )
+        query = normalize_input(msg.reply_to_message.text)
+        allowed_langs = (await SettingsDB.get(msg.chat.id)).get()
+        search_result = await SearchIndex.search_books(query, allowed_langs, ELEMENTS_ON_PAGE, page) \
+            or await BookAPI.search(query, allowed_langs, ELEMENTS_ON_PAGE, page)
         if search_result is None:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Произошла ошибка :( Попробуйте позже',
                 chat_id=msg.chat.id, message_id=msg.message_id
             )
             return
 
         if not search_result:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Книги не найдены!', chat_id=msg.chat.id,
                 message_id=msg.message_id
             )
@@ -248,31 +380,31 @@ class Sender:
         msg_text = '\n\n\n'.join(book.to_send_book
                                  for book in search_result.books) \
                    + f'\n\n<code>Страница {page}/{page_count}</code>'
-        await cls.bot.edit_message_text(
+        await FastBot.edit_message_text(
             msg_text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode='HTML',
-            reply_markup=await get_keyboard(page, page_count, 'b')
+            reply_markup=get_keyboard(page, page_count, 'b')
         )
 
     @classmethod
+    @rate_limited("search")
     @need_one_or_more_langs
     async def search_authors(cls, msg: Message, page: int):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
-        search_result = await AuthorAPI.search(
-            normalize_input(msg.reply_to_message.text),
-            (await SettingsDB.get(msg.chat.id)).get(),
-            ELEMENTS_ON_PAGE, page
-        )
+        query = normalize_input(msg.reply_to_message.text)
+        allowed_langs = (await SettingsDB.get(msg.chat.id)).get()
+        search_result = await SearchIndex.search_authors(query, allowed_langs, ELEMENTS_ON_PAGE, page) \
+            or await AuthorAPI.search(query, allowed_langs, ELEMENTS_ON_PAGE, page)
 
         if search_result is None:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Произошла ошибка :( Попробуйте позже',
                 chat_id=msg.chat.id, message_id=msg.message_id
             )
             return
 
         if not search_result:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Автор не найден!', chat_id=msg.chat.id,
                 message_id=msg.message_id
             )
@@ -283,13 +415,14 @@ class Sender:
         msg_text = ''.join(author.to_send
                            for author in search_result.authors) \
                    + f'<code>Страница {page}/{page_max}</code>'
-        await cls.bot.edit_message_text(
+        await FastBot.edit_message_text(
             msg_text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode='HTML',
-            reply_markup=await get_keyboard(page, page_max, 'a')
+            reply_markup=get_keyboard(page, page_max, 'a')
         )
 
     @classmethod
+    @rate_limited("search")
     @need_one_or_more_langs
     async def search_books_by_author(cls, msg: Message, author_id: int,
                                      page: int):
@@ -321,30 +454,33 @@ class Sender:
                              for book in books]) + \
             f'<code>Страница {page}/{page_max}</code>'
         if not msg.reply_to_message:
-            await cls.bot.send_message(
+            await FastBot.send_message(
                 msg.chat.id, msg_text, parse_mode='HTML',
-                reply_markup=await get_keyboard(1, page_max, 'ba'),
+                reply_markup=get_keyboard(1, page_max, 'ba', footer=(
+                    ("🔔 Новинки автора", f"follow_a_{author_id}"),
+                )),
                 reply_to_message_id=msg.message_id
             )
         else:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 msg_text, msg.chat.id, msg.message_id, parse_mode='HTML',
-                reply_markup=await get_keyboard(page, page_max, 'ba')
+                reply_markup=get_keyboard(page, page_max, 'ba', footer=(
+                    ("🔔 Новинки автора", f"follow_a_{author_id}"),
+                ))
             )
 
     @classmethod
+    @rate_limited("search")
     @need_one_or_more_langs
     async def search_series(cls, msg: Message, page: int):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
-        sequences_result = await SequenceAPI.search(
-            normalize_input(msg.reply_to_message.text),
-            (await SettingsDB.get(msg.chat.id)).get(),
-            ELEMENTS_ON_PAGE,
-            page
-        )
+        query = normalize_input(msg.reply_to_message.text)
+        allowed_langs = (await SettingsDB.get(msg.chat.id)).get()
+        sequences_result = await SearchIndex.search_sequences(query, allowed_langs, ELEMENTS_ON_PAGE, page) \
+            or await SequenceAPI.search(query, allowed_langs, ELEMENTS_ON_PAGE, page)
 
         if sequences_result is None:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Произошла ошибка :( Попробуйте позже',
                 chat_id=msg.chat.id, message_id=msg.message_id
             )
@@ -360,13 +496,14 @@ class Sender:
         msg_text = ''.join([sequence.to_send
                             for sequence in sequences_result.sequences[:5]]) \
                    + f'<code>Страница {page}/{page_max}</code>'
-        await cls.bot.edit_message_text(
+        await FastBot.edit_message_text(
             msg_text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode='HTML',
-            reply_markup=await get_keyboard(page, page_max, 's')
+            reply_markup=get_keyboard(page, page_max, 's')
         )
 
     @classmethod
+    @rate_limited("search")
     @need_one_or_more_langs
     async def search_books_by_series(
         cls, msg: Message, series_id: int, page: int,
@@ -376,12 +513,12 @@ class Sender:
 
         settings = await SettingsDB.get(msg.chat.id)
 
-        search_result = await SequenceAPI.get_by_id(
+        search_result, saved_at = await OfflineStore.get_sequence(
             series_id, settings.get(), ELEMENTS_ON_PAGE, page
         )
 
         if search_result is None:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 'Произошла ошибка :( Попробуйте позже',
                 chat_id=msg.chat.id, message_id=msg.message_id
             )
@@ -400,38 +537,35 @@ class Sender:
             '\n\n\n' \
             .join([book.to_send_book for book in books]
                   ) + f'\n\n<code>Страница {page}/{page_max}</code>'
+        if saved_at is not None:
+            msg_text += '\n\n' + offline_note(saved_at)
 
-        if not msg.reply_to_message:
-            keyboard = await get_keyboard(1, page_max, 'bs')
+        if not after_download:
+            footer = (("⬇️ Скачать серию", f"download_c_{series_id}"),)
         else:
-            keyboard = await get_keyboard(page, page_max, 'bs')
-
-        if keyboard is None:
-            keyboard = types.InlineKeyboardMarkup()
+            footer = (("✅ Книги отправляются!", f"download_c_{series_id}"),)
+        footer += (("🔔 Новинки серии", f"follow_s_{series_id}"),)
 
-        if not after_download:
-            keyboard.row(types.InlineKeyboardButton(
-                "⬇️ Скачать серию", callback_data=f"download_c_{series_id}"))
+        if not msg.reply_to_message:
+            keyboard = get_keyboard(1, page_max, 'bs', footer=footer)
         else:
-            keyboard.row(types.InlineKeyboardButton(
-                "✅ Книги отправляются!",
-                callback_data=f"download_c_{series_id}")
-            )
+            keyboard = get_keyboard(page, page_max, 'bs', footer=footer)
 
         if not msg.reply_to_message:
-            await cls.bot.send_message(
+            await FastBot.send_message(
                 msg.chat.id, msg_text, parse_mode='HTML',
                 reply_markup=keyboard,
                 reply_to_message_id=msg.message_id,
                 allow_sending_without_reply=True
             )
         else:
-            await cls.bot.edit_message_text(
+            await FastBot.edit_message_text(
                 msg_text, msg.chat.id, msg.message_id, parse_mode='HTML',
                 reply_markup=keyboard
             )
 
     @classmethod
+    @rate_limited("series")
     @need_one_or_more_langs
     async def send_books_by_series(
         cls, query: types.CallbackQuery, series_id: int, file_type: str
@@ -441,7 +575,7 @@ class Sender:
         )
 
         await cls.bot.send_chat_action(query.from_user.id, 'typing')
-        search_result = await SequenceAPI.get_by_id(
+        search_result, _ = await OfflineStore.get_sequence(
             series_id, (await SettingsDB.get(query.from_user.id)).get(),
             1_000_000, 1
         )
@@ -449,29 +583,52 @@ class Sender:
         if search_result is None or not search_result.books:
             return
 
-        for book in search_result.books:
-            if book.file_type == "fb2":
-                await cls.send_book(query.message, book.id, file_type)
-            else:
-                await cls.send_book(query.message, book.id, book.file_type)
+        await cls.send_series_job(query.message, SeriesJob(
+            query.message.chat.id, query.message.message_id,
+            [(book.id, file_type if book.file_type == "fb2" else book.file_type)
+             for book in search_result.books]
+        ))
+
+    @classmethod
+    async def send_series_job(cls, msg: Message, job: SeriesJob):
+        try:
+            while job.books:
+                book_id, file_type = job.books[0]
+                await cls.send_book(msg, book_id, file_type)
+                job.books.pop(0)
+        except asyncio.CancelledError:
+            # shutdown: the rest is sent after restart, see resume_series_jobs
+            await SeriesJobDB.create(job)
+            raise
+
+    @classmethod
+    async def resume_series_jobs(cls):
+        # each worker resumes the chats routed to it, so their updates stay in one process
+        if Config.WORKER_ID is None:
+            jobs = await SeriesJobDB.pop(1, 0)
+        else:
+            jobs = await SeriesJobDB.pop(Config.WORKERS, Config.WORKER_ID)
+        for job in jobs:
+            msg = Message(message_id=job.message_id, chat=types.Chat(id=job.chat_id, type="private"))
+            Lifecycle.spawn(cls.send_series_job(msg, job))
 
     @classmethod
     @need_one_or_more_langs
     async def get_random_book(cls, msg: Message):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        book = await BookAPI.get_random(
+        text = await RANDOM_POOLS["book"].pop(
             (await SettingsDB.get(msg.chat.id)).get()
         )
-        if book is None:
-            await cls.bot.send_message(
+        if text is None:
+            await FastBot.send_message(
                 msg.chat.id,
                 "Пока бот не может это сделать, но скоро это исправят!"
             )
             return
 
-        await cls.bot.send_message(
-            msg.chat.id, book.to_send_book, parse_mode='HTML',
+        await FastBot.send_message(
+            msg.chat.id, text, parse_mode='HTML',
             reply_to_message_id=msg.message_id,
             allow_sending_without_reply=True
         )
@@ -481,18 +638,18 @@ class Sender:
     async def get_random_author(cls, msg: Message):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        author = await AuthorAPI.get_random(
+        text = await RANDOM_POOLS["author"].pop(
             (await SettingsDB.get(msg.chat.id)).get()
         )
-        if author is None:
-            await cls.bot.send_message(
+        if text is None:
+            await FastBot.send_message(
                 msg.chat.id,
                 "Пока бот не может это сделать, но скоро это исправят!"
             )
             return
 
-        await cls.bot.send_message(
-            msg.chat.id, author.to_send, parse_mode='HTML',
+        await FastBot.send_message(
+            msg.chat.id, text, parse_mode='HTML',
             reply_to_message_id=msg.message_id,
             allow_sending_without_reply=True
         )
@@ -502,25 +659,25 @@ class Sender:
     async def get_random_sequence(cls, msg: Message):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        sequence = await SequenceAPI.get_random(
+        text = await RANDOM_POOLS["sequence"].pop(
             (await SettingsDB.get(msg.chat.id)).get()
         )
-        if sequence is None:
-            await cls.bot.send_message(
+        if text is None:
+            await FastBot.send_message(
                 msg.chat.id,
                 "Пока бот не может это сделать, но скоро это исправят!"
             )
             return
 
-        await cls.bot.send_message(
-            msg.chat.id, sequence.to_send, parse_mode="HTML",
+        await FastBot.send_message(
+            msg.chat.id, text, parse_mode="HTML",
             reply_to_message_id=msg.message_id,
             allow_sending_without_reply=True
         )
 
     @classmethod
     async def send_book_detail(cls, msg: Message, book_id: int):
-        book = await BookAPI.get_by_id(book_id)
+        book, saved_at = await OfflineStore.get_book(book_id)
 
         if book is None:
             await msg.reply("Книга не найдена!")
@@ -534,8 +691,12 @@ class Sender:
                     "Посмотреть аннотацию", callback_data=f"b_ann_{book_id}_1")
             )
 
-        await cls.bot.send_message(
-            msg.chat.id, book.to_send_book_detail, parse_mode="HTML",
+        msg_text = book.to_send_book_detail
+        if saved_at is not None:
+            msg_text += '\n\n' + offline_note(saved_at)
+
+        await FastBot.send_message(
+            msg.chat.id, msg_text, parse_mode="HTML",
             reply_to_message_id=msg.message_id, reply_markup=keyboard,
             allow_sending_without_reply=True
         )
@@ -545,38 +706,32 @@ class Sender:
     async def send_book_annotation(cls, msg: Message, book_id: int, page: int):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        annotation = await BookAnnotationAPI.get_by_book_id(book_id)
-        if annotation is None:
-            await cls.bot.send_message(
+        msg_parts = await get_book_annotation_pages(book_id)
+        if msg_parts is None:
+            await FastBot.send_message(
                 msg.chat.id, "Нет аннотации для этой книги!",
                 reply_to_message_id=msg.message_id,
                 allow_sending_without_reply=True
             )
             return
 
-        msg_parts = split_text(annotation.body)
-
+        page = min(max(page, 1), len(msg_parts))
         text = msg_parts[page-1] + \
             f'\n<code>Страница {page}/{len(msg_parts)}</code>'
 
-        keyboard = await get_keyboard(
-            page, len(msg_parts), f"b_ann_{book_id}", only_one=True
-        )
-        if keyboard is None:
-            keyboard = types.InlineKeyboardMarkup()
-        keyboard.row(
-            types.InlineKeyboardButton(
-                "Назад", callback_data=f"book_detail_{book_id}")
+        keyboard = get_keyboard(
+            page, len(msg_parts), f"b_ann_{book_id}", only_one=True,
+            footer=(("Назад", f"book_detail_{book_id}"),)
         )
 
-        await cls.bot.edit_message_text(
+        await FastBot.edit_message_text(
             text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode="HTML", reply_markup=keyboard
         )
 
     @classmethod
     async def send_book_detail_edit(cls, msg: Message, book_id: int):
-        book = await BookAPI.get_by_id(book_id)
+        book, saved_at = await OfflineStore.get_book(book_id)
 
         if book is None:
             await msg.reply("Книга не найдена!")
@@ -590,8 +745,12 @@ class Sender:
                     "Посмотреть аннотацию", callback_data=f"b_ann_{book_id}_1")
             )
 
-        await cls.bot.edit_message_text(
-            book.to_send_book_detail, chat_id=msg.chat.id,
+        msg_text = book.to_send_book_detail
+        if saved_at is not None:
+            msg_text += '\n\n' + offline_note(saved_at)
+
+        await FastBot.edit_message_text(
+            msg_text, chat_id=msg.chat.id,
             message_id=msg.message_id, parse_mode="HTML",
             reply_markup=keyboard
         )
@@ -602,25 +761,23 @@ class Sender:
 
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        annotation = await AuthorAnnotationAPI.get_by_author_id(author_id)
-        if annotation is None:
-            await cls.bot.send_message(
+        msg_parts = await get_author_annotation_pages(author_id)
+        if msg_parts is None:
+            await FastBot.send_message(
                 msg.chat.id, "Нет информации для этого автора!",
                 reply_to_message_id=msg.message_id,
                 allow_sending_without_reply=True
             )
             return
 
-        msg_parts = split_text(annotation.body)
-
         text = msg_parts[page-1] + \
             f'\n\n<code>Страница {page}/{len(msg_parts)}</code>'
 
-        keyboard = await get_keyboard(
+        keyboard = get_keyboard(
             page, len(msg_parts), f"a_ann_{author_id}", only_one=True
         )
 
-        await cls.bot.send_message(
+        await FastBot.send_message(
             msg.chat.id, text,
             reply_to_message_id=msg.message_id,
             allow_sending_without_reply=True,
@@ -633,25 +790,24 @@ class Sender:
     ):
         await cls.bot.send_chat_action(msg.chat.id, 'typing')
 
-        annotation = await AuthorAnnotationAPI.get_by_author_id(author_id)
-        if annotation is None:
-            await cls.bot.send_message(
+        msg_parts = await get_author_annotation_pages(author_id)
+        if msg_parts is None:
+            await FastBot.send_message(
                 msg.chat.id, "Нет информации для этого автора!",
                 reply_to_message_id=msg.message_id,
                 allow_sending_without_reply=True
             )
             return
 
-        msg_parts = split_text(annotation.body)
-
+        page = min(max(page, 1), len(msg_parts))
         text = msg_parts[page-1] + \
             f'\n\n<code>Страница {page}/{len(msg_parts)}</code>'
 
-        keyboard = await get_keyboard(
+        keyboard = get_keyboard(
             page, len(msg_parts), f"a_ann_{author_id}", only_one=True
         )
 
-        await cls.bot.edit_message_text(
+        await FastBot.edit_message_text(
             text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode="HTML", reply_markup=keyboard
         )
@@ -662,34 +818,86 @@ class Sender:
         cls, msg: types.Message, start_date: date, end_date: date,
         page: int, type_: str
     ):
-        update_log = await UpdateLogAPI.get_by_day(
-            start_date, end_date,
-            (await SettingsDB.get(msg.chat.id)).get(),
-            7, page
-        )
-        if not update_log:
-            await cls.bot.edit_message_text(
+        langs = (await SettingsDB.get(msg.chat.id)).get()
+        cached = UpdateLogCache.get(start_date, end_date, langs, page)
+        if cached is not None:
+            count, books_text = cached
+        else:
+            update_log = await UpdateLogAPI.get_by_day(
+                start_date, end_date, langs, ELEMENTS_ON_PAGE, page
+            )
+            count = update_log.count if update_log else 0
+            books_text = '\n\n\n'.join(book.to_send_book
+                                       for book in update_log.books) if count else ''
+        if not count:
+            await FastBot.edit_message_text(
                 'Обновления не найдены!',
                 chat_id=msg.chat.id,
                 message_id=msg.message_id
             )
             return
 
-        page_count = update_log.count // ELEMENTS_ON_PAGE + \
-            (1 if update_log.count % ELEMENTS_ON_PAGE != 0 else 0)
+        page_count = count // ELEMENTS_ON_PAGE + \
+            (1 if count % ELEMENTS_ON_PAGE != 0 else 0)
         if start_date == end_date:
             msg_text = f'Обновления за {start_date.isoformat()}\n\n'
         else:
             msg_text = f'Обновления за {start_date.isoformat()} - ' \
                        f'{end_date.isoformat()}\n\n'
-        msg_text += '\n\n\n'.join(book.to_send_book
-                                  for book in update_log.books) \
-            + f'\n\n<code>Страница {page}/{page_count}</code>'
-        await cls.bot.edit_message_text(
+        msg_text += books_text + f'\n\n<code>Страница {page}/{page_count}</code>'
+        await FastBot.edit_message_text(
             msg_text, chat_id=msg.chat.id, message_id=msg.message_id,
             parse_mode='HTML',
-            reply_markup=await get_keyboard(
+            reply_markup=get_keyboard(
                 page, page_count,
                 f'ul_{type_}_{start_date.isoformat()}_{end_date.isoformat()}'
             )
         )
+
+    @classmethod
+    async def search_books_inline(cls, query: types.InlineQuery):
+        text = normalize_input(query.query.strip())
+        if len(text) < INLINE_MIN_QUERY_LENGTH:
+            return
+
+        user_id = query.from_user.id
+        cls.inline_queries[user_id] = query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if cls.inline_queries.get(user_id) != query.id:
+            return
+        del cls.inline_queries[user_id]
+        if is_throttled("search", user_id):
+            return
+
+        allowed_langs = (await SettingsDB.get(user_id)).get()
+        page = int(query.offset) if query.offset.isdigit() else 1
+
+        key = (text, allowed_langs, page)
+        cached = inline_search_cache.get(key)
+        if cached is None:
+            search_result = await SearchIndex.search_books(text, allowed_langs, INLINE_RESULTS_ON_PAGE, page) \
+                or await BookAPI.search(text, allowed_langs, INLINE_RESULTS_ON_PAGE, page)
+            if search_result is None:
+                return
+            results = [types.InlineQueryResultArticle(
+                id=str(book.id),
+                title=book.title,
+                description=' '.join(a.short for a in book.authors),
+                input_message_content=types.InputTextMessageContent(
+                    book.share_text,
+                    parse_mode="markdown",
+                    disable_web_page_preview=True
+                )
+            ) for book in search_result.books]
+            next_offset = str(page + 1) if page * INLINE_RESULTS_ON_PAGE < search_result.count else ""
+            cached = (results, next_offset)
+            inline_search_cache.set(key, cached)
+
+        results, next_offset = cached
+        await cls.bot.answer_inline_query(
+            query.id, results, cache_time=INLINE_CACHE_TIME,
+            is_personal=True, next_offset=next_offset
+        )
+
+
+Profiler.instrument(Sender)
@@ -0,0 +1 @@
+SELECT * FROM digest_subscription WHERE user_id = $1;
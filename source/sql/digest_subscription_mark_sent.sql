@@ -0,0 +1 @@
+UPDATE digest_subscription SET last_sent = $2 WHERE user_id = ANY($1::INTEGER[]);
@@ -0,0 +1,2 @@
+INSERT INTO digest_subscription (user_id, period) VALUES ($1, $2)
+ON CONFLICT (user_id) DO UPDATE SET period = EXCLUDED.period;
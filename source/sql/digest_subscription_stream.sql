@@ -0,0 +1,5 @@
+SELECT d.user_id, d.author_ids, d.sequence_ids, COALESCE(s.langs, 1) AS langs
+FROM digest_subscription d LEFT JOIN settings s ON s.user_id = d.user_id
+WHERE d.period = $1 AND (d.last_sent IS NULL OR d.last_sent < $2) AND d.user_id > $3
+ORDER BY d.user_id
+LIMIT $4;
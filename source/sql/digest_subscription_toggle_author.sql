@@ -0,0 +1,7 @@
+INSERT INTO digest_subscription (user_id, period, author_ids) VALUES ($1, 'w', ARRAY[$2::INTEGER])
+ON CONFLICT (user_id) DO UPDATE SET
+    period = COALESCE(digest_subscription.period, 'w'),
+    author_ids = CASE WHEN $2 = ANY(digest_subscription.author_ids)
+        THEN array_remove(digest_subscription.author_ids, $2)
+        ELSE array_append(digest_subscription.author_ids, $2) END
+RETURNING $2 = ANY(author_ids) AS following, period;
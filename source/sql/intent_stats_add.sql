@@ -0,0 +1,3 @@
+INSERT INTO intent_stats (period_start, intent, count, errors, buckets) VALUES ($1, cast($2 AS VARCHAR), $3, $4, $5)
+ON CONFLICT (period_start, intent) DO UPDATE SET count = intent_stats.count + EXCLUDED.count, errors = intent_stats.errors + EXCLUDED.errors,
+    buckets = (SELECT array_agg(a + b ORDER BY i) FROM unnest(intent_stats.buckets, EXCLUDED.buckets) WITH ORDINALITY AS t(a, b, i));
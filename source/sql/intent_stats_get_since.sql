@@ -0,0 +1 @@
+SELECT intent, count, errors, buckets FROM intent_stats WHERE period_start >= $1;
\ No newline at end of file
@@ -0,0 +1,29 @@
+CREATE TABLE IF NOT EXISTS telegram_user
+(
+    user_id INTEGER NOT NULL
+        CONSTRAINT user_pkey PRIMARY KEY,
+    first_name VARCHAR(64) NOT NULL,
+    last_name VARCHAR(64),
+    username VARCHAR(32)
+);
+ALTER TABLE telegram_user OWNER TO {owner};
+
+CREATE TABLE IF NOT EXISTS settings
+(
+    user_id INTEGER NOT NULL PRIMARY KEY
+        CONSTRAINT setting_user_pkey REFERENCES telegram_user,
+    allow_ru BOOLEAN NOT NULL,
+    allow_be BOOLEAN NOT NULL,
+    allow_uk BOOLEAN NOT NULL,
+    beta_testing BOOLEAN NOT NULL DEFAULT FALSE
+);
+ALTER TABLE settings OWNER TO {owner};
+
+CREATE TABLE IF NOT EXISTS posted_book 
+(
+    book_id INTEGER NOT NULL,
+    file_type VARCHAR(4) NOT NULL,
+    file_id VARCHAR(128) NOT NULL,
+    PRIMARY KEY (book_id, file_type)
+);
+ALTER TABLE posted_book OWNER TO {owner};
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS intent_stats
+(
+    period_start TIMESTAMP NOT NULL,
+    intent VARCHAR(64) NOT NULL,
+    count INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    buckets INTEGER[] NOT NULL,
+    PRIMARY KEY (period_start, intent)
+);
+ALTER TABLE intent_stats OWNER TO {owner};
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS series_job
+(
+    id SERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    message_id INTEGER NOT NULL,
+    book_ids INTEGER[] NOT NULL,
+    file_types VARCHAR[] NOT NULL
+);
+ALTER TABLE series_job OWNER TO {owner};
@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS digest_subscription
+(
+    user_id INTEGER NOT NULL PRIMARY KEY
+        CONSTRAINT digest_subscription_user_fkey REFERENCES telegram_user,
+    period VARCHAR(1),
+    author_ids INTEGER[] NOT NULL DEFAULT '{{}}',
+    sequence_ids INTEGER[] NOT NULL DEFAULT '{{}}',
+    last_sent DATE
+);
+ALTER TABLE digest_subscription OWNER TO {owner};
+
+CREATE INDEX IF NOT EXISTS digest_subscription_period_user_id_idx
+    ON digest_subscription (period, user_id) WHERE period IS NOT NULL;
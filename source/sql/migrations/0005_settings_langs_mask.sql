@@ -0,0 +1,9 @@
+-- bits follow LANG_BITS in langs.py: ru, be, uk
+ALTER TABLE settings ADD COLUMN IF NOT EXISTS langs BIGINT NOT NULL DEFAULT 1;
+
+UPDATE settings
+SET langs = (CASE WHEN allow_ru THEN 1 ELSE 0 END)
+          | (CASE WHEN allow_be THEN 2 ELSE 0 END)
+          | (CASE WHEN allow_uk THEN 4 ELSE 0 END);
+
+ALTER TABLE settings DROP COLUMN allow_ru, DROP COLUMN allow_be, DROP COLUMN allow_uk;
@@ -0,0 +1 @@
+SELECT DISTINCT book_id FROM posted_book WHERE book_id > $1 ORDER BY book_id LIMIT $2;
\ No newline at end of file
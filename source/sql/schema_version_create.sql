@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS schema_version
+(
+    version INTEGER NOT NULL PRIMARY KEY,
+    applied_at TIMESTAMP NOT NULL DEFAULT now()
+);
+ALTER TABLE schema_version OWNER TO {owner};
@@ -0,0 +1 @@
+SELECT coalesce(max(version), 0) AS version FROM schema_version;
\ No newline at end of file
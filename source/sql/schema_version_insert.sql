@@ -0,0 +1 @@
+INSERT INTO schema_version (version) VALUES ($1) ON CONFLICT (version) DO NOTHING;
\ No newline at end of file
@@ -0,0 +1 @@
+INSERT INTO series_job (chat_id, message_id, book_ids, file_types) VALUES ($1, $2, $3, $4);
\ No newline at end of file
@@ -0,0 +1 @@
+DELETE FROM series_job WHERE (chat_id % $1 + $1) % $1 = $2 RETURNING chat_id, message_id, book_ids, file_types;
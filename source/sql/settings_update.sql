@@ -1,2 +1,2 @@
-INSERT INTO settings (user_id, allow_ru, allow_be, allow_uk, beta_testing) VALUES ($1, $2, $3, $4, $5)
-ON CONFLICT (user_id) DO UPDATE SET allow_ru = EXCLUDED.allow_ru, allow_be = EXCLUDED.allow_be, allow_uk = EXCLUDED.allow_uk, beta_testing = EXCLUDED.beta_testing;
\ No newline at end of file
+INSERT INTO settings (user_id, langs, beta_testing) VALUES ($1, $2, $3)
+ON CONFLICT (user_id) DO UPDATE SET langs = EXCLUDED.langs, beta_testing = EXCLUDED.beta_testing;
\ No newline at end of file
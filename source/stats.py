@@ -0,0 +1,115 @@
+import asyncio
+import bisect
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from db import IntentStatsDB
+
+
+# upper bounds of latency buckets, ms; the last bucket is unbounded
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class IntentStats:
+    __slots__ = ("count", "errors", "buckets")
+
+    def __init__(self, count: int = 0, errors: int = 0, buckets: Optional[List[int]] = None):
+        self.count = count
+        self.errors = errors
+        self.buckets = list(buckets) if buckets else [0] * (len(BUCKETS) + 1)
+
+    def record(self, latency_ms: float, error: bool):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.buckets[bisect.bisect_left(BUCKETS, latency_ms)] += 1
+
+    def merge(self, other: "IntentStats"):
+        self.count += other.count
+        self.errors += other.errors
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, q: float) -> Optional[int]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, value in enumerate(self.buckets):
+            total += value
+            if total >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else None
+        return None
+
+
+class Stats:
+    FLUSH_INTERVAL = 60
+
+    window: Dict[str, IntentStats] = {}
+    task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def record(cls, intent: str, latency_ms: float, error: bool = False):
+        stats = cls.window.get(intent)
+        if stats is None:
+            stats = cls.window[intent] = IntentStats()
+        stats.record(latency_ms, error)
+
+    @classmethod
+    def start(cls):
+        cls.task = asyncio.create_task(cls._flush_loop())
+
+    @classmethod
+    async def stop(cls):
+        if cls.task is not None:
+            cls.task.cancel()
+        await cls.flush()
+
+    @classmethod
+    async def flush(cls):
+        window, cls.window = cls.window, {}
+        period_start = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        for intent, stats in window.items():
+            try:
+                await IntentStatsDB.add(period_start, intent, stats.count, stats.errors, stats.buckets)
+            except Exception as e:
+                logging.warning(f"Stats: failed to persist {intent}: {e!r}")
+                existing = cls.window.setdefault(intent, IntentStats())
+                existing.merge(stats)
+
+    @classmethod
+    async def _flush_loop(cls):
+        while True:
+            await asyncio.sleep(cls.FLUSH_INTERVAL)
+            await cls.flush()
+
+    @classmethod
+    async def summary(cls, hours: int) -> Dict[str, IntentStats]:
+        result: Dict[str, IntentStats] = {}
+        since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+        for row in await IntentStatsDB.get_since(since):
+            result.setdefault(row["intent"], IntentStats()).merge(
+                IntentStats(row["count"], row["errors"], row["buckets"])
+            )
+        for intent, stats in cls.window.items():
+            result.setdefault(intent, IntentStats()).merge(stats)
+        return result
+
+
+def format_ms(value: Optional[int]) -> str:
+    return f"≤{value}" if value is not None else f">{BUCKETS[-1]}"
+
+
+async def render_summary(hours: int = 24, top: int = 15) -> str:
+    summary = await Stats.summary(hours)
+    if not summary:
+        return f"Нет данных за {hours} ч."
+
+    total = sum(s.count for s in summary.values())
+    errors = sum(s.errors for s in summary.values())
+    res = f"<b>Статистика за {hours} ч.</b>\nЗапросов: {total}, ошибок: {errors}\n\n"
+    res += "<code>intent: count (errors) p50/p95/p99 ms</code>\n"
+    for intent, s in sorted(summary.items(), key=lambda x: x[1].count, reverse=True)[:top]:
+        res += (f"<code>{intent}: {s.count} ({s.errors}) "
+                f"{format_ms(s.percentile(0.5))}/{format_ms(s.percentile(0.95))}/{format_ms(s.percentile(0.99))}</code>\n")
+    return res
@@ -18,6 +18,7 @@ commands_msg = """
 Команды:
 /random_author - получить случайного автора
 /random_series - получить случайную серию
+/digest - рассылка новых книг
 """
 info_msg = """
 В связи с блокировкой обсуждения во Вконтакте были созданы:
@@ -46,3 +47,11 @@ donate_msg = (
 )
 cache_removed = "Файл обновлен!"
 share = "Поделиться"
+digest_msg = (
+    "Рассылка новых книг на языках из /settings: {period}.\n"
+    "Авторов в подписке: {authors}, серий: {series}. "
+    "Подписаться на автора или серию можно кнопкой 🔔 в списке их книг, "
+    "тогда в рассылке будут только их новинки."
+)
+digest_periods = {"d": "каждый день", "w": "раз в неделю", None: "выключена"}
+offline_note = "⚠️ Сервер книг недоступен, данные от {date} могут быть устаревшими."
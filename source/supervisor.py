@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from config import Config
+from metrics import merge_expositions
+
+
+def get_chat_id(update: dict) -> int:
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    callback_query = update.get("callback_query")
+    if callback_query is not None:
+        message = callback_query.get("message")
+        return message["chat"]["id"] if message else callback_query["from"]["id"]
+    for key in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        if key in update:
+            return update[key]["from"]["id"]
+    return update.get("update_id", 0)
+
+
+class Supervisor:
+    """
+    Receives webhooks on SERVER_PORT and forwards every update to one of WORKERS processes.
+
+    Updates are routed by chat id, so all updates of a chat are handled by the same process.
+    Workers are plain bot processes started with WORKER_ID; they share nothing but the database.
+    """
+
+    RESTART_DELAY = 1
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.processes: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.monitor_task: Optional[asyncio.Task] = None
+        self.running = True
+
+    @staticmethod
+    def worker_url(worker_id: int, path: str = "/") -> str:
+        return f"http://127.0.0.1:{Config.WORKER_BASE_PORT + worker_id}{path}"
+
+    async def spawn(self, worker_id: int):
+        env = dict(os.environ, WORKER_ID=str(worker_id))
+        self.processes[worker_id] = await asyncio.create_subprocess_exec(sys.executable, sys.argv[0], env=env)
+
+    async def monitor(self):
+        while self.running:
+            for worker_id, process in enumerate(self.processes):
+                if process is not None and process.returncode is not None:
+                    logging.warning(f"Worker {worker_id} exited with {process.returncode}, restarting")
+                    await self.spawn(worker_id)
+            await asyncio.sleep(self.RESTART_DELAY)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        worker_id = get_chat_id(json.loads(body)) % self.workers
+        try:
+            async with self.session.post(self.worker_url(worker_id), data=body,
+                                         headers={"Content-Type": "application/json"}) as response:
+                return web.Response(body=await response.read(), status=response.status,
+                                    content_type=response.content_type)
+        except aiohttp.ClientError:
+            # let Telegram redeliver the update later
+            return web.Response(status=502)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        async def fetch(worker_id: int) -> str:
+            try:
+                async with self.session.get(self.worker_url(worker_id, "/metrics")) as response:
+                    return await response.text()
+            except aiohttp.ClientError:
+                return ""
+
+        texts = await asyncio.gather(*(fetch(i) for i in range(self.workers)))
+        expositions: Dict[str, str] = {str(i): text for i, text in enumerate(texts)}
+        return web.Response(text=merge_expositions(expositions, "worker"),
+                            content_type="text/plain", charset="utf-8")
+
+    async def on_startup(self, app: web.Application):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        for worker_id in range(self.workers):
+            await self.spawn(worker_id)
+        self.monitor_task = asyncio.create_task(self.monitor())
+        bot = Bot(token=Config.BOT_TOKEN)
+        await bot.set_webhook(Config.WEBHOOK_HOST + "/")
+        await (await bot.get_session()).close()
+
+    async def on_shutdown(self, app: web.Application):
+        self.running = False
+        self.monitor_task.cancel()
+        bot = Bot(token=Config.BOT_TOKEN)
+        await bot.delete_webhook()
+        await (await bot.get_session()).close()
+        for process in self.processes:
+            if process is not None and process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*(p.wait() for p in self.processes if p is not None))
+        await self.session.close()
+
+    def run(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle_update)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        web.run_app(app, host=Config.SERVER_HOST, port=int(Config.SERVER_PORT))
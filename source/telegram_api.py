@@ -0,0 +1,136 @@
+import time
+from contextlib import contextmanager
+from typing import Optional, Union
+
+from aiogram import Bot, exceptions, types
+from aiogram.bot import api
+from aiogram.dispatcher.webhook import SendMessage
+from aiogram.types.base import TelegramObject
+
+from config import Config
+from metrics import TELEGRAM_LATENCY, TELEGRAM_RETRY_AFTER, WEBHOOK_REPLIES
+from tracing import span
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+Markup = Union[str, TelegramObject, None]
+
+
+@contextmanager
+def instrument(method: str):
+    started_at = time.monotonic()
+    try:
+        with span("telegram", method):
+            yield
+    except exceptions.RetryAfter:
+        TELEGRAM_RETRY_AFTER.inc(method=method)
+        raise
+    finally:
+        TELEGRAM_LATENCY.observe(time.monotonic() - started_at, method=method)
+
+
+class InstrumentedBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        with instrument(method):
+            return await super().request(method, data, files, **kwargs)
+
+
+class FastBot:
+    """
+    Raw JSON client for the hottest Bot API calls.
+
+    Bodies are built with ujson, markups may be passed already serialized (see send.get_keyboard)
+    and the response is only checked for errors, not turned into aiogram objects.
+    Errors are raised as the same aiogram exceptions as the Bot methods raise.
+    """
+    bot: Bot
+    token: str
+
+    HEADERS = {"Content-Type": "application/json"}
+
+    @classmethod
+    def configure(cls, bot: Bot, token: str):
+        cls.bot = bot
+        cls.token = token
+
+    @staticmethod
+    def make_body(payload: dict, reply_markup: Markup = None) -> str:
+        body = json.dumps({key: value for key, value in payload.items() if value is not None}, ensure_ascii=False)
+        if reply_markup is None:
+            return body
+        if not isinstance(reply_markup, str):
+            reply_markup = json.dumps(reply_markup.to_python(), ensure_ascii=False)
+        return f'{body[:-1]},"reply_markup":{reply_markup}}}'
+
+    @classmethod
+    async def request(cls, method: str, body: str) -> None:
+        session = await cls.bot.get_session()
+        with instrument(method):
+            async with session.post(
+                cls.bot.server.api_url(cls.token, method), data=body.encode(),
+                headers=cls.HEADERS, proxy=cls.bot.proxy, timeout=cls.bot.timeout
+            ) as response:
+                # read the body anyway, unread responses are not returned to the keep-alive pool
+                body = await response.read()
+                if response.status == 200:
+                    return
+                api.check_result(method, response.content_type, response.status, body.decode())
+
+    @classmethod
+    async def send_message(
+        cls, chat_id: int, text: str, parse_mode: Optional[str] = None,
+        reply_to_message_id: Optional[int] = None, allow_sending_without_reply: Optional[bool] = None,
+        reply_markup: Markup = None
+    ) -> None:
+        await cls.request("sendMessage", cls.make_body({
+            "chat_id": chat_id, "text": text, "parse_mode": parse_mode,
+            "reply_to_message_id": reply_to_message_id,
+            "allow_sending_without_reply": allow_sending_without_reply
+        }, reply_markup))
+
+    @classmethod
+    async def edit_message_text(
+        cls, text: str, chat_id: int, message_id: int, parse_mode: Optional[str] = None,
+        reply_markup: Markup = None
+    ) -> None:
+        await cls.request("editMessageText", cls.make_body({
+            "chat_id": chat_id, "message_id": message_id, "text": text, "parse_mode": parse_mode
+        }, reply_markup))
+
+    @classmethod
+    async def send_document(
+        cls, chat_id: int, file_id: str, caption: Optional[str] = None, parse_mode: Optional[str] = None,
+        reply_to_message_id: Optional[int] = None, allow_sending_without_reply: Optional[bool] = None,
+        reply_markup: Markup = None
+    ) -> None:
+        await cls.request("sendDocument", cls.make_body({
+            "chat_id": chat_id, "document": file_id, "caption": caption, "parse_mode": parse_mode,
+            "reply_to_message_id": reply_to_message_id,
+            "allow_sending_without_reply": allow_sending_without_reply
+        }, reply_markup))
+
+    @classmethod
+    async def copy_message(
+        cls, chat_id: int, from_chat_id: int, message_id: int, reply_markup: Markup = None
+    ) -> None:
+        await cls.request("copyMessage", cls.make_body({
+            "chat_id": chat_id, "from_chat_id": from_chat_id, "message_id": message_id
+        }, reply_markup))
+
+
+async def webhook_reply(msg: types.Message, text: str, **kwargs) -> Optional[SendMessage]:
+    """
+    Replies to `msg` with the webhook response instead of a separate sendMessage call.
+
+    Only for handlers that send exactly one message: the handler has to return the result,
+    and nothing can be sent after it as the reply goes out when the handler is done.
+    """
+    if not Config.WEBHOOK_REPLIES:
+        await msg.reply(text, **kwargs)
+        return None
+    WEBHOOK_REPLIES.inc(method="sendMessage")
+    return SendMessage(msg.chat.id, text, reply_to_message_id=msg.message_id, **kwargs)
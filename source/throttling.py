@@ -0,0 +1,48 @@
+import time
+from typing import Dict, List
+
+
+class RateLimiter:
+    """Token bucket per key: `capacity` requests at once, refilled with `rate` requests per second."""
+
+    PRUNE_SIZE = 10_000
+
+    def __init__(self, name: str, capacity: float, rate: float):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.buckets: Dict[int, List[float]] = {}
+
+    def _refill(self, key: int, now: float) -> List[float]:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.PRUNE_SIZE:
+                self.prune(now)
+            bucket = self.buckets[key] = [self.capacity, now]
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    def allow(self, key: int) -> bool:
+        bucket = self._refill(key, time.monotonic())
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def retry_after(self, key: int) -> float:
+        bucket = self._refill(key, time.monotonic())
+        return max(0.0, (1 - bucket[0]) / self.rate)
+
+    def prune(self, now: float):
+        # buckets that are full again carry no information
+        full_after = self.capacity / self.rate
+        self.buckets = {k: b for k, b in self.buckets.items() if now - b[1] < full_after}
+
+
+LIMITERS: Dict[str, RateLimiter] = {
+    "download": RateLimiter("download", capacity=10, rate=1 / 6),
+    "search": RateLimiter("search", capacity=30, rate=1),
+    "series": RateLimiter("series", capacity=2, rate=1 / 300),
+}
@@ -0,0 +1,126 @@
+import asyncio
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import List, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+class Trace:
+    __slots__ = ("id", "name", "parent_id", "started_at", "wall_time", "spans")
+
+    def __init__(self, name: str, parent_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent_id = parent_id
+        self.started_at = time.monotonic()
+        self.wall_time = time.time()
+        self.spans: List[list] = []
+
+    def to_json(self, duration: float) -> str:
+        return json.dumps({
+            "trace_id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "time": self.wall_time,
+            "duration_ms": round(duration * 1000, 2),
+            "spans": [{"kind": kind, "name": name, "start_ms": round(start * 1000, 2),
+                       "duration_ms": round(duration * 1000, 2), "error": error}
+                      for kind, name, start, duration, error in self.spans]
+        }, ensure_ascii=False)
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def span(kind: str, name: str):
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started_at = time.monotonic()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.spans.append([kind, name, started_at - trace.started_at, time.monotonic() - started_at, error])
+
+
+class Tracer:
+    enabled = False
+    sample_rate = 1.0
+    slow_threshold = 1.0
+    path = "traces.jsonl"
+
+    @classmethod
+    def configure(cls, path: Optional[str], slow_threshold: float, sample_rate: float):
+        cls.enabled = bool(path) and sample_rate > 0
+        cls.path = path
+        cls.slow_threshold = slow_threshold
+        cls.sample_rate = sample_rate
+
+    @classmethod
+    def start(cls, name: str, parent: Optional[Trace] = None) -> Tuple[Optional[Trace], Token]:
+        """Makes a new trace, None when it is not sampled, the current one until `finish` gets the token."""
+        trace = None
+        if cls.enabled and (cls.sample_rate >= 1 or random.random() < cls.sample_rate):
+            trace = Trace(name, parent.id if parent else None)
+        return trace, current_trace.set(trace)
+
+    @classmethod
+    def finish(cls, trace: Optional[Trace], token: Token):
+        current_trace.reset(token)
+        if trace is None:
+            return
+        duration = time.monotonic() - trace.started_at
+        if duration >= cls.slow_threshold:
+            asyncio.get_running_loop().run_in_executor(None, cls._write, trace.to_json(duration))
+
+    @classmethod
+    def _write(cls, line: str):
+        with open(cls.path, "a") as f:
+            f.write(line + "\n")
+
+    @classmethod
+    async def run(cls, coro, name: str):
+        # background tasks get their own trace, linked to the update that started them
+        trace, token = cls.start(name, current_trace.get())
+        try:
+            return await coro
+        finally:
+            cls.finish(trace, token)
+
+
+def update_name(update: types.Update) -> str:
+    if update.message and update.message.text:
+        # free text is a search query, only commands name the trace
+        if not update.message.text.startswith("/"):
+            return "message:text"
+        return "message:" + update.message.text.split(" ", 1)[0].split("_", 1)[0].split("@", 1)[0][:32]
+    if update.callback_query and update.callback_query.data:
+        return "callback:" + update.callback_query.data.split("_", 1)[0][:32]
+    if update.inline_query:
+        return "inline_query"
+    return "update"
+
+
+class TracingMiddleware(BaseMiddleware):
+    # updates are root traces: a worker of the update queue handles many unrelated updates in one context
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["trace"] = Tracer.start(update_name(update))
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        Tracer.finish(*data["trace"])
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+from flibusta_server import UpdateLogAPI
+from langs import ALL_LANGS, DEFAULT_LANGS, LangSet
+from metrics import cache_lookup
+
+
+RangeKey = Tuple[date, date, LangSet]
+
+
+def update_log_ranges(today: date) -> Dict[str, Tuple[date, date]]:
+    """Date ranges offered by /update_log, by the type used in the callback data."""
+    end_date = today - timedelta(days=1)
+    return {
+        "d": (end_date, end_date),
+        "t": (end_date - timedelta(days=2), end_date),
+        "w": (end_date - timedelta(days=6), end_date),
+        "m": (end_date - timedelta(days=30), end_date),
+    }
+
+
+def seconds_until_tomorrow() -> float:
+    now = datetime.now()
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (tomorrow - now).total_seconds()
+
+
+class UpdateLogCache:
+    """
+    Rendered update log pages of the current /update_log ranges, built in the background
+    once a day for every language set in use.
+
+    Language sets start with the defaults, others are added on their first miss.
+    Pages past MAX_PAGES and buttons from previous days are served from the backend.
+    """
+    DEFAULT_LANG_SETS: List[LangSet] = [ALL_LANGS, DEFAULT_LANGS]
+    MAX_LANG_SETS = 32
+    MAX_PAGES = 100
+    FETCH_PAGES = 10  # pages per backend request
+    ROLLOVER_DELAY = 60
+
+    page_size: int = 7
+    day: Optional[date] = None
+    ranges: Set[Tuple[date, date]] = set()
+    pages: Dict[RangeKey, Tuple[int, List[str]]] = {}
+    lang_sets: Set[LangSet] = set()
+    pending: Set[LangSet] = set()
+    queue: Optional["asyncio.Queue[LangSet]"] = None
+    task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def start(cls, page_size: int):
+        cls.page_size = page_size
+        cls.lang_sets = set(cls.DEFAULT_LANG_SETS)
+        cls.queue = asyncio.Queue()
+        cls.task = asyncio.create_task(cls._run())
+
+    @classmethod
+    async def stop(cls):
+        if cls.task is not None:
+            cls.task.cancel()
+            await asyncio.gather(cls.task, return_exceptions=True)
+            cls.task = None
+
+    @classmethod
+    def get(cls, start_date: date, end_date: date, lang_set: LangSet, page: int) -> Optional[Tuple[int, str]]:
+        """Returns the total books count and the rendered page, None when it should be fetched."""
+        item = cls.pages.get((start_date, end_date, lang_set))
+        cache_lookup("update_log", item is not None and (item[0] == 0 or 1 <= page <= len(item[1])))
+        if item is None:
+            if (start_date, end_date) in cls.ranges and lang_set not in cls.lang_sets \
+                    and len(cls.lang_sets) < cls.MAX_LANG_SETS:
+                cls.lang_sets.add(lang_set)
+                cls._schedule(lang_set)
+            return None
+        count, pages = item
+        if count == 0:
+            return 0, ""
+        if not 1 <= page <= len(pages):
+            return None
+        return count, pages[page - 1]
+
+    @classmethod
+    def _schedule(cls, lang_set: LangSet):
+        if cls.queue is not None and lang_set not in cls.pending:
+            cls.pending.add(lang_set)
+            cls.queue.put_nowait(lang_set)
+
+    @classmethod
+    def _rollover(cls, today: date):
+        cls.day = today
+        cls.ranges = set(update_log_ranges(today).values())
+        cls.pages = {key: value for key, value in cls.pages.items() if key[:2] in cls.ranges}
+        for lang_set in cls.lang_sets:
+            cls._schedule(lang_set)
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            if cls.day != date.today():
+                cls._rollover(date.today())
+            try:
+                lang_set = await asyncio.wait_for(cls.queue.get(), seconds_until_tomorrow() + cls.ROLLOVER_DELAY)
+            except asyncio.TimeoutError:
+                continue
+            cls.pending.discard(lang_set)
+            for start_date, end_date in update_log_ranges(cls.day).values():
+                try:
+                    await cls._build(start_date, end_date, lang_set)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.warning(f"Update log {start_date} - {end_date} {lang_set} not built: {e!r}")
+
+    @classmethod
+    async def _build(cls, start_date: date, end_date: date, lang_set: LangSet):
+        limit = cls.page_size * cls.FETCH_PAGES
+        count = 0
+        pages: List[str] = []
+        request_page = 1
+        while len(pages) < cls.MAX_PAGES:
+            update_log = await UpdateLogAPI.get_by_day(start_date, end_date, lang_set, limit, request_page)
+            if update_log is None:
+                logging.warning(f"Update log {start_date} - {end_date} {lang_set} not built: backend error")
+                return
+            count = update_log.count
+            books = update_log.books
+            for i in range(0, len(books), cls.page_size):
+                pages.append('\n\n\n'.join(book.to_send_book for book in books[i:i + cls.page_size]))
+            if len(books) < limit or request_page * limit >= count:
+                break
+            request_page += 1
+        cls.pages[(start_date, end_date, lang_set)] = (count, pages[:cls.MAX_PAGES])
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+from metrics import UPDATE_QUEUE_DEPTH, UPDATE_QUEUE_WAIT, UPDATE_QUEUE_REJECTED
+
+
+QueueItem = Tuple[int, types.Update, float]
+
+
+def get_update_chat_id(update: types.Update) -> int:
+    for message in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+        if message:
+            return message.chat.id
+    if update.callback_query:
+        query = update.callback_query
+        return query.message.chat.id if query.message else query.from_user.id
+    for obj in (update.chosen_inline_result, update.shipping_query, update.pre_checkout_query):
+        if obj:
+            return obj.from_user.id
+    # inline queries need no order: each keystroke supersedes the previous query, so they run
+    # concurrently and the handler's debounce can drop the stale ones
+    return update.update_id
+
+
+class UpdateQueue:
+    """
+    Bounded queue of updates processed by a pool of workers.
+
+    Updates of one chat are never processed concurrently and keep their order: while a chat
+    is handled by a worker its next updates wait in `pending` and are processed by the same worker.
+    """
+
+    max_size: int = 1000
+    size = 0
+
+    process: Callable[[types.Update], Awaitable]
+    queue: Optional["asyncio.Queue[QueueItem]"] = None
+    pending: Dict[int, Deque[QueueItem]] = {}
+    workers: List[asyncio.Task] = []
+
+    @classmethod
+    def start(cls, process: Callable[[types.Update], Awaitable], workers: int, max_size: int):
+        cls.process = process
+        cls.max_size = max_size
+        cls.queue = asyncio.Queue()
+        cls.workers = [asyncio.create_task(cls._worker()) for _ in range(workers)]
+
+    @classmethod
+    async def stop(cls, timeout: float):
+        started_at = time.monotonic()
+        while cls.size and time.monotonic() - started_at < timeout:
+            await asyncio.sleep(0.1)
+        if cls.size:
+            logging.warning(f"Update queue: {cls.size} updates left unprocessed")
+        for worker in cls.workers:
+            worker.cancel()
+        cls.workers = []
+
+    @classmethod
+    def put(cls, update: types.Update) -> bool:
+        if cls.queue is None or cls.size >= cls.max_size:
+            UPDATE_QUEUE_REJECTED.inc()
+            return False
+
+        cls.size += 1
+        UPDATE_QUEUE_DEPTH.set(cls.size)
+
+        chat_id = get_update_chat_id(update)
+        item = (chat_id, update, time.monotonic())
+        if chat_id in cls.pending:
+            cls.pending[chat_id].append(item)
+        else:
+            cls.pending[chat_id] = deque()
+            cls.queue.put_nowait(item)
+        return True
+
+    @classmethod
+    async def _process(cls, item: QueueItem):
+        _, update, enqueued_at = item
+        UPDATE_QUEUE_WAIT.observe(time.monotonic() - enqueued_at)
+        try:
+            await cls.process(update)
+        except Exception:
+            logging.exception(f"Update {update.update_id} failed")
+        finally:
+            cls.size -= 1
+            UPDATE_QUEUE_DEPTH.set(cls.size)
+
+    @classmethod
+    async def _worker(cls):
+        while True:
+            item = await cls.queue.get()
+            chat_id = item[0]
+            pending = cls.pending[chat_id]
+            try:
+                while item is not None:
+                    await cls._process(item)
+                    item = pending.popleft() if pending else None
+            finally:
+                del cls.pending[chat_id]
+
+
+class FastAckRequestHandler(WebhookRequestHandler):
+    """Acknowledges the webhook as soon as the update is queued."""
+
+    async def post(self):
+        self.validate_ip()
+        update = await self.parse_update(self.get_dispatcher().bot)
+        if not UpdateQueue.put(update):
+            # Telegram will redeliver it later
+            raise web.HTTPServiceUnavailable()
+        return web.json_response({"ok": True})
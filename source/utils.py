@@ -1,11 +1,12 @@
 from db import SettingsDB
+from langs import LangSet
 
 import asyncio
 from aiogram import types
 
 from functools import wraps
 import io
-from typing import List, Union
+from typing import Dict, Optional, Union
 
 
 def ignore(exceptions):
@@ -28,69 +29,123 @@ def ignore(exceptions):
     return ignore
 
 
-async def make_settings_lang_keyboard(user_id: int) -> types.InlineKeyboardMarkup:
-    settings = await SettingsDB.get(user_id)
-
-    keyboard = types.InlineKeyboardMarkup()
-
-    if not settings.allow_ru:
-        keyboard.row(types.InlineKeyboardButton("Русский: 🅾 выключен!", callback_data="ru_on"))
-    else:
-        keyboard.row(types.InlineKeyboardButton("Русский: ✅ включен!", callback_data="ru_off"))
-
-    if not settings.allow_uk:
-        keyboard.row(types.InlineKeyboardButton("Украинский: 🅾 выключен!", callback_data="uk_on"))
-    else:
-        keyboard.row(types.InlineKeyboardButton("Украинский: ✅ включен!", callback_data="uk_off"))
+# languages offered in /settings, every one of them must be in LANG_BITS
+LANGS = (("ru", "Русский"), ("uk", "Украинский"), ("be", "Белорусский"))
 
-    if not settings.allow_be:
-        keyboard.row(types.InlineKeyboardButton("Белорусский: 🅾 выключен!", callback_data="be_on"))
-    else:
-        keyboard.row(types.InlineKeyboardButton("Белорусский: ✅ включен!", callback_data="be_off"))
-        
-    keyboard.row(types.InlineKeyboardButton("⬅️ Назад", callback_data="settings_main"))
-
-    return keyboard
+# keyboards below do not depend on the request, they are built and serialized once,
+# aiogram sends string markups as is
 
 
-async def download_by_series_keyboard(series_id: int) -> types.InlineKeyboardMarkup:
+def _build_settings_lang_keyboard(allowed: LangSet) -> str:
     keyboard = types.InlineKeyboardMarkup()
 
-    for file_type in ["fb2", "fb2+zip", "epub", "mobi"]:
-        keyboard.row(types.InlineKeyboardButton(file_type, callback_data=f"download_c_{file_type}_{series_id}"))
+    for lang, name in LANGS:
+        if lang not in allowed:
+            keyboard.row(types.InlineKeyboardButton(f"{name}: 🅾 выключен!", callback_data=f"{lang}_on"))
+        else:
+            keyboard.row(types.InlineKeyboardButton(f"{name}: ✅ включен!", callback_data=f"{lang}_off"))
 
-    return keyboard
+    keyboard.row(types.InlineKeyboardButton("⬅️ Назад", callback_data="settings_main"))
 
+    return keyboard.as_json()
 
-async def beta_testing_keyboard(user_id: int) -> types.InlineKeyboardMarkup:
-    settings = await SettingsDB.get(user_id)
 
+def _build_beta_testing_keyboard(beta_testing: bool) -> str:
     keyboard = types.InlineKeyboardMarkup()
 
-    if settings.beta_testing:
+    if beta_testing:
         keyboard.row(types.InlineKeyboardButton("✅ Участвовать в бета тесте!", callback_data="_"))
     else:
         keyboard.row(types.InlineKeyboardButton("Участвовать в бета тесте!", callback_data="beta_test_on"))
 
-    if not settings.beta_testing:
+    if not beta_testing:
         keyboard.row(types.InlineKeyboardButton("✅ Не участвовать в бета тесте!", callback_data="_"))
     else:
         keyboard.row(types.InlineKeyboardButton("Не участвовать в бета тесте!", callback_data="beta_test_off"))
-        
+
     keyboard.row(types.InlineKeyboardButton("⬅️ Назад", callback_data="settings_main"))
 
-    return keyboard
+    return keyboard.as_json()
 
 
-async def make_settings_keyboard() -> types.InlineKeyboardMarkup:
+def _build_settings_keyboard() -> str:
     keyboard = types.InlineKeyboardMarkup()
 
     keyboard.row(types.InlineKeyboardButton("Языки", callback_data="langs_settings"))
     # keyboard.row(types.InlineKeyboardButton("Бета тест", callback_data="beta_testing"))
 
+    return keyboard.as_json()
+
+
+SERIES_ID_PLACEHOLDER = "{series_id}"
+
+
+def _build_download_by_series_keyboard() -> str:
+    keyboard = types.InlineKeyboardMarkup()
+
+    for file_type in ["fb2", "fb2+zip", "epub", "mobi"]:
+        keyboard.row(types.InlineKeyboardButton(
+            file_type, callback_data=f"download_c_{file_type}_{SERIES_ID_PLACEHOLDER}"
+        ))
+
+    return keyboard.as_json()
+
+
+def _build_search_keyboard() -> str:
+    keyboard = types.InlineKeyboardMarkup()
+
+    keyboard.row(
+        types.InlineKeyboardButton("По названию", callback_data="b_1")
+    )
+    keyboard.row(
+        types.InlineKeyboardButton("По авторам", callback_data="a_1"),
+        types.InlineKeyboardButton("По сериям", callback_data="s_1")
+    )
+
+    return keyboard.as_json()
+
+
+def _build_digest_keyboard(period: Optional[str]) -> str:
+    keyboard = types.InlineKeyboardMarkup()
+
+    for value, name in (("d", "Каждый день"), ("w", "Раз в неделю"), ("off", "Не присылать")):
+        checked = value == (period or "off")
+        keyboard.row(types.InlineKeyboardButton(("✅ " if checked else "") + name,
+                                                callback_data="_" if checked else f"digest_{value}"))
+
+    return keyboard.as_json()
+
+
+# built on first use, there is at most one keyboard per language set in use
+SETTINGS_LANG_KEYBOARDS: Dict[LangSet, str] = {}
+BETA_TESTING_KEYBOARDS = {beta_testing: _build_beta_testing_keyboard(beta_testing) for beta_testing in (True, False)}
+SETTINGS_KEYBOARD = _build_settings_keyboard()
+DOWNLOAD_BY_SERIES_KEYBOARD = _build_download_by_series_keyboard()
+SEARCH_KEYBOARD = _build_search_keyboard()
+DIGEST_KEYBOARDS = {period: _build_digest_keyboard(period) for period in ("d", "w", None)}
+
+
+async def make_settings_lang_keyboard(user_id: int) -> str:
+    langs = (await SettingsDB.get(user_id)).langs
+    keyboard = SETTINGS_LANG_KEYBOARDS.get(langs)
+    if keyboard is None:
+        keyboard = SETTINGS_LANG_KEYBOARDS[langs] = _build_settings_lang_keyboard(langs)
     return keyboard
 
 
+async def download_by_series_keyboard(series_id: int) -> str:
+    return DOWNLOAD_BY_SERIES_KEYBOARD.replace(SERIES_ID_PLACEHOLDER, str(series_id))
+
+
+async def beta_testing_keyboard(user_id: int) -> str:
+    settings = await SettingsDB.get(user_id)
+    return BETA_TESTING_KEYBOARDS[bool(settings.beta_testing)]
+
+
+async def make_settings_keyboard() -> str:
+    return SETTINGS_KEYBOARD
+
+
 class BytesResult(io.BytesIO):
     def __init__(self, content):
         super().__init__(content)
@@ -110,33 +165,3 @@ class BytesResult(io.BytesIO):
     @name.setter
     def name(self, value):
         self._name = value
-
-
-def split_text(text: str) -> List[str]:
-    parts = []
-    i = 0
-
-    while True:
-        if i + 2048 > len(text):
-            parts.append(text[i:len(text) + 1])
-            break
-        else:
-            new_i = max(
-                text.rfind(".", i, i + 2048),
-                text.rfind("!", i, i + 2048),
-                text.rfind("?", i, i + 2048),
-            )
-
-            if new_i == -1:
-                new_i = text.rfind("\n", i, i + 2048)
-            
-            if new_i == -1:
-                new_i = min(i + 2048, len(text))
-
-            if new_i == i or new_i == -1:
-                break
-
-            parts.append(text[i:new_i + 1])
-            i = new_i
-
-    return parts